@@ -0,0 +1,374 @@
+"""
+Benchmark suite for the parser, the detectors and the API endpoints
+
+Generates a synthetic log (see benchmarks/generate_logs.py) and times:
+  parser     NginxLogParser.parse_line and the ingest parse path
+  detectors  every detector and count in services/parser.py, plus the streaming
+             RowDetectors and hit materialization used by /analyse
+  endpoints  /upload and /analyse, in process against the in-memory Elasticsearch
+             stand-in (ELASTIC_STUB=1) or, with --backend sqlite, the embedded SQLite
+             storage, with the backend's own aggregation cost reported separately as
+             storage.aggregate
+  startup    importing main and running its lifespan, each in a fresh interpreter,
+             i.e. a worker's cold start; the slowest imports are listed on stderr
+
+Each benchmark reports the best and median of --repeat runs and a rate in items per
+second. Results are written as JSON with the commit they were taken at; pass an
+earlier results file as --baseline to compare rates and flag regressions.
+
+Usage (from the api directory):
+    python -m benchmarks.bench_suite --lines 100000 --output bench.json
+    python -m benchmarks.bench_suite --lines 100000 --baseline bench.json --output bench-new.json
+    python -m benchmarks.bench_suite --suites parser,detectors --lines 1000000
+    python -m benchmarks.bench_suite --suites endpoints --backend sqlite
+    python -m benchmarks.bench_suite --suites startup --repeat 5
+"""
+
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generate_logs import LogProfile, generate_lines, profile_arguments, profile_from_args
+
+SUITES = ('parser', 'detectors', 'endpoints', 'startup')
+
+BACKENDS = ('elasticsearch', 'sqlite')
+
+# Rates that fall by more than this fraction against the baseline are reported as regressions
+DEFAULT_THRESHOLD = 0.10
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(['git', *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summarize(times: List[float], items: int, unit: str) -> Dict[str, Any]:
+    best = min(times)
+    return {
+        'seconds': best,
+        'median_seconds': statistics.median(times),
+        'items': items,
+        'unit': unit,
+        'rate': items / best if best > 0 else None,
+    }
+
+
+def measure(func: Callable[[], Any], items: int, repeat: int, unit: str = 'lines') -> Dict[str, Any]:
+    """Time func repeat times"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return _summarize(times, items, unit)
+
+
+async def measure_async(func: Callable[[], Any], items: int, repeat: int, unit: str = 'lines', setup: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
+    """Time a coroutine function repeat times, running setup (untimed) before each run"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        await func()
+        times.append(time.perf_counter() - start)
+    return _summarize(times, items, unit)
+
+
+def _documents(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Parsed entries in the shape they are stored in Elasticsearch"""
+    return [
+        {key: value.isoformat() if isinstance(value, datetime) else value for key, value in entry.items()}
+        for entry in entries
+    ]
+
+
+def bench_parser(lines: List[str], repeat: int) -> Dict[str, Dict[str, Any]]:
+    from services.log_parser import NginxLogParser
+    from services.dedup import LineKeys
+    from services.ingest import parse_new_lines
+
+    parser = NginxLogParser()
+    results = {
+        'parser.parse_line': measure(lambda: [parser.parse_line(line) for line in lines], len(lines), repeat),
+        'ingest.parse_new_lines': measure(lambda: parse_new_lines(parser, LineKeys(), lines), len(lines), repeat),
+    }
+
+    stage_totals = dict.fromkeys(NginxLogParser.PARSE_STAGES, 0.0)
+    for line in lines:
+        parser.parse_line_timed(line, stage_totals)
+    for stage, seconds in stage_totals.items():
+        results[f"parser.stage.{stage}"] = _summarize([seconds], len(lines), 'lines')
+    return results
+
+
+def bench_detectors(entries: List[Dict[str, Any]], repeat: int) -> Dict[str, Dict[str, Any]]:
+    from services import parser as detectors
+    from services.retrieval import DEFAULT_BATCH_SIZE, to_log_records
+    from services.row_detectors import RowDetectors
+
+    documents = _documents(entries)
+    logs = to_log_records(documents)
+    count = len(logs)
+
+    results = {'retrieval.to_log_records': measure(lambda: to_log_records(documents), count, repeat)}
+
+    per_log = {
+        'check_blacklist_occurance': detectors.check_blacklist_occurance,
+        'count_requests_by_ip': detectors.count_requests_by_ip,
+        'count_user_agents': detectors.count_user_agents,
+        'detect_high_frequency_ips': detectors.detect_high_frequency_ips,
+        'detect_suspicious_user_agents': detectors.detect_suspicious_user_agents,
+        'detect_sensitive_endpoint_access': detectors.detect_sensitive_endpoint_access,
+        'detect_burst_requests': detectors.detect_burst_requests,
+        'detect_attack_signatures': detectors.detect_attack_signatures,
+        'count_status_codes': detectors.count_status_codes,
+        'count_http_methods': detectors.count_http_methods,
+        'count_most_accessed_paths': detectors.count_most_accessed_paths,
+        'calculate_requests_per_minute': detectors.calculate_requests_per_minute,
+        'analyze_error_paths': detectors.analyze_error_paths,
+        'analyze_bot_vs_human_traffic': detectors.analyze_bot_vs_human_traffic,
+        'generate_map_markers': detectors.generate_map_markers,
+    }
+    outputs = {}
+    for name, detector in per_log.items():
+        outputs[name] = detector(logs)
+        results[f"detector.{name}"] = measure(lambda: detector(logs), count, repeat)
+
+    insights_args = (
+        outputs['check_blacklist_occurance'],
+        outputs['count_requests_by_ip'],
+        outputs['detect_high_frequency_ips'],
+        outputs['detect_suspicious_user_agents'],
+        outputs['detect_sensitive_endpoint_access'],
+        outputs['detect_burst_requests'],
+        outputs['count_user_agents'],
+        outputs['count_status_codes'],
+        outputs['count_http_methods'],
+        outputs['calculate_requests_per_minute'],
+        outputs['analyze_error_paths'],
+        outputs['count_most_accessed_paths'],
+        outputs['detect_attack_signatures'],
+    )
+    results['detector.generate_insights'] = measure(lambda: detectors.generate_insights(*insights_args), count, repeat)
+
+    def streaming():
+        row_detectors = RowDetectors()
+        for i in range(0, count, DEFAULT_BATCH_SIZE):
+            row_detectors.feed(logs[i:i + DEFAULT_BATCH_SIZE])
+        return row_detectors.results()
+    results['detector.row_detectors'] = measure(streaming, count, repeat)
+    return results
+
+
+def _prepare_environment(data_dir: str, backend: str) -> None:
+    # Services read their settings at import, so this runs before any of them are imported.
+    # Set ELASTIC_STUB=0 (and ELASTIC_URL) to benchmark the endpoints against a real cluster.
+    os.environ['STORAGE_BACKEND'] = backend
+    os.environ.setdefault('SQLITE_PATH', os.path.join(data_dir, 'bench.sqlite3'))
+    os.environ.setdefault('ELASTIC_STUB', '1')
+    os.environ.setdefault('GEMINI_STUB', '1')
+    os.environ.setdefault('ELASTIC_URL', 'http://localhost:9200')
+    os.environ.setdefault('ELASTIC_INDEX', 'bench-logs')
+    os.environ.setdefault('DEDUP_ENABLED', '0')
+    os.environ.setdefault('INGEST_JOBS_DIR', os.path.join(data_dir, 'jobs'))
+
+
+async def _bench_endpoints(body: bytes, lines: int, repeat: int) -> Dict[str, Dict[str, Any]]:
+    import httpx
+    import main
+    from services.cache import result_cache
+    from services.elastic import aes
+    from services.storage import storage
+
+    transport = httpx.ASGITransport(app=main.app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        async def upload():
+            response = await client.post('/upload', params={'wait': 'true', 'filename': 'bench.log'}, content=body)
+            response.raise_for_status()
+
+        def reset_store():
+            # The SQLite backend isn't reset: documents have content-derived IDs, so
+            # repeated uploads replace the same rows
+            if hasattr(aes, 'indices_docs'):
+                aes.indices_docs.clear()
+
+        results['endpoint.upload'] = await measure_async(upload, lines, repeat, setup=reset_store)
+
+        query = {'match_all': {}}
+
+        async def analyse(compact: bool = False):
+            response = await client.post('/analyse', params={'compact': 'true'} if compact else None, json=query)
+            response.raise_for_status()
+
+        results['endpoint.analyse'] = await measure_async(analyse, lines, repeat, setup=result_cache.clear)
+        results['endpoint.analyse_compact'] = await measure_async(lambda: analyse(True), lines, repeat, setup=result_cache.clear)
+        await analyse()
+        results['endpoint.analyse_cached'] = await measure_async(analyse, lines, repeat)
+
+        results['storage.aggregate'] = await measure_async(lambda: storage.aggregate(query), lines, repeat)
+    await storage.close()
+    return results
+
+
+def bench_endpoints(lines: List[str], repeat: int) -> Dict[str, Dict[str, Any]]:
+    return asyncio.run(_bench_endpoints(''.join(lines).encode('utf-8'), len(lines), repeat))
+
+
+# Run in a fresh interpreter: prints the seconds to import main and to finish its lifespan startup
+_STARTUP_SCRIPT = """
+import asyncio, json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def ready():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+
+print(json.dumps({'import': imported - start, 'ready': asyncio.run(ready()) - start}))
+"""
+
+# Slowest imports (cumulative) listed from the -X importtime run
+IMPORT_REPORT_MODULES = 15
+
+
+def _import_report(api_dir: str) -> List[str]:
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=api_dir, capture_output=True, text=True).stderr
+    modules = []
+    for line in output.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            modules.append((int(parts[1]), parts[2].strip()))
+    modules.sort(reverse=True)
+    return [f"{microseconds / 1000:>8.1f} ms  {name}" for microseconds, name in modules[:IMPORT_REPORT_MODULES]]
+
+
+def bench_startup(repeat: int) -> Dict[str, Dict[str, Any]]:
+    api_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    imports, ready, process = [], [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], cwd=api_dir, capture_output=True, text=True, check=True).stdout
+        process.append(time.perf_counter() - start)
+        timings = json.loads(output.strip().splitlines()[-1])
+        imports.append(timings['import'])
+        ready.append(timings['ready'])
+    print("Slowest imports of main:", *_import_report(api_dir), sep='\n  ', file=sys.stderr)
+    return {
+        'startup.import_main': _summarize(imports, 1, 'starts'),
+        'startup.ready': _summarize(ready, 1, 'starts'),
+        'startup.process': _summarize(process, 1, 'starts'),
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """
+    Print rate changes against a baseline run
+
+    Returns:
+        List[str]: Names of the benchmarks whose rate fell by more than threshold
+    """
+    regressions = []
+    print(f"\n{'benchmark':<45} {'baseline':>14} {'current':>14} {'change':>8}")
+    for name, result in results.items():
+        before = baseline.get(name, {}).get('rate')
+        after = result.get('rate')
+        if not before or not after:
+            continue
+        change = after / before - 1
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<45} {before:>14,.0f} {after:>14,.0f} {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark the parser, detectors and API endpoints on synthetic logs')
+    arg_parser.add_argument('--suites', default=','.join(SUITES), help=f"Comma-separated subset of {', '.join(SUITES)}")
+    arg_parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark; the best is reported')
+    arg_parser.add_argument('--output', help='Write results as JSON to this file')
+    arg_parser.add_argument('--baseline', help='Earlier results file to compare against')
+    arg_parser.add_argument('--backend', choices=BACKENDS, default='elasticsearch', help='Storage backend for the endpoints suite')
+    arg_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Rate drop reported as a regression')
+    profile_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    suites = [suite.strip() for suite in args.suites.split(',') if suite.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        arg_parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+    data_dir = tempfile.TemporaryDirectory()
+    _prepare_environment(data_dir.name, args.backend)
+
+    profile: LogProfile = profile_from_args(args)
+    lines: List[str] = []
+    if set(suites) - {'startup'}:
+        start = time.perf_counter()
+        lines = list(generate_lines(profile))
+        print(f"Generated {len(lines):,} lines in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    if 'parser' in suites:
+        results.update(bench_parser(lines, args.repeat))
+    if 'detectors' in suites:
+        from services.log_parser import NginxLogParser
+        parser = NginxLogParser()
+        entries = [entry for entry in (parser.parse_line(line) for line in lines) if entry]
+        results.update(bench_detectors(entries, args.repeat))
+    if 'endpoints' in suites:
+        results.update(bench_endpoints(lines, args.repeat))
+    if 'startup' in suites:
+        results.update(bench_startup(args.repeat))
+
+    for name, result in results.items():
+        print(f"{name:<45} {result['seconds'] * 1000:>10.1f} ms {result['rate'] or 0:>14,.0f} {result['unit']}/s")
+
+    report = {
+        'meta': {
+            'commit': _git('rev-parse', 'HEAD'),
+            'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat,
+            'suites': suites,
+            'backend': args.backend,
+            'profile': asdict(profile),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('profile') != report['meta']['profile']:
+            print("Warning: the baseline was run with a different log profile", file=sys.stderr)
+        if compare(results, baseline.get('results', {}), args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
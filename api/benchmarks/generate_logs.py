@@ -0,0 +1,304 @@
+"""
+Synthetic nginx access log generator
+
+Produces deterministic combined-format logs at any scale: the same profile and seed
+always give byte-identical output. IPs, user agents and paths are drawn from pools
+of configurable size with a Zipf-like skew, so a few clients and pages dominate as
+they do in real traffic. Bots, attack requests, sensitive endpoint probes, errors
+and request bursts are mixed in at configurable rates.
+
+Usage (from the api directory):
+    python -m benchmarks.generate_logs --lines 1000000 --output /tmp/access.log
+    python -m benchmarks.generate_logs --lines 100000000 --output /tmp/access.log.gz --ips 500000
+"""
+
+from dataclasses import dataclass, fields
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Iterator, List, Optional, Sequence
+import argparse
+import gzip
+import random
+import sys
+
+# Lines drawn from the pools at a time; keeps random.choices calls amortized
+BLOCK_SIZE = 10000
+
+BROWSERS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{v}.1 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_{v} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148",
+    "Mozilla/5.0 (Linux; Android 14; Pixel {v}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36",
+]
+
+BOTS = [
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)",
+    "Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)",
+    "Mozilla/5.0 (compatible; YandexBot/3.0; +http://yandex.com/bots)",
+    "Mozilla/5.0 (compatible; SemrushBot/7~bl; +http://www.semrush.com/bot.html)",
+    "facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)",
+]
+
+# Clients that detect_suspicious_user_agents flags without "bot" in the name
+TOOLS = [
+    "curl/8.4.0",
+    "python-requests/2.31.0",
+    "Wget/1.21.4",
+    "Apache-HttpClient/4.5.14 (Java/17.0.8)",
+    "sqlmap/1.7.2#stable (https://sqlmap.org)",
+    "Mozilla/5.00 (Nikto/2.5.0) (Evasions:None) (Test:000001)",
+]
+
+SECTIONS = ["products", "blog", "category", "docs", "users", "search", "cart", "static/js", "static/css", "images"]
+EXTENSIONS = ["", "", "", ".html", ".js", ".css", ".png", ".jpg"]
+
+SENSITIVE_PATHS = [
+    "/admin", "/admin/login", "/login", "/wp-admin/", "/wp-login.php", "/phpmyadmin/index.php",
+    "/config.json", "/.env", "/.git/config", "/backup.zip", "/api/v1/users", "/debug/vars", "/console",
+]
+
+ATTACK_PATHS = [
+    "/products?id=1%27%20OR%20%271%27=%271",
+    "/search?q=1+UNION+SELECT+username,password+FROM+users--",
+    "/item.php?id=5%20AND%20SLEEP(5)",
+    "/index.php?page=../../../../etc/passwd",
+    "/download?file=..%2f..%2f..%2fetc%2fshadow",
+    "/static/%2e%2e/%2e%2e/proc/self/environ",
+    "/search?q=%3Cscript%3Ealert(document.cookie)%3C/script%3E",
+    "/comment?text=%3Cimg%20src=x%20onerror=alert(1)%3E",
+    "/cgi-bin/luci/;stok=/locale",
+    "/vendor/phpunit/phpunit/src/Util/PHP/eval-stdin.php",
+    "/wp-config.php.bak",
+    "/actuator/env",
+    "/server-status",
+    "/solr/admin/info/system",
+]
+
+METHODS = ["GET"] * 85 + ["POST"] * 12 + ["HEAD"] * 2 + ["PUT"]
+ERROR_STATUSES = [404] * 6 + [403] * 2 + [500, 502, 503]
+REDIRECT_STATUSES = [301, 302, 304]
+REFERERS = ["-", "-", "-", "https://www.google.com/", "https://example.com/", "https://example.com/products"]
+
+
+@dataclass
+class LogProfile:
+    """Shape of the generated traffic"""
+    lines: int = 10000
+    seed: int = 0
+    ips: int = 1000
+    user_agents: int = 200
+    paths: int = 500
+    skew: float = 1.1
+    bot_ratio: float = 0.2
+    tool_ratio: float = 0.02
+    attack_ratio: float = 0.01
+    sensitive_ratio: float = 0.01
+    error_ratio: float = 0.05
+    redirect_ratio: float = 0.05
+    bursts: int = 10
+    burst_size: int = 50
+    requests_per_second: float = 20.0
+    start: str = "2024-01-01T00:00:00"
+
+
+def _zipf_weights(count: int, skew: float) -> List[float]:
+    return list(accumulate(1.0 / (rank ** skew) for rank in range(1, count + 1)))
+
+
+def _ip_pool(rng: random.Random, count: int) -> List[str]:
+    # A list alongside the set keeps the order independent of string hashing
+    ips: List[str] = []
+    seen = set()
+    while len(ips) < count:
+        ip = f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        if ip not in seen:
+            seen.add(ip)
+            ips.append(ip)
+    return ips
+
+
+def _user_agent_pool(rng: random.Random, count: int) -> List[str]:
+    agents = []
+    for i in range(count):
+        template = BROWSERS[i % len(BROWSERS)]
+        agents.append(template.format(v=60 + (i // len(BROWSERS)) % 70) + ("" if i < len(BROWSERS) * 70 else f" build/{i}"))
+    rng.shuffle(agents)
+    return agents
+
+
+def _path_pool(rng: random.Random, count: int) -> List[str]:
+    paths = ["/", "/index.html", "/favicon.ico", "/robots.txt"]
+    while len(paths) < count:
+        section = rng.choice(SECTIONS)
+        path = f"/{section}/{rng.randint(1, count * 10)}{rng.choice(EXTENSIONS)}"
+        if rng.random() < 0.15:
+            path += f"?page={rng.randint(1, 20)}"
+        paths.append(path)
+    return paths[:count]
+
+
+class LogGenerator:
+    """
+    Generates log lines for a profile. Timestamps advance by exponentially distributed
+    gaps averaging 1 / requests_per_second; bursts are a single IP sending burst_size
+    requests a fraction of a second apart, enough for detect_burst_requests to fire.
+    """
+
+    def __init__(self, profile: LogProfile):
+        self.profile = profile
+        self.rng = random.Random(profile.seed)
+        self.ips = _ip_pool(self.rng, profile.ips)
+        self.agents = _user_agent_pool(self.rng, profile.user_agents)
+        self.paths = _path_pool(self.rng, profile.paths)
+        self.ip_weights = _zipf_weights(len(self.ips), profile.skew)
+        self.agent_weights = _zipf_weights(len(self.agents), profile.skew)
+        self.path_weights = _zipf_weights(len(self.paths), profile.skew)
+        self.time = datetime.fromisoformat(profile.start)
+        self._formatted_second: Optional[datetime] = None
+        self._formatted = ""
+        bursts = min(profile.bursts, max(0, profile.lines // max(1, profile.burst_size * 2)))
+        self.burst_starts = sorted(self.rng.sample(range(profile.lines), bursts)) if bursts else []
+
+    def _time_local(self) -> str:
+        second = self.time.replace(microsecond=0)
+        if second != self._formatted_second:
+            self._formatted_second = second
+            self._formatted = second.strftime("%d/%b/%Y:%H:%M:%S +0000")
+        return self._formatted
+
+    def _line(self, ip: str, method: str, path: str, status: int, agent: str) -> str:
+        size = self.rng.randint(200, 60000) if status < 300 else self.rng.randint(0, 2000)
+        referer = REFERERS[self.rng.randrange(len(REFERERS))]
+        return f'{ip} - - [{self._time_local()}] "{method} {path} HTTP/1.1" {status} {size} "{referer}" "{agent}"\n'
+
+    def _status(self, roll: float) -> int:
+        profile = self.profile
+        if roll < profile.error_ratio:
+            return ERROR_STATUSES[self.rng.randrange(len(ERROR_STATUSES))]
+        if roll < profile.error_ratio + profile.redirect_ratio:
+            return REDIRECT_STATUSES[self.rng.randrange(len(REDIRECT_STATUSES))]
+        return 200
+
+    def _burst(self, count: int) -> Iterator[str]:
+        ip = self.ips[self.rng.randrange(len(self.ips))]
+        agent = TOOLS[self.rng.randrange(len(TOOLS))]
+        for _ in range(count):
+            self.time += timedelta(seconds=self.rng.uniform(0.01, 0.5))
+            yield self._line(ip, "GET", self.paths[self.rng.randrange(len(self.paths))], 200, agent)
+
+    def lines(self) -> Iterator[str]:
+        """Yield every log line, newline-terminated"""
+        profile = self.profile
+        rng = self.rng
+        mean_gap = 1.0 / profile.requests_per_second
+        bursts = iter(self.burst_starts)
+        next_burst = next(bursts, None)
+        produced = 0
+        while produced < profile.lines:
+            block = min(BLOCK_SIZE, profile.lines - produced)
+            ips = rng.choices(self.ips, cum_weights=self.ip_weights, k=block)
+            agents = rng.choices(self.agents, cum_weights=self.agent_weights, k=block)
+            paths = rng.choices(self.paths, cum_weights=self.path_weights, k=block)
+            for ip, agent, path in zip(ips, agents, paths):
+                if produced >= profile.lines:
+                    return
+                if next_burst is not None and produced >= next_burst:
+                    count = min(profile.burst_size, profile.lines - produced)
+                    yield from self._burst(count)
+                    produced += count
+                    next_burst = next(bursts, None)
+                    continue
+
+                self.time += timedelta(seconds=rng.expovariate(1.0) * mean_gap)
+                roll = rng.random()
+                if roll < profile.bot_ratio:
+                    agent = BOTS[rng.randrange(len(BOTS))]
+                elif roll < profile.bot_ratio + profile.tool_ratio:
+                    agent = TOOLS[rng.randrange(len(TOOLS))]
+
+                status = self._status(rng.random())
+                roll = rng.random()
+                if roll < profile.attack_ratio:
+                    path = ATTACK_PATHS[rng.randrange(len(ATTACK_PATHS))]
+                    status = 403 if rng.random() < 0.5 else 404
+                elif roll < profile.attack_ratio + profile.sensitive_ratio:
+                    path = SENSITIVE_PATHS[rng.randrange(len(SENSITIVE_PATHS))]
+                    status = 401 if rng.random() < 0.5 else 404
+
+                yield self._line(ip, METHODS[rng.randrange(len(METHODS))], path, status, agent)
+                produced += 1
+
+
+def generate_lines(profile: LogProfile) -> Iterator[str]:
+    """Yield the log lines for a profile"""
+    return LogGenerator(profile).lines()
+
+
+def write_log(profile: LogProfile, path: Optional[str] = None) -> int:
+    """
+    Write a generated log to a file (gzip-compressed if the name ends in .gz) or stdout
+
+    Returns:
+        int: Bytes written before compression
+    """
+    written = 0
+    if path is None:
+        out = sys.stdout
+    elif path.endswith('.gz'):
+        out = gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+    else:
+        out = open(path, 'w', encoding='utf-8')
+    try:
+        buffer: List[str] = []
+        for line in generate_lines(profile):
+            buffer.append(line)
+            if len(buffer) >= BLOCK_SIZE:
+                chunk = ''.join(buffer)
+                out.write(chunk)
+                written += len(chunk)
+                buffer = []
+        chunk = ''.join(buffer)
+        out.write(chunk)
+        written += len(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return written
+
+
+def profile_arguments(arg_parser: argparse.ArgumentParser, skip: Sequence[str] = ()) -> None:
+    """Add a --flag for every LogProfile field"""
+    defaults = LogProfile()
+    for field in fields(LogProfile):
+        if field.name in skip:
+            continue
+        arg_parser.add_argument(
+            f"--{field.name.replace('_', '-')}",
+            type=type(getattr(defaults, field.name)),
+            default=getattr(defaults, field.name),
+            help=f"default: {getattr(defaults, field.name)}"
+        )
+
+
+def profile_from_args(args: argparse.Namespace, **overrides) -> LogProfile:
+    values = {field.name: getattr(args, field.name) for field in fields(LogProfile) if hasattr(args, field.name)}
+    values.update(overrides)
+    return LogProfile(**values)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Generate a synthetic nginx access log')
+    arg_parser.add_argument('--output', help='File to write (.gz to compress); stdout if omitted')
+    profile_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    profile = profile_from_args(args)
+    written = write_log(profile, args.output)
+    if args.output:
+        print(f"Wrote {profile.lines:,} lines ({written:,} bytes) to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
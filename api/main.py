@@ -1,17 +1,91 @@
-import os
-import uuid
+import asyncio
+import hashlib
+import json
+import math
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from typing import Dict, Any
-from services.elastic import es, es_index
-from services.log_parser import NginxLogParser
-from model.log import  LogEntry
-from services.parser import check_blacklist_occurance, count_requests_by_ip, detect_high_frequency_ips, detect_suspicious_user_agents, detect_sensitive_endpoint_access, detect_burst_requests, count_user_agents, generate_insights, count_status_codes, count_http_methods, calculate_requests_per_minute, analyze_error_paths, count_most_accessed_paths, generate_map_markers, analyze_bot_vs_human_traffic
-from services.gemini import gemini_model
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from typing import Dict, Any, List, Optional
+from services.storage import storage
+from services.archive import ARCHIVE_ON_EXPIRE, archive
+from services.indices import ELASTIC_RETENTION_DAYS
+from services.analysis import run_analysis
+from services.fanout import SITES, SITE_TIMEOUT, resolve_sites, run_fleet_analysis, site_backend
+from services.admission import Overloaded, analysis_admission, upload_gate
+from services.cache import result_cache, analysis_cache_key, bump_index_generation
+from services.response import FastJSONResponse, compact_result, DEFAULT_SECTION_LIMIT
+from services.summary import request_summary, get_summary, wait_for_summary
+from services.gemini import get_gemini_model
+from services.parser import load_blacklist, load_ip_cache
+from services.concurrency import run_cpu, run_ingest_cpu
+from services.features import feature_store
+from services.ingest import ingest_stream, iter_multipart_file
+from services.jobs import JobManager
+from services.s3 import S3_BUCKET_NAME
+from services.s3_ingest import S3IngestManager
+from services.dedup import dedup_for
+from services.live import live_state
+from services.metrics import CallbackMetric, MetricsMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from services.profiling import TimingMiddleware, current_timings, profile_path, profile_text, profiling_authorized
+from collections import Counter
 
-app = FastAPI()
+# Background ingest jobs; cached /analyse results are invalidated as they index
+job_manager = JobManager(storage, storage.index)
+job_manager.on_indexed = bump_index_generation
+
+# Background ingests of S3 prefixes
+s3_ingest_manager = S3IngestManager(storage, storage.index)
+s3_ingest_manager.on_indexed = bump_index_generation
+
+CallbackMetric(
+    "danphobic_ingest_jobs",
+    "Ingest jobs by status; queued is the ingest queue depth",
+    "gauge",
+    lambda: [({'status': status}, count) for status, count in Counter(job.status for job in job_manager.jobs.values()).items()]
+)
+
+async def expire_storage(retention_days: int):
+    # With ARCHIVE_ON_EXPIRE=1, days are copied to the cold-tier archive before they are dropped
+    if ARCHIVE_ON_EXPIRE and retention_days > 0:
+        await archive.archive(storage, retention_days)
+    expired = await storage.expire(retention_days)
+    # Expired days are dropped from the dedup record, so their logs can be ingested again
+    await dedup_for(storage)
+    archive_expired = await archive.expire()
+    if expired["expired"] or expired["rollups_expired"] or archive_expired["expired"]:
+        bump_index_generation()
+    return expired
+
+async def prepare_storage():
+    try:
+        await storage.setup()
+        await expire_storage(ELASTIC_RETENTION_DAYS)
+    except Exception as e:
+        print(f"Error preparing indices: {str(e)}")
+
+async def prewarm():
+    # Data files and heavy clients are loaded on worker threads at startup rather than by the first request
+    for name, result in zip(
+        ("blacklist", "geo index", "gemini"),
+        await asyncio.gather(run_cpu(load_blacklist), run_cpu(load_ip_cache), run_cpu(get_gemini_model), return_exceptions=True)
+    ):
+        if isinstance(result, Exception):
+            print(f"Error loading {name}: {str(result)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.gather(prepare_storage(), prewarm())
+    await job_manager.start()
+    await s3_ingest_manager.start()
+    yield
+    await s3_ingest_manager.stop()
+    await job_manager.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -22,154 +96,336 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Compress large JSON responses such as /analyse
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Server-Timing breakdowns and profiles for requests sent with ?timing=1 / ?profile=1
+# (or the X-Debug-Timing / X-Debug-Profile headers), when REQUEST_PROFILING_ENABLED=1
+app.add_middleware(TimingMiddleware)
+
+# Per-route latency for /metrics
+app.add_middleware(MetricsMiddleware)
+
+def _overloaded_error(e: Overloaded) -> HTTPException:
+    """A 503 telling the client when to retry a request that wasn't admitted"""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+
 @app.post("/analyse")
-async def analyse_logs(query: Dict[str, Any] = Body(...)):
+async def analyse_logs(
+    query: Dict[str, Any] = Body(...),
+    compact: bool = False,
+    limit: int = Query(DEFAULT_SECTION_LIMIT, ge=1),
+    tier: str = Query("hot", pattern="^(hot|archive)$"),
+    sites: Optional[List[str]] = Query(None),
+    indices: Optional[List[str]] = Query(None),
+    site_timeout: float = Query(SITE_TIMEOUT, gt=0),
+    mode: str = Query("auto", pattern="^(auto|full|approximate)$"),
+    cache: bool = True
+):
+    # ?sites= (names from SITES, or * for all) and ?indices= analyse several sites at once
     try:
-        log_search = es.search(index=es_index, query=query, size=100)
-        
-        if not log_search.get("hits", {}).get("hits"):
-            return {"message": "No logs found", "logs": []}
+        targets = resolve_sites(sites, indices)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown site or index {e.args[0]}")
 
-        logs = []
-        for hit in log_search["hits"]["hits"]:
+    try:
+        # tier=archive runs the analysis over the cold-tier archive instead of the hot backend
+        backend = archive if tier == "archive" else storage
+        if targets:
+            # Sites are queried concurrently and their results merged; slow or failing sites are left out
+            backends = [site_backend(backend, index) for index in targets.values()]
+            compute = lambda max_rows: run_fleet_analysis(query, targets, backend, site_timeout, max_rows)
+        else:
+            backends = [backend]
+            compute = lambda max_rows: run_analysis(query, backend, max_rows)
+        cache_key = analysis_cache_key(query, tier=tier, sites=targets)
+        # Timed requests read the cache like any other unless they also send ?cache=0
+        timings = current_timings()
+        bypass_cache = timings is not None and not cache
+        admission = None
+        if not bypass_cache and mode != "approximate" and result_cache.ready(cache_key):
+            # Cached and in-flight results cost nothing more, so they skip admission
+            result = await result_cache.get_or_compute(cache_key, lambda: compute(None))
+        else:
+            # Analyses are admitted by estimated cost. ?mode=full never runs approximately
+            # (and may be turned away under load); ?mode=approximate always does.
+            admission = await analysis_admission.admit(query, backends, mode)
             try:
-                log_entry = LogEntry(**hit["_source"])
-                logs.append(log_entry)
-            except Exception as e:
-                print(f"Error converting log entry: {str(e)}")
-                continue
-
-        # Checks
-        blacklist_occurance = check_blacklist_occurance(logs) # Array of blacklisted IPs
-        request_counts = count_requests_by_ip(logs) # Dictionary of IP addresses and their request counts
-        high_frequency_ips = detect_high_frequency_ips(logs) # Dictionary of IP addresses and their request counts
-        suspicious_user_agents = detect_suspicious_user_agents(logs) # Dictionary of IP addresses and their request counts
-        sensitive_endpoint_access = detect_sensitive_endpoint_access(logs) # Dictionary of IP addresses and their request counts
-        burst_requests = detect_burst_requests(logs) # Dictionary of IP addresses and their request counts
-        user_agent_counts = count_user_agents(logs) # Dictionary of user agents and their request counts
-        status_counts = count_status_codes(logs) # Dictionary of status code categories and their counts
-        method_counts = count_http_methods(logs) # Dictionary of HTTP methods and their counts
-        requests_per_minute = calculate_requests_per_minute(logs) # List of (timestamp, count) tuples
-        error_paths = analyze_error_paths(logs) # Dictionary of paths and their error counts
-        path_counts = count_most_accessed_paths(logs) # Get all path counts
-        bot_vs_human_traffic = analyze_bot_vs_human_traffic(logs) # List of (timestamp, bot_count, human_count) tuples
-
-        # Generate insights including path analysis
-        insights = generate_insights(
-            blacklist_occurance,
-            request_counts,
-            high_frequency_ips,
-            suspicious_user_agents,
-            sensitive_endpoint_access,
-            burst_requests,
-            user_agent_counts,
-            status_counts,
-            method_counts,
-            requests_per_minute,
-            error_paths,
-            path_counts
-        )
+                if bypass_cache:
+                    timings.note("cache", "bypass")
+                    result = await compute(admission.max_rows)
+                else:
+                    # Identical queries against an unchanged index share one cached computation;
+                    # partial fleet results are shared with concurrent requests but not kept
+                    if admission.approximate:
+                        cache_key = analysis_cache_key(query, tier=tier, sites=targets, mode="approximate")
+                    result = await result_cache.get_or_compute(
+                        cache_key,
+                        lambda: compute(admission.max_rows),
+                        cacheable=lambda result: not result.get("partial")
+                    )
+            finally:
+                analysis_admission.release(admission)
+        if admission is not None and admission.approximate:
+            result = {**result, "approximate": admission.to_dict()}
+        if not result.get("total"):
+            return FastJSONResponse(result)
 
-        # print(f"Insights: {insights}")
-        # print(f"Status counts: {status_counts}")
-        # print(f"Method counts: {method_counts}")
-        # print(f"Requests per minute: {requests_per_minute[:5]}...")  # Print first 5 data points
-        # print(f"Error paths: {error_paths}")
-        # print(f"Path counts: {path_counts}")
-        print(f"Bot vs human traffic: {bot_vs_human_traffic}")
-
-        summary = gemini_model.generate_content(f"<instructions>The following are key insights from a group of Nginx logs. In the response, only provide a bulletpointed, formatted summary of the key insights. Only use one level of bullet points. Include at most 7 bullet points. Ensure they are informative. Only provide the bulletpoints, no other text.</instructions> <insights>Total number of logs: {len(logs)}. Key insights: {insights}</insights>")
-
-        map_markers = generate_map_markers(logs)
-
-        return {
-            "message": "Logs retrieved successfully",
-            "total": len(logs),
-            "logs": logs,
-            "blacklist_occurance": blacklist_occurance,
-            "request_counts": request_counts,
-            "high_frequency_ips": high_frequency_ips,
-            "suspicious_user_agents": suspicious_user_agents,
-            "sensitive_endpoint_access": sensitive_endpoint_access,
-            "burst_requests": burst_requests,
-            "user_agent_counts": user_agent_counts,
-            "status_counts": status_counts,
-            "method_counts": method_counts,
-            "requests_per_minute": requests_per_minute,
-            "error_paths": error_paths,
-            "path_counts": path_counts,
-            "insights": insights,
-            "summary": summary.text,
-            "map_markers": map_markers,
-            "bot_vs_human_traffic": bot_vs_human_traffic
-        }
+        if (admission is not None and admission.approximate) or analysis_admission.under_load():
+            # Under load the AI summary is skipped rather than queued behind the analyses
+            summary_id, summary = None, None
+            result = {**result, "summary_skipped": True}
+        else:
+            # The summary is generated in the background; clients fetch it from /summary/{summary_id}
+            summary_id, summary = request_summary(result["total"], result["insights"])
+        if compact:
+            # Detector results reference a shared entries table and large sections are truncated
+            result = await run_cpu(compact_result, result, limit)
+        return FastJSONResponse({**result, "summary": summary, "summary_id": summary_id})
 
+    except Overloaded as e:
+        raise _overloaded_error(e)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error retrieving logs: {str(e)}"
         )
 
+@app.get("/sites")
+async def list_sites():
+    return {"sites": SITES}
+
+@app.get("/summary/{summary_id}")
+async def get_analysis_summary(summary_id: str):
+    return get_summary(summary_id)
+
+@app.get("/summary/{summary_id}/stream")
+async def stream_analysis_summary(summary_id: str, timeout: float = 60.0):
+    async def events():
+        waited = 0.0
+        state = get_summary(summary_id)
+        while state["status"] == "pending" and waited < timeout:
+            # Keep proxies from closing the connection while the model is working
+            yield ": keepalive\n\n"
+            state = await wait_for_summary(summary_id, min(15.0, timeout - waited))
+            waited += 15.0
+        yield f"event: summary\ndata: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+# Live dashboard updates as logs are ingested. The first event is a snapshot of the live
+# window; later events carry only what changed. Updates are sent at most once per interval,
+# and a client that reads slowly gets fewer, larger deltas rather than a growing backlog.
+@app.get("/live/stream")
+async def stream_live_dashboard(interval: float = Query(1.0, ge=0.1, le=60.0)):
+    async def events():
+        subscriber = live_state.subscribe()
+        try:
+            while True:
+                if not await subscriber.wait(15.0):
+                    # Keep proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                delta = subscriber.next_delta()
+                if delta is not None:
+                    yield f"event: delta\ndata: {json.dumps(delta)}\n\n"
+                # Let rapid updates accumulate into the next delta
+                await asyncio.sleep(interval)
+        finally:
+            live_state.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+# Prometheus scrape endpoint: per-stage latency histograms, cache hit counts and queue depths
+@app.get("/metrics")
+async def get_metrics():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+# Saved per-request profiles: pstats binary by default (load with pstats or snakeviz),
+# or a text report with ?format=text
+@app.get("/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    format: str = Query("pstats", pattern="^(pstats|text)$"),
+    sort: str = "cumulative",
+    x_debug_token: Optional[str] = Header(None)
+):
+    # Profiles are only served to callers allowed to create them
+    path = profile_path(profile_id) if profiling_authorized(x_debug_token) else None
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No profile {profile_id}")
+    if format == "text":
+        try:
+            return PlainTextResponse(await run_cpu(profile_text, path, sort))
+        except KeyError:
+            raise HTTPException(status_code=400, detail=f"Unknown sort key {sort}")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+@app.get("/features/anomalies")
+async def get_feature_anomalies(std_dev_threshold: float = 2.0):
+    feature_store.evict_idle()
+    high_frequency_ips = feature_store.high_frequency_ips(std_dev_threshold)
+    return {
+        "tracked_ips": len(feature_store),
+        "high_frequency_ips": high_frequency_ips,
+        "scores": [feature_store.anomaly_score(ip) for ip in high_frequency_ips]
+    }
+
+@app.get("/features/{ip}")
+async def get_ip_features(ip: str):
+    features = feature_store.get(ip)
+    if features is None:
+        raise HTTPException(status_code=404, detail=f"No features tracked for {ip}")
+    return {
+        "ip": ip,
+        "features": features,
+        "score": feature_store.anomaly_score(ip)
+    }
+
+async def _upload_body(request: Request, filename: Optional[str]):
+    """
+    Return the uploaded filename and an async iterator over the file's bytes.
+    Accepts the dashboard's multipart form (field "file") or a raw body with ?filename=
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        parts = iter_multipart_file(request.stream(), content_type)
+        first = await anext(parts, None)
+        if first is None or not first[0]:
+            raise HTTPException(status_code=400, detail="No file provided")
+
+        async def chunks():
+            yield first[1]
+            async for _, data in parts:
+                yield data
+        return first[0], chunks()
+
+    if not filename:
+        raise HTTPException(status_code=400, detail="No file provided")
+    return filename, request.stream()
+
 @app.post("/upload")
-async def upload_log(file: UploadFile = File(...)):
+async def upload_log(request: Request, filename: Optional[str] = None, wait: bool = False):
     try:
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="No file provided")
+        filename, body = await _upload_body(request, filename)
 
-        # Save file temporarily
-        contents = await file.read()
-        filename = f"{uuid.uuid4()}_{file.filename}"
-        with open(filename, "wb") as f:
-            f.write(contents)
-
-        # Parse the file
-        parser = NginxLogParser()
-        parser.parse_file(filename)
-
-        # Process in chunks of 1000 records
-        chunk_size = 1000
-        total_indexed = 0
-        total_chunks = (len(parser.entries) + chunk_size - 1) // chunk_size
-
-        for chunk_idx in range(total_chunks):
-            start_idx = chunk_idx * chunk_size
-            end_idx = min((chunk_idx + 1) * chunk_size, len(parser.entries))
-            chunk_entries = parser.entries[start_idx:end_idx]
-
-            # Prepare bulk indexing operations for this chunk
-            bulk_operations = []
-            for i, entry in enumerate(chunk_entries):
-                doc_id = f"{filename}_{start_idx + i}"
-                # Add the index operation metadata
-                bulk_operations.append({"index": {"_index": es_index, "_id": doc_id}})
-                # Add the document
-                bulk_operations.append(entry)
-
-            # Perform bulk indexing for this chunk
-            if bulk_operations:
-                response = es.bulk(operations=bulk_operations)
-                if response.get("errors"):
-                    print(f"Some documents failed to index in chunk {chunk_idx + 1}:", response)
-                else:
-                    chunk_count = len(bulk_operations) // 2
-                    total_indexed += chunk_count
-                    print(f"Successfully indexed chunk {chunk_idx + 1}/{total_chunks} ({chunk_count} documents)")
+        if not wait:
+            # Spool the upload and hand it to the ingest workers; progress is at /jobs/{job_id}
+            job = await job_manager.submit(body, filename)
+            return JSONResponse({
+                "success": True,
+                "message": "Upload queued for ingest",
+                "data": {
+                    "job_id": job.id,
+                    "filename": job.filename,
+                    "status_url": f"/jobs/{job.id}"
+                }
+            }, status_code=202)
+
+        # The body is streamed straight into the parser, never buffered or written to disk
+        fingerprint = hashlib.sha256()
+
+        async def fingerprinted():
+            async for chunk in body:
+                fingerprint.update(chunk)
+                yield chunk
+
+        # Inline ingests beyond UPLOAD_CONCURRENCY wait for a slot, then are turned away
+        async with upload_gate.admit():
+            dedup = await dedup_for(storage)
+            stats = await ingest_stream(fingerprinted(), storage, storage.index, dedup=dedup)
+            if dedup is not None and not stats.lines_failed:
+                dedup.add_file(fingerprint.hexdigest(), filename, stats.lines_parsed, stats.days, stats.lines_skipped)
+                await run_ingest_cpu(dedup.save)
 
-        # Clean up local file
-        os.remove(filename)
+        # Cached /analyse results no longer reflect the index
+        if stats.lines_indexed:
+            bump_index_generation()
 
         return JSONResponse({
             "success": True,
             "message": "Upload successful",
             "data": {
                 "filename": filename,
-                "lines_indexed": total_indexed,
-                "total_chunks": total_chunks
+                "lines_indexed": stats.lines_indexed,
+                "lines_failed": stats.lines_failed,
+                "lines_skipped": stats.lines_skipped,
+                "total_chunks": stats.batches
             }
         })
 
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        raise _overloaded_error(e)
     except UnicodeDecodeError:
         raise HTTPException(status_code=400, detail="Invalid file format - must be text file")
     except Exception as e:
         print(f"Error uploading log: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/jobs")
+async def list_ingest_jobs():
+    return {"jobs": job_manager.list()}
+
+@app.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No ingest job {job_id}")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_ingest_job(job_id: str):
+    if not await job_manager.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Ingest job {job_id} is not queued or running")
+    return job_manager.get(job_id)
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_ingest_job(job_id: str):
+    if not await job_manager.resume(job_id):
+        raise HTTPException(status_code=409, detail=f"Ingest job {job_id} is not cancelled or failed")
+    return job_manager.get(job_id)
+
+@app.post("/ingest/s3")
+async def start_s3_ingest(prefix: str = Body(..., embed=True), bucket: Optional[str] = Body(None, embed=True)):
+    # Objects already ingested from this prefix with an unchanged ETag are skipped
+    bucket = bucket or S3_BUCKET_NAME
+    if not bucket:
+        raise HTTPException(status_code=400, detail="No bucket given and S3_BUCKET_NAME is not set")
+    ingest = await s3_ingest_manager.submit(bucket, prefix)
+    return JSONResponse({**s3_ingest_manager.get(ingest.id), "status_url": f"/ingest/s3/{ingest.id}"}, status_code=202)
+
+@app.get("/ingest/s3")
+async def list_s3_ingests():
+    return {"ingests": s3_ingest_manager.list()}
+
+@app.get("/ingest/s3/{ingest_id}")
+async def get_s3_ingest(ingest_id: str):
+    ingest = s3_ingest_manager.get(ingest_id)
+    if ingest is None:
+        raise HTTPException(status_code=404, detail=f"No S3 ingest {ingest_id}")
+    return ingest
+
+@app.post("/ingest/s3/{ingest_id}/cancel")
+async def cancel_s3_ingest(ingest_id: str):
+    if not s3_ingest_manager.cancel(ingest_id):
+        raise HTTPException(status_code=409, detail=f"S3 ingest {ingest_id} is not running")
+    return s3_ingest_manager.get(ingest_id)
+
+@app.post("/indices/expire")
+async def expire_old_indices(retention_days: int = Query(..., ge=1)):
+    return await expire_storage(retention_days)
+
+# Copy days older than older_than_days from the hot backend into the cold-tier archive,
+# where /analyse?tier=archive queries them. The hot copies stay until they are expired.
+@app.post("/archive")
+async def archive_old_logs(older_than_days: int = Query(..., ge=1)):
+    result = await archive.archive(storage, older_than_days)
+    if result["archived"]:
+        bump_index_generation()
+    return result
+
+@app.get("/archive")
+async def describe_archive():
+    return await archive.describe()
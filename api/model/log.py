@@ -1,4 +1,5 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from datetime import datetime
 from pydantic import BaseModel
 
 class LogQuery(BaseModel):
@@ -16,4 +17,87 @@ class LogEntry(BaseModel):
     datetime: str
     method: str
     path: str
-    protocol: str
\ No newline at end of file
+    protocol: str
+    attack_tags: Optional[List[str]] = None
+
+class LogRecord:
+    """
+    Compact, read-only view of a log entry for the analysis hot path.
+
+    Has the same fields as LogEntry plus timestamp, the datetime decoded once
+    when the record is built. Built without validation from documents this app
+    indexed itself; serializes to the same shape as LogEntry.
+    """
+
+    FIELDS = tuple(LogEntry.model_fields)
+
+    __slots__ = FIELDS + ('timestamp',)
+
+    def __init__(
+        self,
+        remote_addr: str,
+        remote_user: str,
+        time_local: str,
+        request: str,
+        status: int,
+        body_bytes_sent: int,
+        http_referer: str,
+        http_user_agent: str,
+        datetime: str,
+        method: str,
+        path: str,
+        protocol: str,
+        attack_tags: Optional[List[str]] = None,
+        timestamp: Optional["datetime"] = None
+    ):
+        self.remote_addr = remote_addr
+        self.remote_user = remote_user
+        self.time_local = time_local
+        self.request = request
+        self.status = status
+        self.body_bytes_sent = body_bytes_sent
+        self.http_referer = http_referer
+        self.http_user_agent = http_user_agent
+        self.datetime = datetime
+        self.method = method
+        self.path = path
+        self.protocol = protocol
+        self.attack_tags = attack_tags
+        self.timestamp = timestamp if timestamp is not None else _parse_datetime(datetime)
+
+    @classmethod
+    def from_source(cls, source: Dict[str, Any]) -> "LogRecord":
+        """Build a record from an indexed document's _source (raises KeyError if a field is missing)"""
+        # Assigns the slots directly, skipping __init__'s argument handling on the hot path
+        record = object.__new__(cls)
+        record.remote_addr = source['remote_addr']
+        record.remote_user = source['remote_user']
+        record.time_local = source['time_local']
+        record.request = source['request']
+        record.status = source['status']
+        record.body_bytes_sent = source['body_bytes_sent']
+        record.http_referer = source['http_referer']
+        record.http_user_agent = source['http_user_agent']
+        record.datetime = source['datetime']
+        record.method = source['method']
+        record.path = source['path']
+        record.protocol = source['protocol']
+        record.attack_tags = source.get('attack_tags')
+        record.timestamp = _parse_datetime(record.datetime)
+        return record
+
+    @classmethod
+    def from_entry(cls, entry: LogEntry) -> "LogRecord":
+        return cls(**{name: getattr(entry, name) for name in cls.FIELDS})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def __repr__(self) -> str:
+        return f"LogRecord({self.remote_addr} {self.datetime} {self.request!r} {self.status})"
+
+def _parse_datetime(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
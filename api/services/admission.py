@@ -0,0 +1,278 @@
+from typing import Any, Dict, List, Optional
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from services.storage import StorageBackend
+from services.concurrency import ANALYSIS_WORKERS, analysis_queue_depth
+from services.indices import query_time_range
+from services.metrics import ADMISSION_REQUESTS, ADMISSION_WAIT_SECONDS, CallbackMetric
+import asyncio
+import os
+import time
+
+# Concurrent /analyse computations. Heavy queries (see QueryCost) have their own, smaller
+# limit, so a few wide queries can't take every slot while dashboard queries wait.
+ANALYSE_CONCURRENCY = int(os.getenv("ANALYSE_CONCURRENCY", "4"))
+ANALYSE_HEAVY_CONCURRENCY = int(os.getenv("ANALYSE_HEAVY_CONCURRENCY", "1"))
+
+# Seconds a request may wait for a slot, and how many may wait, before it is turned away.
+# Heavy queries wait briefly, then run in approximate mode instead.
+ANALYSE_QUEUE_TIMEOUT = float(os.getenv("ANALYSE_QUEUE_TIMEOUT", "10"))
+ANALYSE_HEAVY_QUEUE_TIMEOUT = float(os.getenv("ANALYSE_HEAVY_QUEUE_TIMEOUT", "2"))
+ANALYSE_MAX_QUEUE = int(os.getenv("ANALYSE_MAX_QUEUE", "32"))
+
+# Cost estimates (a count per backend) running at once. They only start once the
+# interactive queue has room, so requests that would be shed never reach the backends.
+ANALYSE_ESTIMATE_CONCURRENCY = int(os.getenv("ANALYSE_ESTIMATE_CONCURRENCY", "4"))
+
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_QUEUE_TIMEOUT = float(os.getenv("UPLOAD_QUEUE_TIMEOUT", "30"))
+UPLOAD_MAX_QUEUE = int(os.getenv("UPLOAD_MAX_QUEUE", "16"))
+
+# A query is heavy when it matches ANALYSE_HEAVY_HITS logs, or spans more than
+# ANALYSE_HEAVY_SPAN_DAYS (or has no time bound) and matches a tenth of that
+ANALYSE_HEAVY_HITS = int(os.getenv("ANALYSE_HEAVY_HITS", "1000000"))
+ANALYSE_HEAVY_SPAN_DAYS = float(os.getenv("ANALYSE_HEAVY_SPAN_DAYS", "7"))
+
+# Logs the row-based detectors see in approximate mode; the aggregates stay exact
+ANALYSE_APPROXIMATE_ROWS = int(os.getenv("ANALYSE_APPROXIMATE_ROWS", "50000"))
+
+
+class Overloaded(Exception):
+    """No slot was free in time; the client should retry after retry_after seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """
+    Bounds how many requests of one kind run at once.
+
+    Requests past the limit wait in arrival order for up to queue_timeout seconds, and
+    at most max_queue of them wait; the rest are turned away with Overloaded at once.
+    """
+
+    def __init__(self, name: str, limit: int, queue_timeout: float, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+        self._wait_seconds = ADMISSION_WAIT_SECONDS.labels(name)
+        self._admitted = ADMISSION_REQUESTS.labels(name, 'admitted')
+        self._rejected = ADMISSION_REQUESTS.labels(name, 'rejected')
+        self._timeouts = ADMISSION_REQUESTS.labels(name, 'timeout')
+
+    @property
+    def saturated(self) -> bool:
+        return self.in_flight >= self.limit
+
+    def check(self, pending: int = 0) -> None:
+        """
+        Turn a request away now if the queue is full, before any work is done for it
+
+        Args:
+            pending: Requests on their way to this gate, counted as already waiting
+
+        Raises:
+            Overloaded: If the queue is full
+        """
+        if self._semaphore.locked() and self.waiting + pending >= self.max_queue:
+            self._rejected.inc()
+            raise Overloaded(f"Too many {self.name} requests waiting", self.queue_timeout)
+
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait for a slot
+
+        Raises:
+            Overloaded: If the queue is full or no slot came free within the timeout
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        self.check()
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self._timeouts.inc()
+            raise Overloaded(f"No {self.name} slot came free within {timeout:g}s", self.queue_timeout)
+        finally:
+            self.waiting -= 1
+            self._wait_seconds.observe(time.perf_counter() - start)
+        self.in_flight += 1
+        self._admitted.inc()
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def admit(self, timeout: Optional[float] = None):
+        await self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+@dataclass
+class QueryCost:
+    """What an analysis is expected to cost, from its hit count and time span"""
+    hits: int
+    span: Optional[timedelta]
+
+    @property
+    def heavy(self) -> bool:
+        if self.hits >= ANALYSE_HEAVY_HITS:
+            return True
+        wide = self.span is None or self.span > timedelta(days=ANALYSE_HEAVY_SPAN_DAYS)
+        return wide and self.hits >= ANALYSE_HEAVY_HITS // 10
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'span_seconds': self.span.total_seconds() if self.span is not None else None,
+            'heavy': self.heavy,
+        }
+
+
+async def estimate_cost(query: Dict[str, Any], backends: List[StorageBackend]) -> QueryCost:
+    """
+    Estimate an analysis' cost with a count on each backend it will run on
+
+    Args:
+        query: Elasticsearch query DSL
+        backends: The backends (one per site) the analysis reads
+    """
+    hits = sum(await asyncio.gather(*(backend.count(query) for backend in backends)))
+    start, end = query_time_range(query)
+    return QueryCost(hits, end - start if start is not None and end is not None else None)
+
+
+@dataclass
+class Admission:
+    """A slot held by an /analyse request, and how the analysis should run in it"""
+    gate: AdmissionGate
+    cost: Optional[QueryCost]
+    max_rows: Optional[int] = None
+    reason: Optional[str] = None
+
+    @property
+    def approximate(self) -> bool:
+        return self.max_rows is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'reason': self.reason,
+            'max_rows': self.max_rows,
+            'cost': self.cost.to_dict() if self.cost is not None else None,
+        }
+
+
+class AnalysisAdmission:
+    """
+    Admission for /analyse: cheap queries share the interactive gate, heavy ones queue at
+    the heavy gate. In auto mode a heavy query that can't get a heavy slot in time runs in
+    approximate mode on an interactive slot instead of failing: the aggregates are still
+    exact, and the row-based detectors stop after approximate_rows logs.
+    """
+
+    def __init__(
+        self,
+        interactive: AdmissionGate,
+        heavy: AdmissionGate,
+        estimate: AdmissionGate,
+        approximate_rows: int = ANALYSE_APPROXIMATE_ROWS
+    ):
+        self.interactive = interactive
+        self.heavy = heavy
+        self.estimate = estimate
+        self.approximate_rows = approximate_rows
+
+    async def admit(self, query: Dict[str, Any], backends: List[StorageBackend], mode: str = 'auto') -> Admission:
+        """
+        Estimate an analysis' cost and wait for a slot for it
+
+        Requests are turned away before the estimate when the interactive queue is full,
+        and the estimates themselves are bounded by the estimate gate. Approximate
+        requests always take an interactive slot, so they skip the estimate.
+
+        Args:
+            query: Elasticsearch query DSL
+            backends: The backends the analysis reads
+            mode: "auto", "full" (never approximate) or "approximate" (always)
+
+        Raises:
+            Overloaded: If no slot came free in time
+        """
+        # Requests still being estimated will queue here too
+        self.interactive.check(self.estimate.in_flight + self.estimate.waiting)
+        if mode == 'approximate':
+            return await self.acquire(None, mode)
+        async with self.estimate.admit():
+            cost = await estimate_cost(query, backends)
+        return await self.acquire(cost, mode)
+
+    async def acquire(self, cost: Optional[QueryCost], mode: str = 'auto') -> Admission:
+        """
+        Wait for a slot for an analysis
+
+        Args:
+            cost: The analysis' estimated cost; only optional in approximate mode
+            mode: "auto", "full" (never approximate) or "approximate" (always)
+
+        Raises:
+            Overloaded: If no slot came free in time
+        """
+        if mode == 'approximate':
+            await self.interactive.acquire()
+            return Admission(self.interactive, cost, self.approximate_rows, 'requested')
+        gate = self.heavy if cost.heavy else self.interactive
+        try:
+            await gate.acquire()
+            return Admission(gate, cost)
+        except Overloaded as e:
+            if mode == 'full' or gate is self.interactive:
+                raise
+            reason = str(e)
+        await self.interactive.acquire()
+        return Admission(self.interactive, cost, self.approximate_rows, reason)
+
+    def release(self, admission: Admission) -> None:
+        admission.gate.release()
+
+    def under_load(self) -> bool:
+        """Whether analyses are queueing, for shedding optional work such as AI summaries"""
+        return (
+            self.interactive.waiting > 0
+            or self.heavy.waiting > 0
+            or analysis_queue_depth() > ANALYSIS_WORKERS
+        )
+
+
+analyse_gate = AdmissionGate('analyse', ANALYSE_CONCURRENCY, ANALYSE_QUEUE_TIMEOUT, ANALYSE_MAX_QUEUE)
+heavy_analyse_gate = AdmissionGate('analyse_heavy', ANALYSE_HEAVY_CONCURRENCY, ANALYSE_HEAVY_QUEUE_TIMEOUT, ANALYSE_MAX_QUEUE)
+estimate_gate = AdmissionGate('analyse_estimate', ANALYSE_ESTIMATE_CONCURRENCY, ANALYSE_QUEUE_TIMEOUT, ANALYSE_MAX_QUEUE)
+upload_gate = AdmissionGate('upload', UPLOAD_CONCURRENCY, UPLOAD_QUEUE_TIMEOUT, UPLOAD_MAX_QUEUE)
+
+analysis_admission = AnalysisAdmission(analyse_gate, heavy_analyse_gate, estimate_gate)
+
+_gates = (analyse_gate, heavy_analyse_gate, estimate_gate, upload_gate)
+
+CallbackMetric(
+    "danphobic_admission_in_flight",
+    "Requests holding a slot, by admission gate",
+    "gauge",
+    lambda: [({'gate': gate.name}, gate.in_flight) for gate in _gates]
+)
+CallbackMetric(
+    "danphobic_admission_waiting",
+    "Requests queued for a slot, by admission gate",
+    "gauge",
+    lambda: [({'gate': gate.name}, gate.waiting) for gate in _gates]
+)
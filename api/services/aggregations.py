@@ -0,0 +1,258 @@
+from typing import Any, Dict, Iterator, List, Mapping, Tuple
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+# Field names from the daily index template (see services/indices.py)
+STATUS_FIELD = 'status'
+METHOD_FIELD = 'method'
+IP_FIELD = 'remote_addr'
+PATH_FIELD = 'path'
+USER_AGENT_FIELD = 'http_user_agent'
+DATETIME_FIELD = 'datetime'
+
+# Upper bound on buckets returned for high-cardinality terms (IPs, paths, UAs)
+MAX_TERMS = 10000
+
+# Distinct IPs counted exactly by the cardinality aggregation before it switches to an
+# estimate (40000 is the largest threshold Elasticsearch accepts)
+CARDINALITY_PRECISION = 40000
+
+# Matches the isoformat() strings the row-based detectors produce
+MINUTE_FORMAT = "yyyy-MM-dd'T'HH:mm:ss"
+
+
+def build_aggregations(error_threshold: int = 3, max_terms: int = MAX_TERMS, time_series: bool = True) -> Dict[str, Any]:
+    """
+    Build the Elasticsearch aggregations equivalent to the count-based checks in services/parser.py
+
+    Args:
+        error_threshold: Minimum number of errors for a path to be reported (see analyze_error_paths)
+        max_terms: Maximum number of buckets for high-cardinality terms aggregations
+        time_series: Include the per-minute histogram (left out when it is read from rollups)
+
+    Returns:
+        Dict[str, Any]: Aggregations body to send alongside the search query
+    """
+    aggregations = {
+        'status_counts': {
+            'range': {
+                'field': STATUS_FIELD,
+                'ranges': [
+                    {'key': '2xx', 'from': 200, 'to': 300},
+                    {'key': '3xx', 'from': 300, 'to': 400},
+                    {'key': '4xx', 'from': 400, 'to': 500},
+                    {'key': '5xx', 'from': 500, 'to': 600},
+                ]
+            }
+        },
+        'method_counts': {
+            'terms': {'field': METHOD_FIELD, 'size': 100}
+        },
+        'request_counts': {
+            'terms': {'field': IP_FIELD, 'size': max_terms}
+        },
+        # Requests beyond the top max_terms IPs are only counted in sum_other_doc_count, so the
+        # number of IPs they came from is counted separately for the high-frequency statistics
+        'distinct_ips': {
+            'cardinality': {'field': IP_FIELD, 'precision_threshold': CARDINALITY_PRECISION}
+        },
+        'path_counts': {
+            'terms': {'field': PATH_FIELD, 'size': max_terms}
+        },
+        'user_agent_counts': {
+            'terms': {'field': USER_AGENT_FIELD, 'size': max_terms}
+        },
+        'requests_per_minute': {
+            'date_histogram': {
+                'field': DATETIME_FIELD,
+                'fixed_interval': '1m',
+                'min_doc_count': 0,
+                'format': MINUTE_FORMAT
+            },
+            'aggs': {
+                'traffic_type': {
+                    'filters': {
+                        'filters': {
+                            'bot': {
+                                'wildcard': {
+                                    USER_AGENT_FIELD: {'value': '*bot*', 'case_insensitive': True}
+                                }
+                            }
+                        },
+                        'other_bucket_key': 'human'
+                    }
+                }
+            }
+        },
+        'error_paths': {
+            'filter': {'range': {STATUS_FIELD: {'gte': 400, 'lt': 600}}},
+            'aggs': {
+                'paths': {
+                    'terms': {'field': PATH_FIELD, 'size': max_terms, 'min_doc_count': error_threshold},
+                    'aggs': {
+                        'statuses': {'terms': {'field': STATUS_FIELD, 'size': 100}}
+                    }
+                }
+            }
+        }
+    }
+    if not time_series:
+        del aggregations['requests_per_minute']
+    return aggregations
+
+
+# Backends without Elasticsearch (services/sqlite_storage.py, services/archive.py) count
+# with their own engines and build the same response shapes with these helpers, so every
+# backend's results go through parse_aggregations.
+
+def terms_buckets(counts: Mapping[Any, int], size: int) -> Dict[str, Any]:
+    """A terms aggregation over counted values: largest first, ties by key, None skipped"""
+    items = sorted(((key, count) for key, count in counts.items() if key is not None), key=lambda item: (-item[1], item[0]))
+    return {
+        'buckets': [{'key': key, 'doc_count': count} for key, count in items[:size]],
+        'sum_other_doc_count': sum(count for _, count in items[size:]),
+    }
+
+
+def _minutes(first: str, last: str) -> Iterator[str]:
+    minute = datetime.fromisoformat(first)
+    end = datetime.fromisoformat(last)
+    while minute <= end:
+        yield minute.strftime('%Y-%m-%dT%H:%M')
+        minute += timedelta(minutes=1)
+
+
+def minute_buckets(counts: Mapping[str, Tuple[int, int]]) -> Dict[str, Any]:
+    """
+    The per-minute date histogram over (requests, bot requests) counted by "YYYY-MM-DDTHH:MM".
+    Like the date histogram with min_doc_count 0, minutes without requests are included.
+    """
+    if not counts:
+        return {'buckets': []}
+    minutes = sorted(counts)
+    buckets = []
+    for minute in _minutes(minutes[0], minutes[-1]):
+        count, bots = counts.get(minute, (0, 0))
+        buckets.append({
+            'key_as_string': f"{minute}:00",
+            'doc_count': count,
+            'traffic_type': {'buckets': {'bot': {'doc_count': bots}, 'human': {'doc_count': count - bots}}},
+        })
+    return {'buckets': buckets}
+
+
+def error_path_buckets(statuses: Mapping[str, Mapping[int, int]], error_threshold: int = 3, max_terms: int = MAX_TERMS) -> Dict[str, Any]:
+    """The error_paths aggregation over error counts by path and status"""
+    totals = sorted(
+        ((sum(counts.values()), path) for path, counts in statuses.items() if sum(counts.values()) >= error_threshold),
+        key=lambda item: (-item[0], item[1])
+    )[:max_terms]
+    return {'paths': {'buckets': [
+        {
+            'key': path,
+            'doc_count': total,
+            'statuses': {'buckets': [
+                {'key': status, 'doc_count': count}
+                for status, count in sorted(statuses[path].items(), key=lambda item: (-item[1], item[0]))
+            ]},
+        }
+        for total, path in totals
+    ]}}
+
+
+def _terms_to_dict(agg: Dict[str, Any]) -> Dict[str, int]:
+    return {str(bucket['key']): bucket['doc_count'] for bucket in agg.get('buckets', [])}
+
+
+def parse_request_count_stats(request_counts: Dict[str, Any], distinct_ips: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Population behind the request_counts terms aggregation, which only lists the top IPs
+
+    Returns:
+        Dict[str, int]: ips (distinct IPs matched) and requests (requests from all of them)
+    """
+    buckets = request_counts.get('buckets', [])
+    return {
+        # The cardinality estimate can fall below the number of buckets actually returned
+        'ips': max(distinct_ips.get('value', 0), len(buckets)),
+        'requests': sum(bucket['doc_count'] for bucket in buckets) + request_counts.get('sum_other_doc_count', 0),
+    }
+
+
+def parse_status_counts(agg: Dict[str, Any]) -> Dict[str, int]:
+    """Map the status range aggregation back to the count_status_codes shape"""
+    status_counts = {'2xx': 0, '3xx': 0, '4xx': 0, '5xx': 0}
+    for bucket in agg.get('buckets', []):
+        status_counts[bucket['key']] = bucket['doc_count']
+    return status_counts
+
+
+def parse_method_counts(agg: Dict[str, Any]) -> Dict[str, int]:
+    """Map the method terms aggregation back to the count_http_methods shape (methods upper-cased)"""
+    method_counts = defaultdict(int)
+    for method, count in _terms_to_dict(agg).items():
+        method_counts[method.upper()] += count
+    return dict(method_counts)
+
+
+def parse_path_counts(agg: Dict[str, Any]) -> Dict[str, int]:
+    """Map the path terms aggregation back to the count_most_accessed_paths shape (query strings removed)"""
+    path_counts = defaultdict(int)
+    for path, count in _terms_to_dict(agg).items():
+        path_counts[path.split('?')[0]] += count
+    return dict(path_counts)
+
+
+def parse_requests_per_minute(agg: Dict[str, Any]) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int, int]]]:
+    """
+    Map the per-minute date histogram back to the calculate_requests_per_minute
+    and analyze_bot_vs_human_traffic shapes
+
+    Returns:
+        Tuple of (requests_per_minute, bot_vs_human_traffic)
+    """
+    requests_per_minute = []
+    bot_vs_human_traffic = []
+    for bucket in agg.get('buckets', []):
+        minute = bucket['key_as_string']
+        requests_per_minute.append((minute, bucket['doc_count']))
+        traffic = bucket.get('traffic_type', {}).get('buckets', {})
+        bot_vs_human_traffic.append((
+            minute,
+            traffic.get('bot', {}).get('doc_count', 0),
+            traffic.get('human', {}).get('doc_count', 0)
+        ))
+    return requests_per_minute, bot_vs_human_traffic
+
+
+def parse_error_paths(agg: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """Map the error path aggregation back to the analyze_error_paths shape"""
+    return {
+        bucket['key']: _terms_to_dict(bucket['statuses'])
+        for bucket in agg.get('paths', {}).get('buckets', [])
+    }
+
+
+def parse_aggregations(aggregations: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Map an aggregation response built by build_aggregations back to the response shapes of /analyse
+
+    Args:
+        aggregations: The "aggregations" section of the search response
+
+    Returns:
+        Dict[str, Any]: status_counts, method_counts, request_counts, request_count_stats, path_counts,
+        user_agent_counts, requests_per_minute, bot_vs_human_traffic and error_paths
+    """
+    requests_per_minute, bot_vs_human_traffic = parse_requests_per_minute(aggregations.get('requests_per_minute', {}))
+    return {
+        'status_counts': parse_status_counts(aggregations.get('status_counts', {})),
+        'method_counts': parse_method_counts(aggregations.get('method_counts', {})),
+        'request_counts': _terms_to_dict(aggregations.get('request_counts', {})),
+        'request_count_stats': parse_request_count_stats(aggregations.get('request_counts', {}), aggregations.get('distinct_ips', {})),
+        'path_counts': parse_path_counts(aggregations.get('path_counts', {})),
+        'user_agent_counts': _terms_to_dict(aggregations.get('user_agent_counts', {})),
+        'requests_per_minute': requests_per_minute,
+        'bot_vs_human_traffic': bot_vs_human_traffic,
+        'error_paths': parse_error_paths(aggregations.get('error_paths', {})),
+    }
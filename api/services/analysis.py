@@ -0,0 +1,150 @@
+from typing import Any, Dict, Optional, Tuple
+from contextlib import aclosing
+from services.storage import StorageBackend, storage as default_storage
+from services.parser import find_blacklisted_ips, find_high_frequency_ips, generate_insights, generate_map_markers_from_counts
+from services.retrieval import to_log_records
+from services.row_detectors import RowDetectors
+from services.concurrency import run_cpu
+from services.metrics import ANALYSIS_STAGE_SECONDS, MATERIALIZE_SECONDS, timed
+
+_materialize = timed(MATERIALIZE_SECONDS)(to_log_records)
+_find_blacklisted_ips = timed(ANALYSIS_STAGE_SECONDS.labels('blacklist'))(find_blacklisted_ips)
+_find_high_frequency_ips = timed(ANALYSIS_STAGE_SECONDS.labels('high_frequency_ips'))(find_high_frequency_ips)
+_generate_insights = timed(ANALYSIS_STAGE_SECONDS.labels('insights'))(generate_insights)
+_generate_map_markers = timed(ANALYSIS_STAGE_SECONDS.labels('map_markers'))(generate_map_markers_from_counts)
+
+
+async def collect_analysis(
+    query: Dict[str, Any],
+    storage: StorageBackend = default_storage,
+    max_rows: Optional[int] = None
+) -> Tuple[int, Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Retrieve what the checks need for the logs matching a query: the backend's aggregates
+    and the row-based detector results
+
+    Args:
+        query: Elasticsearch query DSL selecting the logs to analyse
+        storage: Backend holding the logs
+        max_rows: Stop the row-based detectors after this many logs (default: all). The
+            aggregates still cover every match; detector results cover the earliest logs.
+
+    Returns:
+        Tuple of (total matches, aggregates, detector results or None when nothing matched)
+    """
+    # Counts and time series are aggregated by the backend over the full match set
+    total, aggregates = await storage.aggregate(query)
+
+    if not total:
+        return 0, aggregates, None
+
+    # Row-based detectors stream through every matching document in pages
+    row_detectors = RowDetectors()
+    # Closed explicitly so a scan cut short by max_rows releases its point-in-time at once
+    async with aclosing(storage.scan(query)) as batches:
+        async for batch in batches:
+            if max_rows is not None:
+                batch = batch[:max_rows - row_detectors.entries_seen]
+            await run_cpu(lambda: row_detectors.feed(_materialize(batch)))
+            if max_rows is not None and row_detectors.entries_seen >= max_rows:
+                break
+    return total, aggregates, row_detectors.results()
+
+
+async def run_analysis(query: Dict[str, Any], storage: StorageBackend = default_storage, max_rows: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run every check over the logs matching a query
+
+    Args:
+        query: Elasticsearch query DSL selecting the logs to analyse
+        storage: Backend holding the logs (default: the configured STORAGE_BACKEND)
+        max_rows: Limit on the logs the row-based detectors see (see collect_analysis)
+
+    Returns:
+        Dict[str, Any]: The /analyse response, without the AI summary
+    """
+    total, aggregates, rows = await collect_analysis(query, storage, max_rows)
+
+    if not total:
+        return {"message": "No logs found", "logs": []}
+
+    return await build_analysis(total, aggregates, rows)
+
+
+async def build_analysis(total: int, aggregates: Dict[str, Any], rows: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run the checks over collected aggregates and detector results
+
+    Args:
+        total: Number of matching logs
+        aggregates: Aggregates in the parse_aggregations shape
+        rows: RowDetectors results
+
+    Returns:
+        Dict[str, Any]: The /analyse response, without the AI summary
+    """
+    logs = rows["logs"] # Sample of matching entries
+    detector_totals = rows["detector_totals"] # Uncapped totals behind the capped evidence lists
+
+    # Checks
+    request_counts = aggregates["request_counts"] # Dictionary of IP addresses and their request counts
+    blacklist_occurance = _find_blacklisted_ips(request_counts) # Array of blacklisted IPs
+    request_count_stats = aggregates["request_count_stats"] # Distinct IPs and their requests, beyond the top IPs listed
+    high_frequency_ips = _find_high_frequency_ips(request_counts, ips=request_count_stats["ips"], requests=request_count_stats["requests"]) # Dictionary of IP addresses and their request counts
+    # Statistics over IPs missing from request_counts assume their requests are spread evenly
+    high_frequency_ips_approximate = request_count_stats["ips"] > len(request_counts)
+    suspicious_user_agents = rows["suspicious_user_agents"] # Dictionary of user agent patterns and their log entries
+    sensitive_endpoint_access = rows["sensitive_endpoint_access"] # Dictionary of endpoints and their log entries
+    burst_requests = rows["burst_requests"] # Dictionary of IP addresses and their burst windows
+    attack_signatures = rows["attack_signatures"] # Dictionary of signature categories and their log entries
+    user_agent_counts = aggregates["user_agent_counts"] # Dictionary of user agents and their request counts
+    status_counts = aggregates["status_counts"] # Dictionary of status code categories and their counts
+    method_counts = aggregates["method_counts"] # Dictionary of HTTP methods and their counts
+    requests_per_minute = aggregates["requests_per_minute"] # List of (timestamp, count) tuples
+    error_paths = aggregates["error_paths"] # Dictionary of paths and their error counts
+    path_counts = aggregates["path_counts"] # Get all path counts
+    bot_vs_human_traffic = aggregates["bot_vs_human_traffic"] # List of (timestamp, bot_count, human_count) tuples
+
+    # Generate insights including path analysis
+    insights = await run_cpu(
+        _generate_insights,
+        blacklist_occurance,
+        request_counts,
+        high_frequency_ips,
+        detector_totals["suspicious_user_agents"],
+        detector_totals["sensitive_endpoint_access"],
+        burst_requests,
+        user_agent_counts,
+        status_counts,
+        method_counts,
+        requests_per_minute,
+        error_paths,
+        path_counts,
+        detector_totals["attack_signatures"]
+    )
+
+    map_markers = await run_cpu(_generate_map_markers, request_counts)
+
+    return {
+        "message": "Logs retrieved successfully",
+        "total": total,
+        "logs": logs,
+        "blacklist_occurance": blacklist_occurance,
+        "request_counts": request_counts,
+        "high_frequency_ips": high_frequency_ips,
+        "high_frequency_ips_approximate": high_frequency_ips_approximate,
+        "suspicious_user_agents": suspicious_user_agents,
+        "sensitive_endpoint_access": sensitive_endpoint_access,
+        "burst_requests": burst_requests,
+        "attack_signatures": attack_signatures,
+        "detector_totals": detector_totals,
+        "user_agent_counts": user_agent_counts,
+        "status_counts": status_counts,
+        "method_counts": method_counts,
+        "requests_per_minute": requests_per_minute,
+        "error_paths": error_paths,
+        "path_counts": path_counts,
+        "insights": insights,
+        "map_markers": map_markers,
+        "bot_vs_human_traffic": bot_vs_human_traffic
+    }
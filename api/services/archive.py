@@ -0,0 +1,783 @@
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque
+from datetime import date, datetime, timedelta
+from itertools import accumulate, compress
+from services.storage import StorageBackend
+from services.aggregations import MAX_TERMS, error_path_buckets, minute_buckets, parse_aggregations, terms_buckets
+from services.concurrency import run_cpu
+from services.dedup import BloomFilter
+from services.indices import _parse_bound, query_time_range
+from services.retrieval import DEFAULT_BATCH_SIZE, ENTRY_FIELDS
+from services.sqlite_storage import FIELD_COLUMNS, _clauses, _single
+from services.metrics import ARCHIVE_SECONDS, ARCHIVE_SEGMENTS
+import asyncio
+import base64
+import functools
+import hashlib
+import lzma
+import operator
+import orjson
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+# Cold tier for logs that have aged out of the hot storage backend. Parsed entries are
+# kept as compressed columnar segments, one or more per day, in ARCHIVE_DIR or, with
+# ARCHIVE_BUCKET set, in S3 under ARCHIVE_PREFIX.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), '..', 'data', 'archive'))
+ARCHIVE_BUCKET = os.getenv("ARCHIVE_BUCKET")
+ARCHIVE_PREFIX = os.getenv("ARCHIVE_PREFIX", "archive")
+
+# Rows per segment, and the codec each column block is compressed with ("zlib" or "lzma")
+ARCHIVE_SEGMENT_ROWS = int(os.getenv("ARCHIVE_SEGMENT_ROWS", "250000"))
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zlib")
+
+# False positive rate of the per-segment Bloom filters; a false positive only costs a segment read
+ARCHIVE_BLOOM_ERROR_RATE = float(os.getenv("ARCHIVE_BLOOM_ERROR_RATE", "0.01"))
+
+# Days of archived logs to keep (0 keeps everything)
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "0"))
+
+# Set ARCHIVE_ON_EXPIRE=1 to archive days of the hot backend before they are expired
+ARCHIVE_ON_EXPIRE = os.getenv("ARCHIVE_ON_EXPIRE", "0") == "1"
+
+# Segments read and decoded ahead of the one being consumed
+ARCHIVE_READ_AHEAD = int(os.getenv("ARCHIVE_READ_AHEAD", "4"))
+
+# Segment headers kept in memory; segments are immutable, so cached headers never go stale
+HEADER_CACHE_SIZE = 4096
+
+# Fields with statistics for pruning. A field with at most STATS_MAX_VALUES distinct values
+# in a segment lists them; one with more gets a Bloom filter.
+STATS_FIELDS = ('remote_addr', 'remote_user', 'status', 'method', 'path', 'protocol', 'http_user_agent', 'http_referer', 'attack_tags')
+STATS_MAX_VALUES = 64
+
+INTEGER_FIELDS = {'status', 'body_bytes_sent'}
+
+# Segment layout: MAGIC, the header length, the JSON header, then one compressed block per
+# column. Column offsets in the header are relative to the end of the header.
+MAGIC = b'DPSEG1'
+_LENGTH = struct.Struct('<I')
+HEADER_READ_SIZE = 65536
+
+CODECS = {
+    'zlib': (functools.partial(zlib.compress, level=6), zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+CATALOG_KEY = 'catalog.json'
+
+_RANGE_OPERATORS = (
+    ('gte', operator.ge), ('gt', operator.gt), ('lte', operator.le), ('lt', operator.lt), ('from', operator.ge), ('to', operator.le)
+)
+
+_write_seconds = ARCHIVE_SECONDS.labels('write')
+_aggregate_seconds = ARCHIVE_SECONDS.labels('aggregate')
+_scan_seconds = ARCHIVE_SECONDS.labels('scan')
+_segments_read = ARCHIVE_SEGMENTS.labels('read')
+_segments_pruned_by_time = ARCHIVE_SEGMENTS.labels('pruned_time')
+_segments_pruned_by_stats = ARCHIVE_SEGMENTS.labels('pruned_stats')
+
+
+class LocalSegmentStore:
+    """Segments as files under a directory"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, *key.split('/')))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Segment key {key!r} is outside the archive directory")
+        return path
+
+    def read(self, key: str, start: int = 0, length: Optional[int] = None) -> bytes:
+        with open(self._path(key), 'rb') as f:
+            f.seek(start)
+            return f.read() if length is None else f.read(length)
+
+    def write(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def location(self) -> str:
+        return os.path.abspath(self.root)
+
+
+class S3SegmentStore:
+    """Segments as S3 objects; a column is fetched with a ranged GET of its block"""
+
+    def __init__(self, bucket: str, prefix: str = ARCHIVE_PREFIX, client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from services.s3 import get_s3
+            self._client = get_s3()
+        return self._client
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def read(self, key: str, start: int = 0, length: Optional[int] = None) -> bytes:
+        kwargs = {}
+        if length is not None:
+            kwargs['Range'] = f"bytes={start}-{start + length - 1}"
+        elif start:
+            kwargs['Range'] = f"bytes={start}-"
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(key), **kwargs)['Body'].read()
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def write(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def location(self) -> str:
+        return f"s3://{self.bucket}/{self.prefix}"
+
+
+def _bloom_key(value: Any) -> str:
+    return hashlib.blake2b(str(value).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _encode_column(values: List[Any], delta: bool = False) -> bytes:
+    # Dictionary encoding: each distinct value is stored once and rows hold its code.
+    # Codes are assigned in order of first appearance, so for a sorted column they never
+    # decrease and delta encoding turns them into runs of 0 and 1.
+    codes_by_value: Dict[Any, int] = {}
+    dictionary: List[Any] = []
+    codes = array('I')
+    for value in values:
+        key = tuple(value) if isinstance(value, list) else value
+        code = codes_by_value.get(key)
+        if code is None:
+            code = codes_by_value[key] = len(dictionary)
+            dictionary.append(value)
+        codes.append(code)
+    if delta and codes:
+        codes = array('I', [codes[0]] + [b - a for a, b in zip(codes, codes[1:])])
+    encoded = orjson.dumps(dictionary)
+    return _LENGTH.pack(len(encoded)) + encoded + codes.tobytes()
+
+
+class Column:
+    """A decoded column: its distinct values and the code of each row's value"""
+
+    __slots__ = ('values', 'codes')
+
+    def __init__(self, data: bytes, delta: bool = False):
+        (length,) = _LENGTH.unpack_from(data)
+        self.values: List[Any] = orjson.loads(data[_LENGTH.size:_LENGTH.size + length])
+        codes = array('I')
+        codes.frombytes(data[_LENGTH.size + length:])
+        self.codes = array('I', accumulate(codes)) if delta else codes
+
+    def mask(self, predicate: Callable[[Any], bool]) -> List[bool]:
+        # Predicates run once per distinct value rather than once per row
+        hits = [predicate(value) for value in self.values]
+        return [hits[code] for code in self.codes]
+
+    def counts(self, mask: Optional[List[bool]] = None) -> Dict[Any, int]:
+        values = self.values
+        codes = self.codes if mask is None else compress(self.codes, mask)
+        return {values[code]: count for code, count in Counter(codes).items()}
+
+
+def encode_segment(documents: List[Dict[str, Any]], compression: str = ARCHIVE_COMPRESSION) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Encode log entries as one columnar segment
+
+    Args:
+        documents: Stored log documents (ENTRY_FIELDS)
+        compression: Codec for the column blocks
+
+    Returns:
+        Tuple of (segment bytes, its header)
+    """
+    compress_block, _ = CODECS[compression]
+    documents = sorted(documents, key=lambda document: document.get('datetime') or '')
+    columns = {}
+    blocks = []
+    offset = 0
+    for field in ENTRY_FIELDS:
+        block = compress_block(_encode_column([document.get(field) for document in documents], delta=field == 'datetime'))
+        columns[field] = {'offset': offset, 'length': len(block)}
+        blocks.append(block)
+        offset += len(block)
+
+    stats = {}
+    for field in STATS_FIELDS:
+        distinct = set()
+        for document in documents:
+            value = document.get(field)
+            if isinstance(value, list):
+                distinct.update(value)
+            elif value is not None:
+                distinct.add(value)
+        if len(distinct) <= STATS_MAX_VALUES:
+            stats[field] = {'values': sorted(distinct, key=str)}
+        else:
+            bloom = BloomFilter(len(distinct), ARCHIVE_BLOOM_ERROR_RATE)
+            for value in distinct:
+                bloom.add(_bloom_key(value))
+            stats[field] = {'bloom': base64.b64encode(bloom.to_bytes()).decode('ascii')}
+
+    dated = [document['datetime'] for document in documents if document.get('datetime')]
+    header = {
+        'version': 1,
+        'rows': len(documents),
+        'compression': compression,
+        'min_datetime': dated[0] if dated else None,
+        'max_datetime': dated[-1] if dated else None,
+        'raw_bytes': sum(len(orjson.dumps(document)) for document in documents),
+        'columns': columns,
+        'stats': stats,
+    }
+    encoded = orjson.dumps(header)
+    return MAGIC + _LENGTH.pack(len(encoded)) + encoded + b''.join(blocks), header
+
+
+def _column(field: str) -> str:
+    column = FIELD_COLUMNS.get(field)
+    if column is None:
+        raise ValueError(f"Unsupported field {field!r}")
+    return column
+
+
+def _coerce(column: str, value: Any) -> Any:
+    if column in INTEGER_FIELDS and isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    if column == 'datetime':
+        parsed = _parse_bound(value)
+        if parsed is None:
+            raise ValueError(f"Unsupported date bound {value!r}")
+        return parsed.isoformat()
+    return value
+
+
+def _wildcard(pattern: str) -> str:
+    return ''.join('.*' if char == '*' else '.' if char == '?' else re.escape(char) for char in pattern)
+
+
+def _predicate(kind: str, column: str, condition: Any) -> Callable[[Any], bool]:
+    """Test one stored value (one tag, for attack_tags) against a leaf query"""
+    if kind == 'term':
+        value = _coerce(column, condition.get('value') if isinstance(condition, dict) else condition)
+        return lambda stored: stored == value
+    if kind == 'terms':
+        values = {_coerce(column, value) for value in condition}
+        return lambda stored: stored in values
+    if kind == 'range':
+        bounds = [(compare, _coerce(column, condition[key])) for key, compare in _RANGE_OPERATORS if condition.get(key) is not None]
+        return lambda stored: stored is not None and all(compare(stored, bound) for compare, bound in bounds)
+    if kind in ('wildcard', 'prefix'):
+        pattern = str(condition.get('value') if isinstance(condition, dict) else condition)
+        flags = re.DOTALL | (re.IGNORECASE if isinstance(condition, dict) and condition.get('case_insensitive') else 0)
+        regex = re.compile(_wildcard(pattern) if kind == 'wildcard' else re.escape(pattern) + '.*', flags)
+        return lambda stored: stored is not None and regex.fullmatch(str(stored)) is not None
+    if kind in ('match', 'match_phrase'):
+        text = str(condition.get('query') if isinstance(condition, dict) else condition).lower()
+        return lambda stored: stored is not None and text in str(stored).lower()
+    raise ValueError(f"Unsupported query type {kind!r}")
+
+
+def _row_predicate(column: str, predicate: Callable[[Any], bool]) -> Callable[[Any], bool]:
+    # attack_tags holds several values; a document matches if any of them does
+    if column == 'attack_tags':
+        return lambda tags: bool(tags) and any(predicate(tag) for tag in tags)
+    return predicate
+
+
+def _overlaps(lower: Optional[str], upper: Optional[str], header: Dict[str, Any]) -> bool:
+    if header['min_datetime'] is None:
+        # No dated rows: only queries without a time bound can match
+        return lower is None and upper is None
+    return (lower is None or header['max_datetime'] >= lower) and (upper is None or header['min_datetime'] <= upper)
+
+
+def may_match(query: Optional[Dict[str, Any]], header: Dict[str, Any]) -> bool:
+    """
+    Whether a segment can hold logs matching a query, from its header alone
+
+    The answer errs towards True: only time ranges, and term, terms, range, wildcard and
+    prefix clauses on fields with statistics can rule a segment out.
+    """
+    if not query:
+        return True
+    kind, body = _single(query)
+    if kind == 'match_none':
+        return False
+    if kind == 'bool':
+        must = _clauses(body.get('must')) + _clauses(body.get('filter'))
+        if not all(may_match(clause, header) for clause in must):
+            return False
+        should = _clauses(body.get('should'))
+        required = int(body.get('minimum_should_match', 0 if must else 1))
+        return not should or required <= 0 or sum(may_match(clause, header) for clause in should) >= required
+    if kind not in ('term', 'terms', 'range', 'wildcard', 'prefix'):
+        return True
+    field, condition = _single(body)
+    column = _column(field)
+    if column == 'datetime' and kind == 'range':
+        lower = next((_coerce(column, condition[key]) for key in ('gte', 'gt', 'from') if condition.get(key) is not None), None)
+        upper = next((_coerce(column, condition[key]) for key in ('lte', 'lt', 'to') if condition.get(key) is not None), None)
+        return _overlaps(lower, upper, header)
+    stats = header['stats'].get(column)
+    if field != column or stats is None:
+        return True
+    predicate = _predicate(kind, column, condition)
+    if 'values' in stats:
+        return any(predicate(value) for value in stats['values'])
+    if kind == 'term':
+        return _bloom_key(_coerce(column, condition.get('value') if isinstance(condition, dict) else condition)) in stats['bloom']
+    if kind == 'terms':
+        return any(_bloom_key(_coerce(column, value)) in stats['bloom'] for value in condition)
+    return True
+
+
+def _and(left: Optional[List[bool]], right: Optional[List[bool]]) -> Optional[List[bool]]:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return [a and b for a, b in zip(left, right)]
+
+
+class Segment:
+    """One segment being read: its header, with columns fetched and decoded on first use"""
+
+    def __init__(self, store, key: str, header: Dict[str, Any], data_start: int):
+        self.store = store
+        self.key = key
+        self.header = header
+        self.rows = header['rows']
+        self._data_start = data_start
+        self._columns: Dict[str, Column] = {}
+
+    def column(self, name: str) -> Column:
+        column = self._columns.get(name)
+        if column is None:
+            location = self.header['columns'][name]
+            block = self.store.read(self.key, self._data_start + location['offset'], location['length'])
+            _, decompress_block = CODECS[self.header['compression']]
+            column = self._columns[name] = Column(decompress_block(block), delta=name == 'datetime')
+        return column
+
+    def mask(self, query: Optional[Dict[str, Any]]) -> Optional[List[bool]]:
+        """
+        Rows matching a query, evaluated column by column
+
+        Returns:
+            One bool per row, or None when every row matches
+
+        Raises:
+            ValueError: For query types or fields the archive doesn't support
+        """
+        if not query:
+            return None
+        kind, body = _single(query)
+        if kind == 'match_all':
+            return None
+        if kind == 'match_none':
+            return [False] * self.rows
+        if kind == 'bool':
+            mask = None
+            must = _clauses(body.get('must')) + _clauses(body.get('filter'))
+            for clause in must:
+                mask = _and(mask, self.mask(clause))
+            for clause in _clauses(body.get('must_not')):
+                excluded = self.mask(clause)
+                mask = _and(mask, [False] * self.rows if excluded is None else [not hit for hit in excluded])
+            should = _clauses(body.get('should'))
+            required = int(body.get('minimum_should_match', 0 if must else 1))
+            if should and required > 0:
+                masks = [self.mask(clause) or [True] * self.rows for clause in should]
+                mask = _and(mask, [sum(hits) >= required for hits in zip(*masks)])
+            return mask
+        if kind == 'exists':
+            return self.column(_column(body['field'])).mask(lambda stored: stored is not None and stored != [])
+        field, condition = _single(body)
+        column = _column(field)
+        return self.column(column).mask(_row_predicate(column, _predicate(kind, column, condition)))
+
+    def documents(self, mask: Optional[List[bool]], fields: List[str]) -> List[Dict[str, Any]]:
+        """Materialize the matching rows, in time order"""
+        rows = range(self.rows) if mask is None else list(compress(range(self.rows), mask))
+        values = []
+        for field in fields:
+            column = self.column(_column(field))
+            dictionary, codes = column.values, column.codes
+            values.append([dictionary[codes[row]] for row in rows])
+        return [dict(zip(fields, row)) for row in zip(*values)]
+
+
+class _Counts:
+    """Aggregates accumulated over segments, then shaped like the Elasticsearch response"""
+
+    def __init__(self):
+        self.total = 0
+        self.statuses: Counter = Counter()
+        self.methods: Counter = Counter()
+        self.ips: Counter = Counter()
+        self.paths: Counter = Counter()
+        self.user_agents: Counter = Counter()
+        self.minutes: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+        self.errors: Dict[str, Counter] = defaultdict(Counter)
+
+    def add(self, segment: Segment, mask: Optional[List[bool]]) -> None:
+        matched = segment.rows if mask is None else sum(mask)
+        if not matched:
+            return
+        self.total += matched
+        status = segment.column('status')
+        user_agent = segment.column('http_user_agent')
+        self.statuses.update(status.counts(mask))
+        self.methods.update(segment.column('method').counts(mask))
+        self.ips.update(segment.column('remote_addr').counts(mask))
+        self.paths.update(segment.column('path').counts(mask))
+        self.user_agents.update(user_agent.counts(mask))
+
+        datetimes = segment.column('datetime')
+        bots = _and(mask, user_agent.mask(lambda agent: agent is not None and 'bot' in agent.lower()))
+        bot_counts = datetimes.counts(bots)
+        for value, count in datetimes.counts(mask).items():
+            if value:
+                minute = self.minutes[value[:16]]
+                minute[0] += count
+                minute[1] += bot_counts.get(value, 0)
+
+        errors = _and(mask, status.mask(lambda code: code is not None and 400 <= code < 600))
+        if any(errors):
+            path = segment.column('path')
+            for (path_code, status_code), count in Counter(zip(compress(path.codes, errors), compress(status.codes, errors))).items():
+                if path.values[path_code] is not None:
+                    self.errors[path.values[path_code]][status.values[status_code]] += count
+
+    def aggregations(self, max_terms: int, error_threshold: int) -> Dict[str, Any]:
+        def status_class(low: int) -> int:
+            return sum(count for code, count in self.statuses.items() if code is not None and low <= code < low + 100)
+
+        return {
+            'status_counts': {'buckets': [
+                {'key': f"{low // 100}xx", 'doc_count': status_class(low)} for low in (200, 300, 400, 500)
+            ]},
+            'method_counts': terms_buckets(self.methods, 100),
+            'request_counts': terms_buckets(self.ips, max_terms),
+            'distinct_ips': {'value': sum(1 for ip in self.ips if ip is not None)},
+            'path_counts': terms_buckets(self.paths, max_terms),
+            'user_agent_counts': terms_buckets(self.user_agents, max_terms),
+            'requests_per_minute': minute_buckets({minute: tuple(counts) for minute, counts in self.minutes.items()}),
+            'error_paths': error_path_buckets(self.errors, error_threshold, max_terms),
+        }
+
+
+class ArchiveStorage(StorageBackend):
+    """
+    Read-only backend over the cold-tier archive, for historical queries.
+
+    Days are copied out of the hot backend by archive() as time-partitioned columnar
+    segments: rows sorted by time, each column dictionary-encoded and compressed on its
+    own, behind a header with the segment's time range and per-field statistics (the
+    distinct values, or a Bloom filter when there are many). A catalog lists every
+    segment with its time range, so a query skips segments outside its range without
+    reading them and skips others from their header; only the columns a query and the
+    /analyse aggregations use are read from the rest.
+    """
+
+    def __init__(self, store, index: str, max_terms: int = MAX_TERMS, error_threshold: int = 3):
+        self.store = store
+        self.index = index
+        self.max_terms = max_terms
+        self.error_threshold = error_threshold
+        self._catalog: Optional[List[Dict[str, Any]]] = None
+        self._headers: OrderedDict = OrderedDict()
+        self._headers_lock = threading.Lock()
+        self._lock = asyncio.Lock()
+        self._last_page: Optional[Tuple[Any, List[Dict[str, Any]]]] = None
+
+    def for_index(self, index: str) -> "ArchiveStorage":
+        return ArchiveStorage(self.store, index, self.max_terms, self.error_threshold)
+
+    def _key(self, name: str) -> str:
+        return f"{self.index}/{name}"
+
+    def _load_catalog(self) -> List[Dict[str, Any]]:
+        try:
+            return orjson.loads(self.store.read(self._key(CATALOG_KEY)))['segments']
+        except FileNotFoundError:
+            return []
+
+    async def segments(self) -> List[Dict[str, Any]]:
+        """Catalog entries of every archived segment, in time order"""
+        if self._catalog is None:
+            self._catalog = await asyncio.to_thread(self._load_catalog)
+        return self._catalog
+
+    async def _save_catalog(self, segments: List[Dict[str, Any]]) -> None:
+        segments = sorted(segments, key=lambda segment: (segment['min_datetime'] or '', segment['key']))
+        await asyncio.to_thread(self.store.write, self._key(CATALOG_KEY), orjson.dumps({'segments': segments}))
+        self._catalog = segments
+
+    def _open(self, key: str) -> Segment:
+        with self._headers_lock:
+            cached = self._headers.get(key)
+            if cached is not None:
+                self._headers.move_to_end(key)
+        if cached is None:
+            data = self.store.read(key, 0, HEADER_READ_SIZE)
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{key} is not an archive segment")
+            (length,) = _LENGTH.unpack_from(data, len(MAGIC))
+            start = len(MAGIC) + _LENGTH.size
+            if len(data) < start + length:
+                data += self.store.read(key, len(data), start + length - len(data))
+            header = orjson.loads(data[start:start + length])
+            for stats in header['stats'].values():
+                if 'bloom' in stats:
+                    stats['bloom'] = BloomFilter.from_bytes(base64.b64decode(stats['bloom']))
+            cached = (header, start + length)
+            with self._headers_lock:
+                self._headers[key] = cached
+                while len(self._headers) > HEADER_CACHE_SIZE:
+                    self._headers.popitem(last=False)
+        return Segment(self.store, key, *cached)
+
+    async def _candidates(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Segments outside the query's time range are skipped using the catalog alone
+        start, end = query_time_range(query)
+        lower = start.isoformat() if start is not None else None
+        upper = end.isoformat() if end is not None else None
+        candidates = [segment for segment in await self.segments() if _overlaps(lower, upper, segment)]
+        _segments_pruned_by_time.inc(len(self._catalog) - len(candidates))
+        return candidates
+
+    def _read(self, key: str, query: Dict[str, Any], process: Callable[[Segment, Optional[List[bool]]], Any]) -> Any:
+        segment = self._open(key)
+        if not may_match(query, segment.header):
+            _segments_pruned_by_stats.inc()
+            return None
+        _segments_read.inc()
+        return process(segment, segment.mask(query))
+
+    async def _each(self, query: Dict[str, Any], process: Callable[[Segment, Optional[List[bool]]], Any], after: Optional[str] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """Run process over each candidate segment in time order, reading a few segments ahead"""
+        keys = [segment['key'] for segment in await self._candidates(query)]
+        if after is not None:
+            # Continue with the segments after this one
+            keys = keys[keys.index(after) + 1:] if after in keys else []
+        pending = deque()
+        position = 0
+        try:
+            while position < len(keys) or pending:
+                while position < len(keys) and len(pending) < ARCHIVE_READ_AHEAD:
+                    pending.append((keys[position], asyncio.ensure_future(run_cpu(self._read, keys[position], query, process))))
+                    position += 1
+                key, result = pending.popleft()
+                yield key, await result
+        finally:
+            for _, result in pending:
+                result.cancel()
+
+    async def count(self, query: Dict[str, Any]) -> int:
+        # An upper bound from the catalog: the rows of every segment in the query's time range
+        return sum(segment['rows'] for segment in await self._candidates(query))
+
+    async def aggregate(self, query: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        start = time.perf_counter()
+        counts = _Counts()
+        try:
+            async for _, _ in self._each(query, counts.add):
+                pass
+        finally:
+            _aggregate_seconds.observe(time.perf_counter() - start)
+        if not counts.total:
+            return 0, parse_aggregations({})
+        return counts.total, parse_aggregations(counts.aggregations(self.max_terms, self.error_threshold))
+
+    async def scan(self, query, fields=None, batch_size=DEFAULT_BATCH_SIZE):
+        fields = fields or ENTRY_FIELDS
+
+        def documents(segment, mask):
+            return segment.documents(mask, fields)
+
+        async for _, matched in self._each(query, documents):
+            start = time.perf_counter()
+            for i in range(0, len(matched or []), batch_size):
+                yield matched[i:i + batch_size]
+            _scan_seconds.observe(time.perf_counter() - start)
+
+    async def search(self, query, size=DEFAULT_BATCH_SIZE, search_after=None, fields=None):
+        # The cursor is a segment and a position within its matches. The matches of the last
+        # segment read are kept, so paging through a segment doesn't decode it for every page.
+        fields = fields or ENTRY_FIELDS
+        cache_key = orjson.dumps([query, fields], option=orjson.OPT_SORT_KEYS)
+
+        def documents(segment, mask):
+            return segment.documents(mask, fields)
+
+        page: List[Dict[str, Any]] = []
+        key = None
+        if search_after is not None:
+            key, position = search_after
+            if self._last_page is not None and self._last_page[0] == (key, cache_key):
+                matched = self._last_page[1]
+            else:
+                matched = await run_cpu(self._read, key, query, documents) or []
+                self._last_page = ((key, cache_key), matched)
+            page = matched[position:position + size]
+            if len(page) == size:
+                return page, [key, position + size]
+        async for segment_key, matched in self._each(query, documents, after=key):
+            matched = matched or []
+            self._last_page = ((segment_key, cache_key), matched)
+            taken = matched[:size - len(page)]
+            page.extend(taken)
+            if len(page) == size:
+                return page, [segment_key, len(taken)]
+        return page, None
+
+    async def archive(self, source: StorageBackend, older_than_days: int, today: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Copy every day of the hot backend older than a cutoff into the archive. Days already
+        archived are skipped; the hot backend is left as it is (its expire() drops the days).
+
+        Args:
+            source: Hot storage backend to read from
+            older_than_days: Days before today that stay hot only
+            today: Reference date (default: now)
+
+        Returns:
+            Dict[str, Any]: archived (per day: rows, segments, bytes and raw_bytes) and skipped days
+        """
+        cutoff = ((today or datetime.now()) - timedelta(days=older_than_days)).date()
+        async with self._lock:
+            archived_days = {segment['day'] for segment in await self.segments()}
+            day = await self._earliest_day(source, cutoff)
+            result: Dict[str, Any] = {'archived': [], 'skipped': []}
+            while day is not None and day < cutoff:
+                if day.isoformat() in archived_days:
+                    result['skipped'].append(day.isoformat())
+                else:
+                    summary = await self._archive_day(source, day)
+                    if summary['rows']:
+                        result['archived'].append(summary)
+                day += timedelta(days=1)
+        return result
+
+    async def _earliest_day(self, source: StorageBackend, cutoff: date) -> Optional[date]:
+        documents, _ = await source.search({'range': {'datetime': {'lt': f"{cutoff.isoformat()}T00:00:00"}}}, 1, fields=['datetime'])
+        try:
+            return date.fromisoformat(documents[0]['datetime'][:10]) if documents else None
+        except (TypeError, ValueError):
+            return None
+
+    async def _archive_day(self, source: StorageBackend, day: date) -> Dict[str, Any]:
+        query = {'range': {'datetime': {'gte': f"{day.isoformat()}T00:00:00", 'lt': f"{(day + timedelta(days=1)).isoformat()}T00:00:00"}}}
+        written: List[Dict[str, Any]] = []
+        pending: List[Dict[str, Any]] = []
+
+        async def write(documents: List[Dict[str, Any]]) -> None:
+            start = time.perf_counter()
+            data, header = await run_cpu(encode_segment, documents)
+            # Keys are never reused, so a cached header always matches its segment
+            key = self._key(f"{day.isoformat()}/{len(written):04d}-{os.urandom(4).hex()}.seg")
+            await asyncio.to_thread(self.store.write, key, data)
+            written.append({
+                'key': key,
+                'day': day.isoformat(),
+                'rows': header['rows'],
+                'min_datetime': header['min_datetime'],
+                'max_datetime': header['max_datetime'],
+                'bytes': len(data),
+                'raw_bytes': header['raw_bytes'],
+            })
+            _write_seconds.observe(time.perf_counter() - start)
+
+        # The scan is in time order, so each segment covers a contiguous slice of the day
+        async for batch in source.scan(query):
+            pending.extend(batch)
+            while len(pending) >= ARCHIVE_SEGMENT_ROWS:
+                await write(pending[:ARCHIVE_SEGMENT_ROWS])
+                pending = pending[ARCHIVE_SEGMENT_ROWS:]
+        if pending:
+            await write(pending)
+
+        # The catalog is written last, so a day is only visible once all its segments are
+        if written:
+            await self._save_catalog(await self.segments() + written)
+        return {
+            'day': day.isoformat(),
+            'rows': sum(segment['rows'] for segment in written),
+            'segments': len(written),
+            'bytes': sum(segment['bytes'] for segment in written),
+            'raw_bytes': sum(segment['raw_bytes'] for segment in written),
+        }
+
+    async def expire(self, retention_days: int = ARCHIVE_RETENTION_DAYS) -> Dict[str, Any]:
+        if retention_days <= 0:
+            return {"expired": [], "rollups_expired": 0}
+        cutoff = (datetime.now() - timedelta(days=retention_days)).date().isoformat()
+        async with self._lock:
+            segments = await self.segments()
+            expired = [segment for segment in segments if segment['day'] < cutoff]
+            if expired:
+                await self._save_catalog([segment for segment in segments if segment['day'] >= cutoff])
+                for segment in expired:
+                    await asyncio.to_thread(self.store.delete, segment['key'])
+        return {"expired": sorted({segment['day'] for segment in expired}), "rollups_expired": 0}
+
+    async def describe(self) -> Dict[str, Any]:
+        """Size of the archive and the days it holds"""
+        segments = await self.segments()
+        stored = sum(segment['bytes'] for segment in segments)
+        raw = sum(segment['raw_bytes'] for segment in segments)
+        return {
+            'location': self.store.location(),
+            'days': sorted({segment['day'] for segment in segments}),
+            'segments': len(segments),
+            'rows': sum(segment['rows'] for segment in segments),
+            'bytes': stored,
+            'raw_bytes': raw,
+            'compression_ratio': round(raw / stored, 2) if stored else None,
+        }
+
+
+def create_archive(index: Optional[str] = None) -> ArchiveStorage:
+    """
+    Build the archive configured by ARCHIVE_BUCKET / ARCHIVE_DIR
+
+    Args:
+        index: Base index name (default: ELASTIC_INDEX)
+    """
+    from services.elastic import es_index
+    store = S3SegmentStore(ARCHIVE_BUCKET) if ARCHIVE_BUCKET else LocalSegmentStore(ARCHIVE_DIR)
+    return ArchiveStorage(store, index or es_index)
+
+
+archive = create_archive()
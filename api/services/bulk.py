@@ -0,0 +1,330 @@
+from typing import Any, Callable, Dict, List, Optional
+from collections import Counter
+from dataclasses import dataclass, field
+import asyncio
+import heapq
+import os
+import orjson
+import sys
+import time
+from services.metrics import BULK_IN_FLIGHT, BULK_ITEMS, BULK_REQUEST_SECONDS
+
+BULK_MAX_BATCH_BYTES = int(os.getenv("BULK_MAX_BATCH_BYTES", str(5 * 1024 * 1024)))
+BULK_MAX_IN_FLIGHT = int(os.getenv("BULK_MAX_IN_FLIGHT", "4"))
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "8"))
+
+# Item and request statuses worth retrying: the cluster is overloaded or briefly unavailable
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+INITIAL_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30.0
+
+_indexed_items = BULK_ITEMS.labels('indexed')
+_failed_items = BULK_ITEMS.labels('failed')
+_retried_items = BULK_ITEMS.labels('retried')
+
+# Error examples kept for reporting; the per-type counts are always complete
+MAX_ERROR_SAMPLES = 20
+
+
+@dataclass
+class BulkStats:
+    """Per-item accounting across every bulk request a writer sends"""
+    indexed: int = 0
+    failed: int = 0
+    retried: int = 0
+    requests: int = 0
+    rejected_requests: int = 0
+    bytes_sent: int = 0
+    errors: Counter = field(default_factory=Counter)
+    error_samples: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'indexed': self.indexed,
+            'failed': self.failed,
+            'retried': self.retried,
+            'requests': self.requests,
+            'rejected_requests': self.rejected_requests,
+            'bytes_sent': self.bytes_sent,
+            'errors': dict(self.errors),
+            'error_samples': self.error_samples,
+        }
+
+
+class _Item:
+    __slots__ = ('seq', 'action', 'source', 'attempts')
+
+    def __init__(self, seq: int, action: bytes, source: bytes):
+        self.seq = seq
+        self.action = action
+        self.source = source
+        self.attempts = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.action) + len(self.source) + 2
+
+
+def _elasticsearch_errors(error: Exception):
+    """
+    The elasticsearch module if error is a request error from it, else None. The module
+    is only imported once a client is built, so nothing raised before then can be one.
+    """
+    elasticsearch = sys.modules.get('elasticsearch')
+    if elasticsearch is not None and isinstance(error, (elasticsearch.ApiError, elasticsearch.ConnectionError, elasticsearch.ConnectionTimeout)):
+        return elasticsearch
+    return None
+
+
+def serialize(value: Any) -> bytes:
+    """Serialize a bulk action or document once, up front, so batches can be sized in bytes"""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+
+class BulkWriter:
+    """
+    Concurrent Elasticsearch bulk indexer.
+
+    Documents are serialized as they are added and grouped into requests by size
+    in bytes. Several requests are kept in flight; when the cluster rejects work
+    (HTTP 429 or an unavailable node) the writer halves its concurrency and backs
+    off, then grows concurrency again one request at a time as requests succeed.
+    Only the items that failed with a retryable status are resent, and every other
+    item failure is counted per error type instead of dropping the whole request.
+
+    Items are numbered in the order they are added; completed tracks how many of
+    them, counting from the first, have reached a final outcome (indexed or failed),
+    which callers use for checkpointing.
+    """
+
+    def __init__(
+        self,
+        client,
+        max_batch_bytes: int = BULK_MAX_BATCH_BYTES,
+        max_in_flight: int = BULK_MAX_IN_FLIGHT,
+        max_retries: int = BULK_MAX_RETRIES,
+        on_progress: Optional[Callable[[int], None]] = None,
+        on_failed: Optional[Callable[[int], None]] = None,
+        sleep=asyncio.sleep
+    ):
+        """
+        Args:
+            client: AsyncElasticsearch client (or a stand-in with the same bulk method)
+            max_batch_bytes: Target size of a single bulk request body
+            max_in_flight: Maximum concurrent bulk requests
+            max_retries: Attempts per item before it is counted as failed
+            on_progress: Called with the new value of completed whenever it advances
+            on_failed: Called with an item's sequence number when it permanently fails,
+                before completed advances past it
+            sleep: Coroutine used for backoff, overridable for testing
+        """
+        self.client = client
+        self.max_batch_bytes = max_batch_bytes
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.on_progress = on_progress
+        self.on_failed = on_failed
+        self._sleep = sleep
+        self.stats = BulkStats()
+
+        self._batch: List[_Item] = []
+        self._batch_bytes = 0
+        self._next_seq = 0
+
+        # Adaptive concurrency limit (AIMD) and current in-flight requests
+        self.limit = max_in_flight
+        self._in_flight = 0
+        self._slots = asyncio.Condition()
+        self._backoff = 0.0
+        self._tasks: set = set()
+        self._error: Optional[BaseException] = None
+
+        # Sequence numbers finished out of order, waiting for the low watermark
+        self.completed = 0
+        self._finished: List[int] = []
+
+    async def add(self, action: Dict[str, Any], document: Dict[str, Any]) -> int:
+        """
+        Queue a document for indexing, waiting if the writer is at its concurrency limit
+
+        Args:
+            action: Bulk action metadata, e.g. {"index": {"_index": ..., "_id": ...}}
+            document: Document source
+
+        Returns:
+            int: Sequence number of the item
+        """
+        self._raise_if_failed()
+        item = _Item(self._next_seq, serialize(action), serialize(document))
+        self._next_seq += 1
+        self._batch.append(item)
+        self._batch_bytes += item.size
+        if self._batch_bytes >= self.max_batch_bytes:
+            await self.flush()
+        return item.seq
+
+    async def flush(self) -> None:
+        """Send the current partial batch"""
+        if not self._batch:
+            return
+        batch, self._batch, self._batch_bytes = self._batch, [], 0
+        await self._acquire()
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> BulkStats:
+        """Flush, wait for every request and retry to finish and return the final stats"""
+        await self.flush()
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        self._raise_if_failed()
+        return self.stats
+
+    def cancel(self) -> None:
+        """Abandon queued and in-flight requests, e.g. when the ingest feeding the writer is cancelled"""
+        self._batch, self._batch_bytes = [], 0
+        for task in list(self._tasks):
+            task.cancel()
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    async def _acquire(self) -> None:
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        BULK_IN_FLIGHT.inc()
+
+    async def _release(self) -> None:
+        BULK_IN_FLIGHT.dec()
+        async with self._slots:
+            self._in_flight -= 1
+            self._slots.notify_all()
+
+    async def _send(self, batch: List[_Item]) -> None:
+        try:
+            while batch:
+                if self._backoff:
+                    await self._sleep(self._backoff)
+                batch = await self._send_once(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Unexpected errors stop the writer; they are raised from the next add/close
+            self._error = e
+            raise
+        finally:
+            await self._release()
+
+    async def _send_once(self, batch: List[_Item]) -> List[_Item]:
+        """Send one bulk request and return the items that should be retried"""
+        indexed, failed, retried = self.stats.indexed, self.stats.failed, self.stats.retried
+        start = time.perf_counter()
+        try:
+            return await self._request(batch)
+        finally:
+            BULK_REQUEST_SECONDS.observe(time.perf_counter() - start)
+            _indexed_items.inc(self.stats.indexed - indexed)
+            _failed_items.inc(self.stats.failed - failed)
+            _retried_items.inc(self.stats.retried - retried)
+
+    async def _request(self, batch: List[_Item]) -> List[_Item]:
+        operations = []
+        for item in batch:
+            operations.append(item.action)
+            operations.append(item.source)
+            item.attempts += 1
+
+        self.stats.requests += 1
+        self.stats.bytes_sent += sum(item.size for item in batch)
+        try:
+            response = await self.client.bulk(operations=operations)
+        except Exception as e:
+            elasticsearch = _elasticsearch_errors(e)
+            if elasticsearch is None:
+                raise
+            status = getattr(e, 'status_code', None) or getattr(getattr(e, 'meta', None), 'status', None)
+            if isinstance(e, elasticsearch.ApiError) and status not in RETRYABLE_STATUSES:
+                for item in batch:
+                    self._fail(item, f"http_{status}", str(e))
+                return []
+            self.stats.rejected_requests += 1
+            self._on_rejected()
+            return self._retry(batch, f"http_{status}" if status else type(e).__name__, str(e))
+
+        retry = []
+        rejected = False
+        items = response.get('items', [])
+        for item, result in zip(batch, items):
+            outcome = next(iter(result.values()))
+            status = outcome.get('status', 500)
+            if status < 300:
+                self.stats.indexed += 1
+                self._finish(item)
+            elif status in RETRYABLE_STATUSES:
+                rejected = True
+                retry.append(item)
+            else:
+                error = outcome.get('error', {})
+                self._fail(item, error.get('type', f"http_{status}"), error.get('reason', ''))
+        # Items missing from a malformed response are retried rather than assumed indexed
+        retry.extend(batch[len(items):])
+
+        if rejected:
+            self._on_rejected()
+        else:
+            self._on_success()
+        return self._retry(retry, 'es_rejected_execution_exception', 'rejected by cluster') if retry else []
+
+    def _retry(self, items: List[_Item], error_type: str, reason: str) -> List[_Item]:
+        retry = []
+        for item in items:
+            if item.attempts >= self.max_retries:
+                self._fail(item, error_type, reason)
+            else:
+                self.stats.retried += 1
+                retry.append(item)
+        return retry
+
+    def _on_rejected(self) -> None:
+        # Multiplicative decrease of concurrency, exponential backoff
+        self.limit = max(1, self.limit // 2)
+        self._backoff = min(MAX_BACKOFF_SECONDS, max(INITIAL_BACKOFF_SECONDS, self._backoff * 2))
+
+    def _on_success(self) -> None:
+        # Additive increase back towards the configured concurrency
+        self._backoff = self._backoff / 2 if self._backoff > INITIAL_BACKOFF_SECONDS else 0.0
+        if self.limit < self.max_in_flight:
+            self.limit += 1
+            asyncio.get_running_loop().create_task(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._slots:
+            self._slots.notify_all()
+
+    def _fail(self, item: _Item, error_type: str, reason: str) -> None:
+        self.stats.failed += 1
+        self.stats.errors[error_type] += 1
+        if len(self.stats.error_samples) < MAX_ERROR_SAMPLES:
+            self.stats.error_samples.append({
+                'action': orjson.loads(item.action),
+                'type': error_type,
+                'reason': reason,
+                'at': time.time(),
+            })
+        if self.on_failed:
+            self.on_failed(item.seq)
+        self._finish(item)
+
+    def _finish(self, item: _Item) -> None:
+        heapq.heappush(self._finished, item.seq)
+        advanced = False
+        while self._finished and self._finished[0] == self.completed:
+            heapq.heappop(self._finished)
+            self.completed += 1
+            advanced = True
+        if advanced and self.on_progress:
+            self.on_progress(self.completed)
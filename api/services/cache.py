@@ -0,0 +1,202 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+from collections import OrderedDict
+from services.metrics import CallbackMetric, gauge_callback
+from services.concurrency import run_cpu
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+
+# Bumped whenever new documents are indexed. It is part of every cache key,
+# so results computed before an ingest are never served after it.
+_index_generation = 0
+
+
+def bump_index_generation() -> int:
+    """Invalidate cached results after new documents have been indexed"""
+    global _index_generation
+    _index_generation += 1
+    return _index_generation
+
+
+def get_index_generation() -> int:
+    return _index_generation
+
+
+def analysis_cache_key(query: Dict[str, Any], **params: Any) -> str:
+    """
+    Build a cache key from a canonicalized query, any extra parameters and the index generation
+
+    Args:
+        query: Elasticsearch query DSL
+        **params: Other inputs that change the result, e.g. response mode
+
+    Returns:
+        str: Hex digest identifying the result
+    """
+    canonical = json.dumps(
+        {'query': query, 'params': params, 'generation': _index_generation},
+        sort_keys=True,
+        separators=(',', ':'),
+        default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate memory footprint of a result by its serialized size"""
+    return len(json.dumps(value, default=str))
+
+
+class _ComputeCancelled(Exception):
+    """Raised to waiters when the request computing their value was cancelled"""
+
+
+class ResultCache:
+    """
+    LRU cache with TTL expiry and size accounting for /analyse results.
+
+    Concurrent get_or_compute calls for the same key share a single in-flight
+    computation, so a burst of identical dashboard loads issues one set of
+    Elasticsearch queries.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+        clock=time.monotonic
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        # key -> (expires_at, size, value), least recently used first
+        self._entries: "OrderedDict[str, tuple[float, int, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a cached value, or None if it is missing or expired"""
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, size, value = item
+        if expires_at <= self._clock():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def ready(self, key: str) -> bool:
+        """Whether get_or_compute(key) would be served without computing: cached or in flight"""
+        return key in self._inflight or self.get(key) is not None
+
+    def put(self, key: str, value: Any, size: Optional[int] = None) -> None:
+        """Store a value, evicting least recently used entries to stay within the limits"""
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (self._clock() + self.ttl_seconds, size, value)
+        self.total_bytes += size
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.total_bytes = 0
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        cacheable: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """
+        Return the cached value for key, computing it at most once across concurrent callers
+
+        Args:
+            key: Cache key, e.g. from analysis_cache_key
+            compute: Coroutine function producing the value on a miss
+            cacheable: Whether a computed value may be stored; values it rejects are
+                still shared with concurrent callers (default: store every value)
+
+        Returns:
+            The cached or freshly computed value. Errors are propagated to every waiter and not cached.
+            If the caller computing the value is cancelled, one of its waiters computes it instead.
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except _ComputeCancelled:
+                continue
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            # Waiters get the value before it is sized, which serializes it off the event loop
+            future.set_result(value)
+            if cacheable is None or cacheable(value):
+                self.put(key, value, await run_cpu(estimate_size, value))
+            return value
+        except asyncio.CancelledError:
+            if not future.done():
+                future.set_exception(_ComputeCancelled())
+                future.exception()
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+                # Mark the exception retrieved in case nobody else was waiting
+                future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+
+# Shared cache for /analyse results
+result_cache = ResultCache()
+
+CallbackMetric(
+    "danphobic_result_cache_requests_total",
+    "/analyse result cache lookups by result; coalesced requests waited on an in-flight computation",
+    "counter",
+    lambda: [
+        ({'result': 'hit'}, result_cache.hits),
+        ({'result': 'miss'}, result_cache.misses),
+        ({'result': 'coalesced'}, result_cache.coalesced),
+    ]
+)
+gauge_callback("danphobic_result_cache_entries", "Results held in the /analyse result cache", lambda: len(result_cache))
+gauge_callback("danphobic_result_cache_bytes", "Estimated size of the cached /analyse results", lambda: result_cache.total_bytes)
+gauge_callback("danphobic_result_cache_inflight", "/analyse computations in flight", lambda: len(result_cache._inflight))
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from services.metrics import gauge_callback
+from services.profiling import profiled
+import asyncio
+import contextvars
+import os
+
+# Worker threads for CPU-bound analysis (parsing, detectors, insights) so the
+# event loop stays free to serve other requests while it runs
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(min(8, (os.cpu_count() or 1) + 2))))
+
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+
+# Ingest parsing runs on its own, smaller pool: a burst of uploads queues behind other
+# ingest work rather than ahead of interactive /analyse requests
+INGEST_CPU_WORKERS = int(os.getenv("INGEST_CPU_WORKERS", str(max(1, ANALYSIS_WORKERS // 2))))
+
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_CPU_WORKERS, thread_name_prefix="ingest")
+
+
+
+def analysis_queue_depth() -> int:
+    """CPU-bound tasks waiting for an analysis worker thread"""
+    return analysis_executor._work_queue.qsize()
+
+
+def ingest_queue_depth() -> int:
+    """Ingest parsing tasks waiting for an ingest worker thread"""
+    return ingest_executor._work_queue.qsize()
+
+
+gauge_callback("danphobic_analysis_queue_depth", "CPU-bound tasks waiting for an analysis worker thread", analysis_queue_depth)
+gauge_callback("danphobic_ingest_queue_depth", "Ingest parsing tasks waiting for an ingest worker thread", ingest_queue_depth)
+
+
+async def run_cpu(func, *args, **kwargs):
+    """
+    Run a CPU-bound function on the analysis pool without blocking the event loop
+
+    The caller's context is carried over to the worker thread, so the function's
+    stages are attributed to the request that ran it.
+
+    Args:
+        func: Function to run
+        *args, **kwargs: Arguments passed to func
+
+    Returns:
+        The function's return value
+    """
+    return await _run_in(analysis_executor, func, *args, **kwargs)
+
+
+async def run_ingest_cpu(func, *args, **kwargs):
+    """Like run_cpu, on the ingest pool"""
+    return await _run_in(ingest_executor, func, *args, **kwargs)
+
+
+async def _run_in(executor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, partial(context.run, profiled(func), *args, **kwargs))
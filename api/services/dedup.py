@@ -0,0 +1,373 @@
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+# Each storage backend and base index has its own record in a subdirectory
+DEDUP_DIR = os.getenv("DEDUP_DIR", os.path.join(os.path.dirname(__file__), '..', 'data', 'dedup'))
+
+# Lines per Bloom filter segment and the false positive rate of each segment. A false
+# positive skips a new line, so the rate is kept low; a new segment is added when one fills.
+DEDUP_SEGMENT_CAPACITY = int(os.getenv("DEDUP_SEGMENT_CAPACITY", "1000000"))
+DEDUP_ERROR_RATE = float(os.getenv("DEDUP_ERROR_RATE", "0.000001"))
+
+# Identical log lines (same client, second and request) are numbered so each keeps its
+# own document. They are always close together, so only this many recent lines are tracked.
+DUPLICATE_WINDOW = 10000
+
+_SEGMENT_HEADER = struct.Struct('<QQd')
+_SEGMENT_FILE = re.compile(r'^lines-(\d{4}\.\d{2}\.\d{2})-(\d+)\.bloom$')
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 128-bit hex keys"""
+
+    def __init__(self, capacity: int, error_rate: float, count: int = 0, bits: Optional[bytearray] = None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+        self.count = count
+
+    def _positions(self, key: str) -> Iterable[int]:
+        # Double hashing: the key is already a uniform 128-bit digest, so its halves are independent
+        value = int(key, 16)
+        h1 = value & 0xFFFFFFFFFFFFFFFF
+        h2 = (value >> 64) | 1
+        size = self.size
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % size
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key: str) -> None:
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def to_bytes(self) -> bytes:
+        return _SEGMENT_HEADER.pack(self.capacity, self.count, self.error_rate) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        capacity, count, error_rate = _SEGMENT_HEADER.unpack_from(data)
+        return cls(capacity, error_rate, count, bytearray(data[_SEGMENT_HEADER.size:]))
+
+
+class LineKeys:
+    """
+    Derives a deterministic document ID from each line of a log stream.
+
+    The ID is a hash of the line's content, so the same line always maps to the same
+    document no matter which file or upload it arrives in. Repeats of an identical line
+    within the stream get the hash of the line and its occurrence number instead.
+    """
+
+    def __init__(self, window: int = DUPLICATE_WINDOW):
+        self.window = window
+        self._recent: "OrderedDict[bytes, int]" = OrderedDict()
+
+    def key(self, line: str) -> str:
+        digest = hashlib.blake2b(line.rstrip().encode('utf-8'), digest_size=16).digest()
+        occurrence = self._recent.get(digest, -1) + 1
+        self._recent[digest] = occurrence
+        self._recent.move_to_end(digest)
+        if len(self._recent) > self.window:
+            self._recent.popitem(last=False)
+        if occurrence:
+            digest = hashlib.blake2b(digest + occurrence.to_bytes(4, 'big'), digest_size=16).digest()
+        return digest.hex()
+
+
+class DedupIndex:
+    """
+    Local record of what has already been ingested into one backend and base index.
+
+    Whole files are recorded by a fingerprint of their contents, and individual lines by
+    their keys in scalable Bloom filters, so a re-uploaded file or the overlapping part of
+    a rotated log is skipped before it is parsed or indexed. Line keys are kept per day of
+    the daily partition they were written to, so a day that is expired or deleted can be
+    dropped from the record along with the files that had lines in it (see retain_days).
+
+    The record is persisted in its own directory under DEDUP_DIR and is owned by a single
+    process at a time (see claim); other processes ingest without line-level dedup.
+    """
+
+    def __init__(
+        self,
+        path: str = DEDUP_DIR,
+        segment_capacity: int = DEDUP_SEGMENT_CAPACITY,
+        error_rate: float = DEDUP_ERROR_RATE
+    ):
+        self.path = path
+        self.segment_capacity = segment_capacity
+        self.error_rate = error_rate
+        # day -> Bloom filter segments of the lines written to that day's partition
+        self._days: Optional[Dict[str, List[BloomFilter]]] = None
+        self._files: Dict[str, Dict[str, Any]] = {}
+        # Line count of each segment as last written, so unchanged segments aren't rewritten
+        self._saved_counts: Dict[str, List[int]] = {}
+        # Days dropped since the last save, whose segment files are still on disk
+        self._dropped: Set[str] = set()
+        self._dirty = False
+        # Ingest workers check and save the index while the event loop records files, so
+        # changes and snapshots are taken under _lock; _save_lock keeps saves in order
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._lock_file = None
+
+    def claim(self) -> bool:
+        """
+        Take ownership of the record for this process
+
+        Records are loaded once and saved from memory, so two processes sharing one would
+        overwrite each other's additions. The first process to claim a record holds an
+        exclusive lock on it until it exits.
+
+        Returns:
+            bool: Whether this process owns the record
+        """
+        if self._lock_file is not None:
+            return True
+        if fcntl is None:
+            # Without advisory locks, running one API process per record is up to the deployment
+            return True
+        os.makedirs(self.path, exist_ok=True)
+        lock_file = open(os.path.join(self.path, 'lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _load(self) -> Dict[str, List[BloomFilter]]:
+        days = self._days
+        if days is None:
+            with self._lock:
+                days = self._load_locked()
+        return days
+
+    def _load_locked(self) -> Dict[str, List[BloomFilter]]:
+        # Loaded on first use rather than at import
+        if self._days is None:
+            days: Dict[str, List[BloomFilter]] = {}
+            if os.path.isdir(self.path):
+                files_path = os.path.join(self.path, 'files.json')
+                if os.path.exists(files_path):
+                    with open(files_path) as f:
+                        self._files = json.load(f)
+                for day, number, name in sorted(_segment_files(self.path)):
+                    with open(os.path.join(self.path, name), 'rb') as f:
+                        days.setdefault(day, []).append(BloomFilter.from_bytes(f.read()))
+            self._saved_counts = {day: [segment.count for segment in segments] for day, segments in days.items()}
+            self._days = days
+        return self._days
+
+    def might_contain(self, key: str) -> bool:
+        """Whether a line key has (probably) been ingested before"""
+        # Lock-free: segments are only appended to and a lookup racing an add may miss it
+        return any(key in segment for segments in list(self._load().values()) for segment in segments)
+
+    def add(self, day: str, keys: Iterable[str]) -> None:
+        """
+        Record line keys as ingested
+
+        Args:
+            day: Day of the daily partition the lines were written to
+            keys: Keys of lines that were indexed
+        """
+        with self._lock:
+            segments = self._load_locked().setdefault(day, [])
+            for key in keys:
+                if not segments or segments[-1].count >= segments[-1].capacity:
+                    segments.append(BloomFilter(self.segment_capacity, self.error_rate))
+                segments[-1].add(key)
+                self._dirty = True
+
+    def get_file(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Return what was recorded about a previously ingested file, or None"""
+        with self._lock:
+            self._load_locked()
+            return self._files.get(fingerprint)
+
+    def add_file(self, fingerprint: str, filename: str, lines: int, days: Iterable[str] = (), skipped: int = 0) -> None:
+        """
+        Record a fully ingested file
+
+        Args:
+            fingerprint: Hash of the file's contents
+            filename: Name it was uploaded as
+            lines: Lines parsed from it
+            days: Days of the daily partitions its lines were written to
+            skipped: Lines skipped as already recorded. Their days aren't known, so the
+                file then depends on every day recorded so far.
+        """
+        with self._lock:
+            recorded = self._load_locked()
+            days = set(days)
+            if skipped:
+                days.update(recorded)
+            previous = self._files.get(fingerprint)
+            if previous is not None:
+                days.update(previous.get('days', ()))
+            self._files[fingerprint] = {
+                'filename': filename,
+                'lines': lines,
+                'days': sorted(days),
+                'ingested_at': time.time(),
+            }
+            self._dirty = True
+
+    def retain_days(self, days: Iterable[str]) -> List[str]:
+        """
+        Drop every day not in days, e.g. the partitions a backend still has, so lines
+        and files are ingested again once their logs have been expired or deleted
+
+        Returns:
+            List[str]: The days dropped
+        """
+        keep = set(days)
+        with self._lock:
+            recorded = self._load_locked()
+            dropped = sorted(day for day in recorded if day not in keep)
+            for day in dropped:
+                del recorded[day]
+                self._saved_counts.pop(day, None)
+                self._dropped.add(day)
+            # Files recorded before days were tracked can't be matched to theirs, so they go too
+            stale = [
+                fingerprint for fingerprint, record in self._files.items()
+                if 'days' not in record or not keep.issuperset(record['days'])
+            ]
+            for fingerprint in stale:
+                del self._files[fingerprint]
+            if dropped or stale:
+                self._dirty = True
+        return dropped
+
+    def save(self) -> None:
+        """Persist any changes to disk"""
+        with self._save_lock:
+            # Snapshot under the lock; changes made while the files are written mark the
+            # index dirty again and go out with the next save
+            with self._lock:
+                if not self._dirty:
+                    return
+                counts = {day: [segment.count for segment in segments] for day, segments in (self._days or {}).items()}
+                changed = []
+                for day, segments in (self._days or {}).items():
+                    saved = self._saved_counts.get(day, [])
+                    changed.extend(
+                        (day, i, segment.to_bytes()) for i, segment in enumerate(segments)
+                        if i >= len(saved) or saved[i] != counts[day][i]
+                    )
+                dropped, self._dropped = self._dropped, set()
+                files = json.dumps(self._files).encode('utf-8')
+                self._dirty = False
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                for day, number, name in _segment_files(self.path):
+                    if day in dropped:
+                        os.remove(os.path.join(self.path, name))
+                for day, i, data in changed:
+                    self._write(f"lines-{day}-{i}.bloom", data)
+                self._write('files.json', files)
+            except BaseException:
+                with self._lock:
+                    self._dirty = True
+                    self._dropped |= dropped
+                raise
+            with self._lock:
+                self._saved_counts = counts
+
+    def _write(self, name: str, data: bytes) -> None:
+        path = os.path.join(self.path, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            segments = [segment for day in self._load_locked().values() for segment in day]
+            return {
+                'files': len(self._files),
+                'days': len(self._days),
+                'lines': sum(segment.count for segment in segments),
+                'segments': len(segments),
+                'bytes': sum(len(segment.bits) for segment in segments),
+            }
+
+
+def _segment_files(path: str) -> List[Tuple[str, int, str]]:
+    """(day, segment number, file name) of each segment file in a record's directory"""
+    segments = []
+    for name in os.listdir(path):
+        match = _SEGMENT_FILE.match(name)
+        if match:
+            segments.append((match.group(1), int(match.group(2)), name))
+    return segments
+
+
+def _scope_directory(scope: str) -> str:
+    """A readable directory name that is unique to a dedup scope"""
+    readable = re.sub(r'[^A-Za-z0-9_.-]+', '_', scope).strip('_')[-80:]
+    return f"{readable}-{hashlib.blake2b(scope.encode('utf-8'), digest_size=6).hexdigest()}"
+
+
+# Records by StorageBackend.dedup_scope; None where another process owns the record
+_records: Dict[str, Optional[DedupIndex]] = {}
+
+
+async def dedup_for(backend) -> Optional[DedupIndex]:
+    """
+    The dedup record of a storage backend's base index, without the days the backend no
+    longer has. Call it when an ingest starts, so logs whose partitions have been expired
+    or deleted since are indexed again rather than skipped.
+
+    Args:
+        backend: Storage backend (see services/storage.py) the ingest writes to
+
+    Returns:
+        The record, or None if dedup is disabled, the backend has no persistent scope or
+        another process owns the record
+    """
+    scope = getattr(backend, 'dedup_scope', None) if DEDUP_ENABLED else None
+    if scope is None:
+        return None
+    if scope not in _records:
+        record = DedupIndex(os.path.join(DEDUP_DIR, _scope_directory(scope)))
+        if not record.claim():
+            print(f"Dedup record {record.path} is in use by another process; ingesting without line dedup")
+            record = None
+        _records[scope] = record
+    record = _records[scope]
+    if record is not None:
+        days = await backend.days()
+        if await asyncio.to_thread(record.retain_days, days):
+            await asyncio.to_thread(record.save)
+    return record
+
+
@@ -1,12 +1,55 @@
-from elasticsearch import Elasticsearch
 from dotenv import load_dotenv
+from functools import lru_cache
 import os
 
 load_dotenv()
 
-es = Elasticsearch(
-    os.getenv("ELASTIC_URL"),
-    api_key=os.getenv("ELASTIC_API_KEY"),
-)
+# Connection pool and timeout settings shared by both clients
+ELASTIC_CONNECTIONS_PER_NODE = int(os.getenv("ELASTIC_CONNECTIONS_PER_NODE", "25"))
+ELASTIC_REQUEST_TIMEOUT = float(os.getenv("ELASTIC_REQUEST_TIMEOUT", "30"))
+ELASTIC_MAX_RETRIES = int(os.getenv("ELASTIC_MAX_RETRIES", "3"))
 
-es_index = os.getenv("ELASTIC_INDEX")
\ No newline at end of file
+es_index = os.getenv("ELASTIC_INDEX")
+
+# The clients are built on first use rather than at import: importing elasticsearch
+# (and its HTTP stack) is a large share of the API's cold start, and the SQLite
+# storage backend never needs it. `es` and `aes` remain importable from this module.
+
+
+@lru_cache(maxsize=None)
+def get_es():
+    """Blocking client, for scripts"""
+    from elasticsearch import Elasticsearch
+    return Elasticsearch(
+        os.getenv("ELASTIC_URL"),
+        api_key=os.getenv("ELASTIC_API_KEY"),
+        connections_per_node=ELASTIC_CONNECTIONS_PER_NODE,
+        request_timeout=ELASTIC_REQUEST_TIMEOUT,
+        max_retries=ELASTIC_MAX_RETRIES,
+        retry_on_timeout=True,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_aes():
+    """Non-blocking client for the FastAPI handlers. Set ELASTIC_STUB=1 to index into memory instead."""
+    if os.getenv("ELASTIC_STUB") == "1":
+        from services.stub_elastic import StubAsyncElasticsearch
+        return StubAsyncElasticsearch()
+    from elasticsearch import AsyncElasticsearch
+    return AsyncElasticsearch(
+        os.getenv("ELASTIC_URL"),
+        api_key=os.getenv("ELASTIC_API_KEY"),
+        connections_per_node=ELASTIC_CONNECTIONS_PER_NODE,
+        request_timeout=ELASTIC_REQUEST_TIMEOUT,
+        max_retries=ELASTIC_MAX_RETRIES,
+        retry_on_timeout=True,
+    )
+
+
+def __getattr__(name: str):
+    if name == 'aes':
+        return get_aes()
+    if name == 'es':
+        return get_es()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,239 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import Counter, OrderedDict
+from datetime import datetime
+from heapq import merge
+from itertools import islice
+from services.storage import StorageBackend
+from services.elastic import es_index
+from services.aggregations import MAX_TERMS, minute_buckets, parse_requests_per_minute
+from services.analysis import build_analysis, collect_analysis
+from services.row_detectors import DEFAULT_MAX_EXAMPLES, DEFAULT_SAMPLE_SIZE
+from services.metrics import SITE_ANALYSIS_SECONDS
+import asyncio
+import os
+import re
+import time
+
+# Sites that can be analysed together, as comma-separated name=index pairs, e.g.
+# SITES=shop=logs-shop,blog=logs-blog. Each index is a base name with its own daily
+# indices; one base name shouldn't be the prefix of another's daily indices.
+SITES: Dict[str, str] = dict(
+    (name.strip(), index.strip())
+    for name, _, index in (pair.partition('=') for pair in os.getenv("SITES", "").split(','))
+    if name.strip() and index.strip()
+)
+
+# Seconds each site has to return its part of a fleet-wide analysis before it is left out
+SITE_TIMEOUT = float(os.getenv("SITE_TIMEOUT", "30"))
+
+# ?indices= accepts the configured sites' indices (and ELASTIC_INDEX) only, unless
+# ALLOW_RAW_INDICES=1; raw names must then be plain index names, with no wildcards,
+# dots or separators that would reach other indices or leave the archive directory
+ALLOW_RAW_INDICES = os.getenv("ALLOW_RAW_INDICES", "0") == "1"
+INDEX_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,99}$')
+
+# Backends kept for raw index names; configured sites' backends are always kept
+RAW_INDEX_BACKENDS = int(os.getenv("RAW_INDEX_BACKENDS", "16"))
+
+# Sections of the aggregates that are plain counts, summed across sites
+COUNT_SECTIONS = ('status_counts', 'method_counts', 'request_counts', 'path_counts', 'user_agent_counts')
+
+# The high-cardinality ones stay top-K like a single site's terms aggregation
+TOP_K_SECTIONS = {'request_counts', 'path_counts', 'user_agent_counts'}
+
+ENTRY_SECTIONS = ('suspicious_user_agents', 'sensitive_endpoint_access', 'attack_signatures')
+
+# Per-site backends, built once per base backend and index. Those for raw index names
+# are least recently used first and capped at RAW_INDEX_BACKENDS.
+_site_backends: Dict[Tuple[StorageBackend, str], StorageBackend] = {}
+_raw_backends: "OrderedDict[Tuple[StorageBackend, str], StorageBackend]" = OrderedDict()
+
+
+def site_backend(backend: StorageBackend, index: str) -> StorageBackend:
+    """The backend for one site's index"""
+    if index == backend.index:
+        return backend
+    key = (backend, index)
+    site = _site_backends.get(key)
+    if site is not None:
+        return site
+    if index in SITES.values():
+        site = _site_backends[key] = backend.for_index(index)
+        return site
+    site = _raw_backends.get(key)
+    if site is None:
+        site = _raw_backends[key] = backend.for_index(index)
+        # Evicted backends are dropped rather than closed, as a running analysis may hold one
+        while len(_raw_backends) > RAW_INDEX_BACKENDS:
+            _raw_backends.popitem(last=False)
+    else:
+        _raw_backends.move_to_end(key)
+    return site
+
+
+def _top(counts: Counter, size: int) -> Dict[Any, int]:
+    return dict(sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))[:size])
+
+
+def merge_aggregates(parts: List[Dict[str, Any]], max_terms: int = MAX_TERMS) -> Dict[str, Any]:
+    """
+    Combine per-site aggregates in the parse_aggregations shape
+
+    Counts are summed and the per-minute series added minute by minute. A path's errors
+    are summed over the sites that reported it, so a path below the error threshold on
+    every site is still missing, as it would be for each site alone.
+    """
+    merged: Dict[str, Any] = {}
+    for section in COUNT_SECTIONS:
+        counts: Counter = Counter()
+        for part in parts:
+            counts.update(part[section])
+        merged[section] = _top(counts, max_terms) if section in TOP_K_SECTIONS else dict(counts)
+    # An IP seen by several sites is counted once per site, so ips is an upper bound
+    merged['request_count_stats'] = {
+        'ips': max(sum(part['request_count_stats']['ips'] for part in parts), len(merged['request_counts'])),
+        'requests': sum(part['request_count_stats']['requests'] for part in parts),
+    }
+    # Both series share the key_as_string minutes of the date histogram
+    minutes: Dict[str, List[int]] = {}
+    for part in parts:
+        for minute, bots, humans in part['bot_vs_human_traffic']:
+            counts = minutes.setdefault(minute[:16], [0, 0])
+            counts[0] += bots + humans
+            counts[1] += bots
+    merged['requests_per_minute'], merged['bot_vs_human_traffic'] = parse_requests_per_minute(
+        minute_buckets({minute: tuple(counts) for minute, counts in minutes.items()})
+    )
+    error_paths: Dict[str, Counter] = {}
+    for part in parts:
+        for path, statuses in part['error_paths'].items():
+            error_paths.setdefault(path, Counter()).update(statuses)
+    merged['error_paths'] = {
+        path: dict(sorted(statuses.items(), key=lambda item: (-item[1], item[0])))
+        for path, statuses in sorted(error_paths.items(), key=lambda item: (-sum(item[1].values()), item[0]))[:max_terms]
+    }
+    return merged
+
+
+def _time_order(log) -> Tuple[bool, datetime]:
+    return log.timestamp is None, log.timestamp or datetime.min
+
+
+def merge_rows(parts: List[Dict[str, Any]], max_examples: int = DEFAULT_MAX_EXAMPLES, sample_size: int = DEFAULT_SAMPLE_SIZE) -> Dict[str, Any]:
+    """
+    Combine per-site RowDetectors results without running the detectors again
+
+    Every site keeps the earliest entries as evidence and sample, so merging them in time
+    order gives the earliest across sites; totals are summed. An IP that bursts on several
+    sites keeps its earliest burst.
+    """
+    merged: Dict[str, Any] = {
+        'logs': list(islice(merge(*(part['logs'] for part in parts), key=_time_order), sample_size)),
+        'detector_totals': {section: Counter() for section in ENTRY_SECTIONS},
+        'burst_requests': {},
+    }
+    for section in ENTRY_SECTIONS:
+        totals: Counter = Counter()
+        for part in parts:
+            totals.update(part['detector_totals'][section])
+        examples = {
+            key: list(islice(merge(*(part[section].get(key, []) for part in parts), key=_time_order), max_examples))
+            for key in dict.fromkeys(key for part in parts for key in part[section])
+        }
+        # Keys in order of their first entry, as a single detector pass would add them
+        merged[section] = dict(sorted(examples.items(), key=lambda item: _time_order(item[1][0]) if item[1] else (True, datetime.max)))
+        merged['detector_totals'][section] = {key: totals[key] for key in dict.fromkeys([*merged[section], *totals])}
+    bursts: Dict[str, List[Any]] = {}
+    for part in parts:
+        for ip, window in part['burst_requests'].items():
+            current = bursts.get(ip)
+            if current is None or _time_order(window[0][0]) < _time_order(current[0][0]):
+                bursts[ip] = window
+    merged['burst_requests'] = dict(sorted(bursts.items(), key=lambda item: _time_order(item[1][0][0])))
+    return merged
+
+
+async def run_fleet_analysis(
+    query: Dict[str, Any],
+    sites: Dict[str, str],
+    backend: StorageBackend,
+    timeout: float = SITE_TIMEOUT,
+    max_rows: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Run one analysis over several sites' logs
+
+    Every site's aggregates and detector results are retrieved concurrently, so the
+    request takes about as long as the slowest site; they are then merged and the
+    checks run once over the merged results. A site that fails or takes longer than
+    timeout is left out and the result is marked partial.
+
+    Args:
+        query: Elasticsearch query DSL, applied to every site
+        sites: Site names and their base index names
+        backend: Storage backend the sites' indices are in
+        timeout: Seconds each site has to respond
+        max_rows: Limit on the logs each site's row-based detectors see
+
+    Returns:
+        Dict[str, Any]: The /analyse response without the AI summary, plus per-site
+        status under "sites" and "partial"
+
+    Raises:
+        RuntimeError: If no site responded
+    """
+    async def collect(site: str, index: str):
+        start = time.perf_counter()
+        try:
+            total, aggregates, rows = await asyncio.wait_for(collect_analysis(query, site_backend(backend, index), max_rows), timeout)
+            outcome, error = 'ok', None
+        except asyncio.TimeoutError:
+            total, aggregates, rows = 0, None, None
+            outcome, error = 'timeout', f"No response within {timeout:g}s"
+        except Exception as e:
+            total, aggregates, rows = 0, None, None
+            outcome, error = 'error', str(e)
+        seconds = time.perf_counter() - start
+        SITE_ANALYSIS_SECONDS.labels(outcome).observe(seconds)
+        status = {'index': index, 'status': outcome, 'total': total, 'seconds': round(seconds, 3)}
+        if error is not None:
+            status['error'] = error
+        return site, status, aggregates, rows
+
+    results = await asyncio.gather(*(collect(site, index) for site, index in sites.items()))
+    statuses = {site: status for site, status, _, _ in results}
+    responded = [(aggregates, rows) for _, status, aggregates, rows in results if status['status'] == 'ok']
+    if not responded:
+        raise RuntimeError("No site responded: " + "; ".join(f"{site}: {status['error']}" for site, status in statuses.items()))
+    fleet = {'sites': statuses, 'partial': len(responded) < len(sites)}
+
+    total = sum(status['total'] for status in statuses.values())
+    if not total:
+        return {"message": "No logs found", "logs": [], **fleet}
+    with_logs = [(aggregates, rows) for aggregates, rows in responded if rows is not None]
+    aggregates = merge_aggregates([aggregates for aggregates, _ in with_logs])
+    rows = merge_rows([rows for _, rows in with_logs])
+    return {**await build_analysis(total, aggregates, rows), **fleet}
+
+
+def resolve_sites(names: Optional[List[str]], indices: Optional[List[str]]) -> Dict[str, str]:
+    """
+    Sites to analyse from the request: configured site names and/or raw index names
+
+    Raises:
+        KeyError: For a site name that isn't in SITES, or an index name that isn't allowed
+    """
+    sites: Dict[str, str] = {}
+    for name in names or []:
+        if name == '*':
+            sites.update(SITES)
+        elif name in SITES:
+            sites[name] = SITES[name]
+        else:
+            raise KeyError(name)
+    configured = set(SITES.values()) | {es_index}
+    for index in indices or []:
+        if index not in configured and not (ALLOW_RAW_INDICES and INDEX_NAME.match(index)):
+            raise KeyError(index)
+        sites[index] = index
+    return sites
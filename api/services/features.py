@@ -0,0 +1,269 @@
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import time
+
+# Idle IPs are dropped from the table after this many seconds without a request
+DEFAULT_TTL_SECONDS = 6 * 60 * 60
+
+# Cap on distinct values tracked per IP so a single scanner can't grow the table unbounded
+MAX_DISTINCT_VALUES = 1000
+
+
+def _field(entry: Any, name: str, default: Any = None) -> Any:
+    """Read a field from either a parsed log dict or a LogEntry object"""
+    if isinstance(entry, dict):
+        return entry.get(name, default)
+    return getattr(entry, name, default)
+
+
+def _timestamp(entry: Any) -> Optional[float]:
+    """Return the entry's request time as a POSIX timestamp, or None if it can't be decoded"""
+    value = _field(entry, 'datetime')
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+class IPFeatures:
+    """Incrementally maintained request features for a single IP address"""
+
+    __slots__ = (
+        'request_count', 'error_count', 'bytes_sent', 'user_agents', 'paths',
+        'first_seen', 'last_seen', 'interarrival_count', 'interarrival_mean',
+        'interarrival_m2', 'touched_at'
+    )
+
+    def __init__(self):
+        self.request_count = 0
+        self.error_count = 0
+        self.bytes_sent = 0
+        self.user_agents = set()
+        self.paths = set()
+        self.first_seen = None
+        self.last_seen = None
+        # Welford running mean/variance of the gaps between consecutive requests
+        self.interarrival_count = 0
+        self.interarrival_mean = 0.0
+        self.interarrival_m2 = 0.0
+        self.touched_at = 0.0
+
+    def update(self, entry: Any) -> None:
+        """Fold a single log entry into the features"""
+        self.request_count += 1
+
+        status = _field(entry, 'status', 0) or 0
+        if 400 <= status < 600:
+            self.error_count += 1
+
+        self.bytes_sent += _field(entry, 'body_bytes_sent', 0) or 0
+
+        user_agent = _field(entry, 'http_user_agent')
+        if user_agent is not None and len(self.user_agents) < MAX_DISTINCT_VALUES:
+            self.user_agents.add(user_agent)
+
+        path = _field(entry, 'path')
+        if path is not None and len(self.paths) < MAX_DISTINCT_VALUES:
+            self.paths.add(path.split('?')[0])
+
+        ts = _timestamp(entry)
+        if ts is None:
+            return
+        if self.last_seen is not None and ts >= self.last_seen:
+            gap = ts - self.last_seen
+            self.interarrival_count += 1
+            delta = gap - self.interarrival_mean
+            self.interarrival_mean += delta / self.interarrival_count
+            self.interarrival_m2 += delta * (gap - self.interarrival_mean)
+        if self.first_seen is None or ts < self.first_seen:
+            self.first_seen = ts
+        if self.last_seen is None or ts > self.last_seen:
+            self.last_seen = ts
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the features as a JSON-friendly dictionary"""
+        variance = self.interarrival_m2 / self.interarrival_count if self.interarrival_count else 0.0
+        return {
+            'request_count': self.request_count,
+            'distinct_user_agents': len(self.user_agents),
+            'distinct_paths': len(self.paths),
+            'error_ratio': self.error_count / self.request_count if self.request_count else 0.0,
+            'bytes_sent': self.bytes_sent,
+            'interarrival_mean': self.interarrival_mean,
+            'interarrival_std': variance ** 0.5,
+            'first_seen': datetime.fromtimestamp(self.first_seen).isoformat() if self.first_seen is not None else None,
+            'last_seen': datetime.fromtimestamp(self.last_seen).isoformat() if self.last_seen is not None else None,
+        }
+
+
+class IPFeatureStore:
+    """
+    Per-IP feature table updated as entries are ingested.
+
+    Alongside the per-IP features the store keeps the running sum and sum of
+    squares of request counts across all tracked IPs, so the mean and standard
+    deviation needed for z-scores are available in O(1) instead of being
+    recomputed from raw rows on every query.
+    """
+
+    def __init__(self, ttl_seconds: float = DEFAULT_TTL_SECONDS, clock=time.monotonic):
+        """
+        Args:
+            ttl_seconds: Seconds an IP may stay idle before it is evicted
+            clock: Monotonic time source, overridable for testing
+        """
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        # Ordered by last update so the idle IPs are always at the front
+        self._features: "OrderedDict[str, IPFeatures]" = OrderedDict()
+        self._count_sum = 0
+        self._count_sq_sum = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._features)
+
+    def __contains__(self, ip: str) -> bool:
+        with self._lock:
+            return ip in self._features
+
+    def update(self, entry: Any) -> None:
+        """Fold a single parsed log entry into the table"""
+        with self._lock:
+            self._update(entry, self._clock())
+
+    def ingest(self, entries: List[Any]) -> int:
+        """
+        Fold a batch of parsed log entries into the table and evict idle IPs
+
+        Args:
+            entries: Parsed log dicts or LogEntry objects
+
+        Returns:
+            int: Number of entries ingested
+        """
+        now = self._clock()
+        with self._lock:
+            for entry in entries:
+                self._update(entry, now)
+            self._evict(now)
+        return len(entries)
+
+    def _update(self, entry: Any, now: float) -> None:
+        ip = _field(entry, 'remote_addr')
+        if not ip:
+            return
+
+        features = self._features.get(ip)
+        if features is None:
+            features = IPFeatures()
+            self._features[ip] = features
+        else:
+            self._features.move_to_end(ip)
+
+        # Count goes c -> c + 1, so the sum of squares grows by 2c + 1
+        self._count_sum += 1
+        self._count_sq_sum += 2 * features.request_count + 1
+        features.update(entry)
+        features.touched_at = now
+
+    def evict_idle(self) -> int:
+        """
+        Drop IPs that have not been updated within the TTL
+
+        Returns:
+            int: Number of IPs evicted
+        """
+        with self._lock:
+            return self._evict(self._clock())
+
+    def _evict(self, now: float) -> int:
+        evicted = 0
+        cutoff = now - self.ttl_seconds
+        while self._features:
+            ip, features = next(iter(self._features.items()))
+            if features.touched_at > cutoff:
+                break
+            del self._features[ip]
+            self._count_sum -= features.request_count
+            self._count_sq_sum -= features.request_count ** 2
+            evicted += 1
+        return evicted
+
+    def get(self, ip: str) -> Optional[Dict[str, Any]]:
+        """Return the features for an IP, or None if it is not tracked"""
+        with self._lock:
+            features = self._features.get(ip)
+            return features.to_dict() if features is not None else None
+
+    def count_stats(self) -> tuple[float, float]:
+        """
+        Return the mean and population standard deviation of request counts across tracked IPs
+        """
+        with self._lock:
+            return self._count_stats()
+
+    def _count_stats(self) -> tuple[float, float]:
+        n = len(self._features)
+        if not n:
+            return 0.0, 0.0
+        mean = self._count_sum / n
+        variance = max(self._count_sq_sum / n - mean ** 2, 0.0)
+        return mean, variance ** 0.5
+
+    def anomaly_score(self, ip: str) -> Optional[Dict[str, Any]]:
+        """
+        Score an IP against the current population in O(1)
+
+        Args:
+            ip: IP address to score
+
+        Returns:
+            Optional[Dict[str, Any]]: Volume z-score and bot-likeness signals, or None if the IP is not tracked
+        """
+        with self._lock:
+            features = self._features.get(ip)
+            if features is None:
+                return None
+
+            mean, std_dev = self._count_stats()
+            z_score = (features.request_count - mean) / std_dev if std_dev else 0.0
+            return {
+                'ip': ip,
+                'request_count': features.request_count,
+                'z_score': z_score,
+                # Same heuristic as analysis/anomaly_detect.py: many requests from a single UA
+                'bot_like': features.request_count > 100 and len(features.user_agents) < 2,
+                'error_ratio': features.error_count / features.request_count,
+            }
+
+    def high_frequency_ips(self, std_dev_threshold: float = 2.0) -> Dict[str, int]:
+        """
+        Return IPs whose request count is more than std_dev_threshold standard deviations above the mean
+
+        Args:
+            std_dev_threshold: Number of standard deviations above mean to consider suspicious (default: 2.0)
+
+        Returns:
+            dict[str, int]: Dictionary mapping suspicious IPs to their request counts
+        """
+        # Ingest workers update the table concurrently, so the scan holds the lock
+        with self._lock:
+            mean, std_dev = self._count_stats()
+            threshold = mean + (std_dev_threshold * std_dev)
+            return {
+                ip: features.request_count
+                for ip, features in self._features.items()
+                if features.request_count > threshold
+            }
+
+
+# Shared table fed by /upload and read by the feature endpoints
+feature_store = IPFeatureStore()
@@ -1,8 +1,87 @@
-import google.generativeai as genai
 from dotenv import load_dotenv
+from typing import Optional
+from functools import lru_cache
+from services.metrics import GEMINI_SECONDS
+import asyncio
 import os
+import time
 
 load_dotenv()
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-gemini_model = genai.GenerativeModel("gemini-2.0-flash")
+
+class StubGeminiModel:
+    """
+    Local stand-in for the Gemini model, used for tests and offline development.
+    Echoes the first few lines of the <insights> section back as bullet points.
+    """
+
+    class Response:
+        def __init__(self, text: str):
+            self.text = text
+
+    def generate_content(self, prompt: str) -> "StubGeminiModel.Response":
+        insights = prompt.split('<insights>', 1)[-1].split('</insights>', 1)[0]
+        insights = insights.split('Key insights:', 1)[-1]
+        points = [part.strip(" []'\"") for part in insights.split("', '") if part.strip(" []'\"")]
+        return self.Response("\n".join(f"- {point}" for point in points[:7]))
+
+    async def generate_content_async(self, prompt: str) -> "StubGeminiModel.Response":
+        return self.generate_content(prompt)
+
+
+@lru_cache(maxsize=None)
+def get_gemini_model():
+    """
+    The model summaries are generated with, configured on first use: importing
+    google.generativeai takes most of a second, so it is kept out of module import
+    and done at startup (see the lifespan in main.py) or by the first summary.
+    Set GEMINI_STUB=1 to run without the real model.
+    """
+    if os.getenv("GEMINI_STUB") == "1":
+        return StubGeminiModel()
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai.GenerativeModel("gemini-2.0-flash")
+
+# Bound how long and how many summaries we wait on at once
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "20"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+
+_gemini_semaphore = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    # Created lazily so it binds to the running event loop
+    global _gemini_semaphore
+    if _gemini_semaphore is None:
+        _gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    return _gemini_semaphore
+
+
+async def generate_content_async(prompt: str, timeout: float = GEMINI_TIMEOUT_SECONDS) -> Optional[str]:
+    """
+    Generate content without blocking the event loop
+
+    Args:
+        prompt: Prompt to send to the model
+        timeout: Seconds to wait for the response before giving up
+
+    Returns:
+        Optional[str]: The generated text, or None if the call timed out or failed
+    """
+    model = get_gemini_model()
+    async with _get_semaphore():
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = await asyncio.wait_for(model.generate_content_async(prompt), timeout)
+            outcome = 'ok'
+            return response.text
+        except asyncio.TimeoutError:
+            outcome = 'timeout'
+            print(f"Gemini request timed out after {timeout}s")
+        except Exception as e:
+            print(f"Error generating content: {str(e)}")
+        finally:
+            GEMINI_SECONDS.labels(outcome).observe(time.perf_counter() - start)
+    return None
@@ -0,0 +1,237 @@
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import os
+
+# Logs are written to one index per day, f"{base}-{date}", named after the day in the
+# entry's own timestamp. Content-derived document IDs then always land in the same index.
+INDEX_DATE_FORMAT = '%Y.%m.%d'
+
+# Daily indices older than this many days are deleted by expire_indices (0 keeps everything)
+ELASTIC_RETENTION_DAYS = int(os.getenv("ELASTIC_RETENTION_DAYS", "0"))
+
+# Wider time ranges search the whole pattern and rely on Elasticsearch skipping shards
+# that can't match, rather than sending a very long index list
+MAX_TARGET_INDICES = 62
+
+# Log timestamps are stored in the server's local time without an offset, while queries
+# usually arrive in UTC. Targeting a day either side absorbs the difference.
+RANGE_PADDING = timedelta(days=1)
+
+INDEX_SETTINGS = {
+    'number_of_shards': 1,
+    'codec': 'best_compression',
+    'refresh_interval': '5s',
+}
+
+INDEX_MAPPINGS = {
+    'dynamic': False,
+    'properties': {
+        'remote_addr': {'type': 'ip'},
+        'remote_user': {'type': 'keyword', 'ignore_above': 256},
+        'time_local': {'type': 'keyword', 'index': False, 'doc_values': False},
+        'request': {'type': 'keyword', 'ignore_above': 2048, 'doc_values': False},
+        'status': {'type': 'short'},
+        'body_bytes_sent': {'type': 'long'},
+        'http_referer': {'type': 'keyword', 'ignore_above': 2048},
+        'http_user_agent': {
+            'type': 'keyword',
+            'ignore_above': 1024,
+            'fields': {'text': {'type': 'text', 'norms': False}}
+        },
+        # The parser keeps the raw text of a timestamp it can't read; such documents are
+        # still indexed, just without a searchable datetime
+        'datetime': {'type': 'date', 'format': 'strict_date_optional_time||epoch_millis', 'ignore_malformed': True},
+        'method': {'type': 'keyword', 'ignore_above': 32},
+        'path': {'type': 'keyword', 'ignore_above': 2048},
+        'protocol': {'type': 'keyword', 'ignore_above': 32},
+        'attack_tags': {'type': 'keyword'},
+    }
+}
+
+
+def index_pattern(base: str) -> str:
+    return f"{base}-*"
+
+
+def daily_index(base: str, when: Any, fallback: Optional[datetime] = None) -> str:
+    """
+    Name of the daily index a log entry belongs in
+
+    Entries without a parsed timestamp go in the daily index of the day they were
+    ingested, so they are still searched by unbounded queries and expire with it.
+
+    Args:
+        base: Base index name (ELASTIC_INDEX)
+        when: The entry's datetime
+        fallback: Ingest time used for entries without one (default: now)
+
+    Returns:
+        str: Index name
+    """
+    if not isinstance(when, datetime):
+        when = fallback or datetime.now()
+    return f"{base}-{when.strftime(INDEX_DATE_FORMAT)}"
+
+
+def index_template(base: str) -> Dict[str, Any]:
+    """Composable index template applied to every daily index"""
+    return {
+        'index_patterns': [index_pattern(base)],
+        'priority': 200,
+        'template': {
+            'settings': INDEX_SETTINGS,
+            'mappings': INDEX_MAPPINGS,
+        },
+    }
+
+
+async def ensure_index_template(client, base: str) -> None:
+    """Install or update the index template for the daily indices"""
+    await client.indices.put_index_template(name=f"{base}-template", **index_template(base))
+
+
+def _parse_bound(value: Any) -> Optional[datetime]:
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+    if not isinstance(value, str):
+        return None
+    if value.startswith('now'):
+        # Only plain "now" is resolved; date math leaves the bound open
+        return datetime.now(timezone.utc).replace(tzinfo=None) if value == 'now' else None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def query_time_range(query: Dict[str, Any], field: str = 'datetime') -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Find the time range a query is restricted to
+
+    Only range clauses every match must satisfy are considered: the query itself and
+    bool must/filter clauses, recursively. Bounds that can't be parsed are left open.
+
+    Args:
+        query: Elasticsearch query DSL
+        field: Date field to look for
+
+    Returns:
+        Tuple of (start, end), either of which may be None for an open bound
+    """
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+    def visit(clause: Any):
+        nonlocal start, end
+        if isinstance(clause, list):
+            for item in clause:
+                visit(item)
+            return
+        if not isinstance(clause, dict):
+            return
+        bounds = clause.get('range', {}).get(field)
+        if isinstance(bounds, dict):
+            lower = _parse_bound(bounds.get('gte', bounds.get('gt', bounds.get('from'))))
+            upper = _parse_bound(bounds.get('lte', bounds.get('lt', bounds.get('to'))))
+            if lower is not None and (start is None or lower > start):
+                start = lower
+            if upper is not None and (end is None or upper < end):
+                end = upper
+        bool_query = clause.get('bool')
+        if isinstance(bool_query, dict):
+            visit(bool_query.get('must'))
+            visit(bool_query.get('filter'))
+
+    visit(query)
+    return start, end
+
+
+def target_indices(base: str, query: Dict[str, Any]) -> str:
+    """
+    Indices a query needs to search: the daily indices overlapping its time range
+
+    Args:
+        base: Base index name (ELASTIC_INDEX)
+        query: Elasticsearch query DSL
+
+    Returns:
+        str: Comma-separated index names, or the daily index pattern for unbounded queries
+    """
+    start, end = query_time_range(query)
+    if start is None or end is None:
+        return index_pattern(base)
+    if end < start:
+        # Nothing can match; search a single day so Elasticsearch still returns an empty result
+        end = start
+    day = (start - RANGE_PADDING).date()
+    last = (end + RANGE_PADDING).date()
+    if (last - day).days + 1 > MAX_TARGET_INDICES:
+        return index_pattern(base)
+    names: List[str] = []
+    while day <= last:
+        names.append(f"{base}-{day.strftime(INDEX_DATE_FORMAT)}")
+        day += timedelta(days=1)
+    return ','.join(names)
+
+
+async def index_days(client, base: str) -> List[str]:
+    """
+    Days (in INDEX_DATE_FORMAT) that have a daily index
+
+    Args:
+        client: AsyncElasticsearch client
+        base: Base index name (ELASTIC_INDEX)
+    """
+    from elasticsearch import NotFoundError
+    try:
+        existing = await client.indices.get(index=index_pattern(base), expand_wildcards='open,closed')
+    except NotFoundError:
+        return []
+    days = []
+    for name in existing:
+        day = name[len(base) + 1:]
+        try:
+            datetime.strptime(day, INDEX_DATE_FORMAT)
+        except ValueError:
+            continue
+        days.append(day)
+    return sorted(days)
+
+
+async def expire_indices(client, base: str, retention_days: int = ELASTIC_RETENTION_DAYS, today: Optional[datetime] = None) -> List[str]:
+    """
+    Delete daily indices older than the retention period. Dropping a whole index is
+    far cheaper than deleting its documents by query.
+
+    Args:
+        client: AsyncElasticsearch client
+        base: Base index name (ELASTIC_INDEX)
+        retention_days: Days of logs to keep; 0 keeps everything
+        today: Reference date (default: now)
+
+    Returns:
+        List[str]: Names of the deleted indices
+    """
+    if retention_days <= 0:
+        return []
+    from elasticsearch import NotFoundError
+    cutoff = ((today or datetime.now()) - timedelta(days=retention_days)).date()
+    try:
+        existing = await client.indices.get(index=index_pattern(base), expand_wildcards='open,closed')
+    except NotFoundError:
+        return []
+
+    expired = []
+    for name in existing:
+        try:
+            day = datetime.strptime(name[len(base) + 1:], INDEX_DATE_FORMAT).date()
+        except ValueError:
+            continue
+        if day < cutoff:
+            expired.append(name)
+    for name in expired:
+        await client.indices.delete(index=name)
+    return expired
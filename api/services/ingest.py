@@ -0,0 +1,374 @@
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
+from python_multipart.multipart import MultipartParser, parse_options_header
+from services.log_parser import NginxLogParser
+from services.features import feature_store
+from services.signatures import tag_entries
+from services.concurrency import run_ingest_cpu
+from services.bulk import BulkStats, BulkWriter
+from services.dedup import DedupIndex, LineKeys
+from services.indices import daily_index
+from services.rollups import ROLLUP_FLUSH_MINUTES, Rollups, write_rollups
+from services.live import live_state
+from services.metrics import PARSE_LINES, PARSE_SECONDS
+from services.profiling import current_timings, stage
+from collections import defaultdict, deque
+from datetime import datetime
+import time
+
+class LineSplitter:
+    """
+    Turns a stream of byte chunks into complete text lines.
+
+    Splitting happens on bytes before decoding (a newline byte never occurs inside a
+    multi-byte UTF-8 sequence), which lets the splitter report the exact byte offset
+    of the end of the last complete line for checkpointing.
+    """
+
+    def __init__(self, offset: int = 0):
+        self._partial = b''
+        self.offset = offset
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """Return the lines completed by this chunk (raises UnicodeDecodeError on invalid input)"""
+        buffer = self._partial + chunk if self._partial else chunk
+        end = buffer.rfind(b'\n')
+        if end == -1:
+            self._partial = buffer
+            return []
+        self._partial = buffer[end + 1:]
+        self.offset += end + 1
+        return buffer[:end].decode('utf-8').split('\n')
+
+    def finish(self) -> List[str]:
+        """Return the final line if the stream did not end with a newline"""
+        if not self._partial:
+            return []
+        text = self._partial.decode('utf-8')
+        self.offset += len(self._partial)
+        self._partial = b''
+        return [text]
+
+
+@dataclass
+class IngestStats:
+    """Progress counters for a single ingest"""
+    lines_read: int = 0
+    lines_parsed: int = 0
+    lines_indexed: int = 0
+    lines_failed: int = 0
+    lines_skipped: int = 0
+    batches: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    bulk: BulkStats = field(default_factory=BulkStats)
+    # Days of the daily partitions entries were indexed into
+    days: Set[str] = field(default_factory=set)
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'lines_read': self.lines_read,
+            'lines_parsed': self.lines_parsed,
+            'lines_indexed': self.lines_indexed,
+            'lines_failed': self.lines_failed,
+            'lines_skipped': self.lines_skipped,
+            'batches': self.batches,
+            'retried': self.bulk.retried,
+            'errors': dict(self.bulk.errors),
+            'elapsed_seconds': elapsed,
+            'lines_per_second': self.lines_indexed / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+_parsed_lines = PARSE_LINES.labels('parsed')
+_unparsed_lines = PARSE_LINES.labels('unparsed')
+_skipped_lines = PARSE_LINES.labels('skipped')
+
+
+def parse_new_lines(
+    parser: NginxLogParser,
+    line_keys: LineKeys,
+    lines: List[str],
+    dedup: Optional[DedupIndex] = None
+) -> Tuple[List[str], List[Tuple[str, Dict[str, Any]]], int]:
+    """
+    Key each line, drop lines the dedup index has already seen and parse the rest
+
+    Args:
+        parser: Log line parser
+        line_keys: Key generator for the stream the lines come from
+        lines: Block of raw lines
+        dedup: Dedup index to check, or None to keep every line
+
+    Returns:
+        Tuple of the keys of the new lines, (key, entry) pairs for those that parsed
+        and the number of lines skipped as already ingested
+    """
+    start = time.perf_counter()
+    keys = []
+    new_lines = []
+    skipped = 0
+    with stage('parse.dedup'):
+        for line in lines:
+            if not line.strip():
+                continue
+            key = line_keys.key(line)
+            if dedup is not None and dedup.might_contain(key):
+                skipped += 1
+                continue
+            keys.append(key)
+            new_lines.append(line)
+
+    # Requests being timed get a breakdown of the parser's own stages
+    timings = current_timings()
+    stage_totals = dict.fromkeys(NginxLogParser.PARSE_STAGES, 0.0) if timings is not None else None
+
+    entries = []
+    for key, line in zip(keys, new_lines):
+        try:
+            entry = parser.parse_line(line) if stage_totals is None else parser.parse_line_timed(line, stage_totals)
+        except Exception as e:
+            print(f"Error parsing line: {line.strip()}")
+            print(f"Error: {e}")
+            continue
+        if entry:
+            entries.append((key, entry))
+    if stage_totals is not None:
+        for name, seconds in stage_totals.items():
+            timings.add(f"parse.{name}", seconds)
+
+    with stage('parse.signatures'):
+        tag_entries([entry for _, entry in entries])
+
+    PARSE_SECONDS.observe(time.perf_counter() - start)
+    _parsed_lines.inc(len(entries))
+    _unparsed_lines.inc(len(keys) - len(entries))
+    _skipped_lines.inc(skipped)
+    return keys, entries, skipped
+
+
+def fold_indexed(entries: List[Dict[str, Any]]) -> Rollups:
+    """
+    Fold entries into the per-IP feature store and the live dashboard state once they
+    have been indexed, so entries that failed, or are read again when an ingest resumes,
+    are never counted twice
+
+    Returns:
+        Rollups: Per-minute rollups of the entries
+    """
+    with stage('features'):
+        feature_store.ingest(entries)
+    with stage('rollups'):
+        rollups = Rollups().add(entries)
+    with stage('live'):
+        live_state.ingest(rollups, entries)
+    return rollups
+
+
+async def ingest_stream(
+    chunks: AsyncIterator[bytes],
+    client,
+    index: str,
+    stats: Optional[IngestStats] = None,
+    start_offset: int = 0,
+    start_id: int = 0,
+    on_checkpoint: Optional[Callable[[int, int], None]] = None,
+    writer: Optional[BulkWriter] = None,
+    dedup: Optional[DedupIndex] = None
+) -> IngestStats:
+    """
+    Parse and index a log as its bytes arrive
+
+    Lines are parsed as soon as their chunk is read and handed to a BulkWriter,
+    which keeps several bulk requests in flight. When Elasticsearch falls behind
+    the writer stops accepting documents and reading pauses, so memory use stays
+    constant regardless of upload size.
+
+    Document IDs are derived from line content (see LineKeys), so indexing the same
+    lines again overwrites rather than duplicates them. Lines already recorded in the
+    dedup index are skipped before parsing, and lines are recorded once indexed.
+
+    For backends that use them, per-minute rollups of the indexed entries are written
+    to the rollup index as the ingest progresses (see services/rollups.py).
+
+    Args:
+        chunks: Async iterator of raw log bytes
+        client: Storage backend (see services/storage.py) or AsyncElasticsearch client
+        index: Base index name; entries are written to the daily index for their timestamp
+        stats: Counters to update, e.g. so a caller can report progress
+        start_offset: Byte offset in the source that chunks start at, when resuming
+        start_id: Number of entries already written, when resuming
+        on_checkpoint: Called with (byte_offset, next_entry_number) whenever every line
+            before byte_offset has been indexed or permanently failed; resuming from there is safe
+        writer: Bulk writer to use instead of one with the default settings
+        dedup: Dedup record to consult and update (see dedup_for); None disables line-level dedup
+
+    Returns:
+        IngestStats: Final counters
+    """
+    stats = stats or IngestStats()
+    # (byte offset, entries parsed before it, (key, day, entry) for each of the chunk's
+    # entries) for chunk boundaries not yet fully indexed
+    marks: deque = deque()
+    # Numbers of entries that permanently failed to index, until their chunk is done
+    failed: Set[int] = set()
+    # Indexed entries not yet folded in (see fold_indexed)
+    pending_entries: List[Dict[str, Any]] = []
+    # Rollups of indexed entries not yet written
+    pending_rollups = Rollups()
+
+    def on_progress(completed: int):
+        stats.lines_indexed = writer.stats.indexed
+        stats.lines_failed = writer.stats.failed
+        stats.batches = writer.stats.requests
+        done = start_id + completed
+        checkpoint = None
+        while marks and marks[0][1] <= done:
+            offset, entries, items = marks.popleft()
+            # Only lines that were indexed are recorded, so failed ones go in again on a re-upload
+            indexed = defaultdict(list)
+            for number, (key, day, entry) in enumerate(items, entries - len(items)):
+                if number not in failed:
+                    indexed[day].append(key)
+                    pending_entries.append(entry)
+            failed.difference_update([number for number in failed if number < entries])
+            stats.days.update(indexed)
+            if dedup is not None:
+                for day, keys in indexed.items():
+                    dedup.add(day, keys)
+            checkpoint = (offset, entries)
+        if checkpoint and on_checkpoint:
+            on_checkpoint(*checkpoint)
+
+    writer = writer or BulkWriter(client)
+    writer.on_progress = on_progress
+    writer.on_failed = lambda seq: failed.add(start_id + seq)
+    rollup_writer = BulkWriter(client) if getattr(client, 'uses_rollups', True) else None
+    stats.bulk = writer.stats
+    parser = NginxLogParser()
+    splitter = LineSplitter(start_offset)
+    line_keys = LineKeys()
+    next_id = start_id
+
+    async def flush_rollups():
+        nonlocal pending_rollups
+        if pending_rollups:
+            rollups, pending_rollups = pending_rollups, Rollups()
+            await write_rollups(rollup_writer, index, rollups)
+
+    async def fold_pending():
+        nonlocal pending_entries
+        if pending_entries:
+            entries, pending_entries = pending_entries, []
+            rollups = await run_ingest_cpu(fold_indexed, entries)
+            if rollup_writer is not None:
+                pending_rollups.merge(rollups)
+
+    async def write(lines: List[str]):
+        nonlocal next_id
+        stats.lines_read += len(lines)
+        _, entries, skipped = await run_ingest_cpu(parse_new_lines, parser, line_keys, lines, dedup) if lines else ([], [], 0)
+        stats.lines_skipped += skipped
+        stats.lines_parsed += len(entries)
+        ingested_at = datetime.now()
+        partitions = [daily_index(index, entry.get('datetime'), ingested_at) for _, entry in entries]
+        items = [(key, partition[len(index) + 1:], entry) for (key, entry), partition in zip(entries, partitions)]
+        marks.append((splitter.offset, next_id + len(entries), items))
+        for (key, entry), partition in zip(entries, partitions):
+            # Waits while the writer is at its concurrency limit, which in turn stops us reading the body
+            await writer.add({"index": {"_index": partition, "_id": key}}, entry)
+            next_id += 1
+        await fold_pending()
+        if len(pending_rollups) >= ROLLUP_FLUSH_MINUTES:
+            await flush_rollups()
+
+    try:
+        async for chunk in chunks:
+            await write(splitter.feed(chunk))
+        await write(splitter.finish())
+        await writer.close()
+        on_progress(writer.completed)
+    except BaseException:
+        writer.cancel()
+        raise
+    finally:
+        if dedup is not None:
+            await run_ingest_cpu(dedup.save)
+        # Whatever was indexed is folded in and its rollups written even if the ingest stopped early
+        try:
+            await fold_pending()
+            await flush_rollups()
+            if rollup_writer is not None:
+                await rollup_writer.close()
+        except Exception as e:
+            print(f"Error finishing ingest of indexed entries: {str(e)}")
+    if writer.stats.failed:
+        print(f"{writer.stats.failed} documents failed to index: {dict(writer.stats.errors)}")
+    if rollup_writer is not None and rollup_writer.stats.failed:
+        print(f"{rollup_writer.stats.failed} rollup documents failed to index: {dict(rollup_writer.stats.errors)}")
+    return stats
+
+
+async def iter_multipart_file(chunks: AsyncIterator[bytes], content_type: str, field_name: str = 'file') -> AsyncIterator[Tuple[Optional[str], bytes]]:
+    """
+    Stream the contents of one file field out of a multipart/form-data body without buffering it
+
+    Args:
+        chunks: Async iterator over the raw request body
+        content_type: The request's Content-Type header, including the boundary
+        field_name: Form field holding the file
+
+    Yields:
+        Tuple[Optional[str], bytes]: The uploaded filename and the next piece of file data
+    """
+    _, options = parse_options_header(content_type)
+    boundary = options.get(b'boundary')
+    if not boundary:
+        raise ValueError("Missing multipart boundary")
+
+    state = {'header_field': b'', 'header_value': b'', 'headers': {}, 'in_file': False, 'filename': None}
+    data: List[bytes] = []
+
+    def on_part_begin():
+        state['headers'] = {}
+        state['in_file'] = False
+
+    def on_header_field(buffer, start, end):
+        state['header_field'] += buffer[start:end]
+
+    def on_header_value(buffer, start, end):
+        state['header_value'] += buffer[start:end]
+
+    def on_header_end():
+        state['headers'][state['header_field'].lower()] = state['header_value']
+        state['header_field'] = b''
+        state['header_value'] = b''
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state['headers'].get(b'content-disposition', b''))
+        if disposition.get(b'name', b'').decode() == field_name:
+            state['in_file'] = True
+            filename = disposition.get(b'filename')
+            state['filename'] = filename.decode('utf-8', 'replace') if filename else None
+
+    def on_part_data(buffer, start, end):
+        if state['in_file']:
+            data.append(bytes(buffer[start:end]))
+
+    parser = MultipartParser(boundary, callbacks={
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+    })
+
+    async for chunk in chunks:
+        parser.write(chunk)
+        if data:
+            yield state['filename'], b''.join(data)
+            data.clear()
+    parser.finalize()
+    if data:
+        yield state['filename'], b''.join(data)
@@ -0,0 +1,356 @@
+from typing import Any, AsyncIterator, Dict, List, Optional
+from dataclasses import dataclass, field, asdict, fields
+from services.ingest import IngestStats, ingest_stream
+from services.dedup import dedup_for
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+
+JOBS_DIR = os.getenv("INGEST_JOBS_DIR", os.path.join(os.path.dirname(__file__), '..', 'data', 'jobs'))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+
+# Bytes read from a spooled upload per chunk
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Seconds between job state writes while a job is running
+CHECKPOINT_INTERVAL_SECONDS = 1.0
+
+# Most recent finished (completed, failed or cancelled) jobs kept; older ones are
+# forgotten and their state and spooled upload deleted as new jobs finish
+INGEST_JOBS_MAX_FINISHED = int(os.getenv("INGEST_JOBS_MAX_FINISHED", "200"))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+
+@dataclass
+class IngestJob:
+    """Persistent state of a background ingest"""
+    id: str
+    filename: str
+    source_path: str
+    bytes_total: int = 0
+    # SHA-256 of the uploaded file, used to recognise files that were already ingested
+    fingerprint: Optional[str] = None
+    duplicate_of: Optional[Dict[str, Any]] = None
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # Every line before checkpoint_offset has been indexed, producing checkpoint_entries entries
+    checkpoint_offset: int = 0
+    checkpoint_entries: int = 0
+    lines_read: int = 0
+    lines_parsed: int = 0
+    lines_indexed: int = 0
+    lines_failed: int = 0
+    lines_skipped: int = 0
+    # Days of the daily partitions the job's entries were indexed into, across resumes
+    days: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+    def progress(self, stats: Optional[IngestStats] = None, resumed_offset: int = 0) -> Dict[str, Any]:
+        """Return the job state with live counters, throughput and ETA"""
+        state = asdict(self)
+        if stats is not None:
+            state.update({
+                'lines_read': self.lines_read + stats.lines_read,
+                'lines_parsed': self.lines_parsed + stats.lines_parsed,
+                'lines_indexed': self.lines_indexed + stats.lines_indexed,
+                'lines_failed': self.lines_failed + stats.lines_failed,
+                'lines_skipped': self.lines_skipped + stats.lines_skipped,
+            })
+            elapsed = time.monotonic() - stats.started_at
+            bytes_done = self.checkpoint_offset - resumed_offset
+            byte_rate = bytes_done / elapsed if elapsed > 0 else 0.0
+            state['lines_per_second'] = stats.lines_indexed / elapsed if elapsed > 0 else 0.0
+            state['bytes_per_second'] = byte_rate
+            remaining = self.bytes_total - self.checkpoint_offset
+            state['eta_seconds'] = remaining / byte_rate if byte_rate > 0 else None
+        state['percent_complete'] = 100.0 * self.checkpoint_offset / self.bytes_total if self.bytes_total else 0.0
+        del state['source_path']
+        return state
+
+
+class JobManager:
+    """
+    Runs ingest jobs on a pool of worker tasks.
+
+    Uploads are spooled to JOBS_DIR and the job state is written next to them,
+    including a checkpoint of the last fully indexed byte offset. On start any
+    job that was queued or running when the process stopped is re-queued and
+    resumes from its checkpoint.
+    """
+
+    def __init__(
+        self,
+        client,
+        index: str,
+        jobs_dir: str = JOBS_DIR,
+        workers: int = INGEST_WORKERS,
+        max_finished: int = INGEST_JOBS_MAX_FINISHED
+    ):
+        self.client = client
+        self.index = index
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.max_finished = max_finished
+        self.jobs: Dict[str, IngestJob] = {}
+        self._stats: Dict[str, tuple[IngestStats, int]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # Jobs whose state changed since it was last written, and a lock per job keeping
+        # its writes in order
+        self._dirty: set = set()
+        self._save_locks: Dict[str, asyncio.Lock] = {}
+        # Called after a job indexes documents, e.g. to invalidate cached results
+        self.on_indexed = None
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    async def _save(self, job: IngestJob) -> None:
+        """Write a job's state, copied on the event loop and written on a thread"""
+        self._dirty.discard(job.id)
+        state = asdict(job)
+        async with self._save_locks.setdefault(job.id, asyncio.Lock()):
+            await asyncio.to_thread(self._write, self._state_path(job.id), state)
+
+    def _write(self, path: str, state: Dict[str, Any]) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    async def _checkpoint(self, job: IngestJob) -> None:
+        """Write the state of a running job at most every CHECKPOINT_INTERVAL_SECONDS"""
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL_SECONDS)
+            if job.id in self._dirty:
+                # Once started, a write finishes (holding the job's lock) even if the job stops
+                await asyncio.shield(self._save(job))
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond max_finished"""
+        # finished_at is only set once a job's final state has been written
+        finished = [job for job in self.jobs.values() if job.status in FINISHED and job.finished_at is not None]
+        if len(finished) <= self.max_finished:
+            return
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:len(finished) - self.max_finished]:
+            del self.jobs[job.id]
+            self._save_locks.pop(job.id, None)
+            # Failed and cancelled jobs still have their upload spooled for a resume
+            for path in (self._state_path(job.id), job.source_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    async def start(self) -> None:
+        """Start the workers and re-queue jobs interrupted by a restart"""
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+        for name in sorted(os.listdir(self.jobs_dir)):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(self.jobs_dir, name)) as f:
+                state = json.load(f)
+            # Ignore fields written by older versions
+            job = IngestJob(**{f.name: state[f.name] for f in fields(IngestJob) if f.name in state})
+            self.jobs[job.id] = job
+            if job.status in (QUEUED, RUNNING):
+                job.status = QUEUED
+                await self._save(job)
+                self._queue.put_nowait(job.id)
+        self._prune()
+
+    async def stop(self) -> None:
+        """Stop the workers; running jobs keep their checkpoint and resume on the next start"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, chunks: AsyncIterator[bytes], filename: str) -> IngestJob:
+        """
+        Spool an upload to disk and queue it for ingest
+
+        A file whose contents were already ingested completes immediately without being queued.
+
+        Args:
+            chunks: Async iterator over the uploaded bytes
+            filename: Original name of the uploaded file
+
+        Returns:
+            IngestJob: The queued job
+        """
+        job_id = uuid.uuid4().hex
+        source_path = os.path.join(self.jobs_dir, f"{job_id}.log")
+        bytes_total = 0
+        fingerprint = hashlib.sha256()
+        with open(source_path, 'wb') as f:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+                fingerprint.update(chunk)
+                bytes_total += len(chunk)
+
+        job = IngestJob(
+            id=job_id,
+            filename=filename,
+            source_path=source_path,
+            bytes_total=bytes_total,
+            fingerprint=fingerprint.hexdigest()
+        )
+        self.jobs[job_id] = job
+
+        dedup = await dedup_for(self.client)
+        previous = dedup.get_file(job.fingerprint) if dedup is not None else None
+        if previous is not None:
+            os.remove(source_path)
+            job.status = COMPLETED
+            job.duplicate_of = previous
+            job.checkpoint_offset = bytes_total
+            job.finished_at = time.time()
+            await self._save(job)
+            self._prune()
+            return job
+
+        await self._save(job)
+        await self._queue.put(job_id)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job's progress, or None if it doesn't exist"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        stats, resumed_offset = self._stats.get(job_id, (None, 0))
+        return job.progress(stats, resumed_offset)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [self.get(job_id) for job_id in self.jobs]
+
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job. Returns False if it has already finished."""
+        job = self.jobs.get(job_id)
+        if job is None or job.status not in (QUEUED, RUNNING):
+            return False
+        job.status = CANCELLED
+        job.finished_at = time.time()
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        # A running job writes its final counters after this, as it stops
+        await self._save(job)
+        self._prune()
+        return True
+
+    async def resume(self, job_id: str) -> bool:
+        """Re-queue a cancelled or failed job from its checkpoint"""
+        job = self.jobs.get(job_id)
+        if job is None or job.status not in (CANCELLED, FAILED):
+            return False
+        job.status = QUEUED
+        job.error = None
+        job.finished_at = None
+        await self._save(job)
+        await self._queue.put(job_id)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            # Jobs cancelled while queued are skipped
+            if job is None or job.status != QUEUED:
+                continue
+            task = asyncio.create_task(self._run(job))
+            self._tasks[job_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                # Either this job was cancelled or the worker is stopping
+                if job.status != CANCELLED:
+                    raise
+            finally:
+                self._tasks.pop(job_id, None)
+                self._stats.pop(job_id, None)
+
+    async def _read_source(self, job: IngestJob) -> AsyncIterator[bytes]:
+        with open(job.source_path, 'rb') as f:
+            f.seek(job.checkpoint_offset)
+            while True:
+                chunk = await asyncio.to_thread(f.read, READ_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    async def _run(self, job: IngestJob) -> None:
+        job.status = RUNNING
+        job.started_at = job.started_at or time.time()
+        await self._save(job)
+
+        stats = IngestStats()
+        self._stats[job.id] = (stats, job.checkpoint_offset)
+
+        def on_checkpoint(offset: int, entries: int):
+            job.checkpoint_offset = offset
+            job.checkpoint_entries = entries
+            self._dirty.add(job.id)
+
+        checkpoint = asyncio.create_task(self._checkpoint(job))
+        try:
+            dedup = await dedup_for(self.client)
+            await ingest_stream(
+                self._read_source(job),
+                self.client,
+                self.index,
+                stats=stats,
+                start_offset=job.checkpoint_offset,
+                start_id=job.checkpoint_entries,
+                on_checkpoint=on_checkpoint,
+                dedup=dedup
+            )
+            job.status = COMPLETED
+            os.remove(job.source_path)
+            # A file with lines that failed to index is not recorded, so uploading it again retries them
+            if job.fingerprint and dedup is not None and not job.lines_failed + stats.lines_failed:
+                dedup.add_file(job.fingerprint, job.filename, job.checkpoint_entries, stats.days.union(job.days), job.lines_skipped + stats.lines_skipped)
+                await asyncio.to_thread(dedup.save)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Ingest job {job.id} failed: {str(e)}")
+            job.status = FAILED
+            job.error = str(e)
+        finally:
+            checkpoint.cancel()
+            job.lines_read += stats.lines_read
+            job.lines_parsed += stats.lines_parsed
+            job.lines_indexed += stats.lines_indexed
+            job.lines_failed += stats.lines_failed
+            job.lines_skipped += stats.lines_skipped
+            job.days = sorted(stats.days.union(job.days))
+            if job.status != COMPLETED:
+                # Entries past the checkpoint are processed again on resume, so don't count them yet
+                excess = job.lines_indexed + job.lines_failed - job.checkpoint_entries
+                job.lines_indexed -= min(max(excess, 0), job.lines_indexed)
+                job.lines_parsed = min(job.lines_parsed, job.checkpoint_entries)
+            if job.status != RUNNING:
+                job.finished_at = job.finished_at or time.time()
+            await self._save(job)
+            self._prune()
+            if stats.lines_indexed and self.on_indexed:
+                self.on_indexed()
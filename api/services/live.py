@@ -0,0 +1,245 @@
+from typing import Any, Dict, List, Optional, Set
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timedelta
+from services.rollups import MINUTE_KEY_FORMAT, MinuteCounts, Rollups
+from services.metrics import gauge_callback
+import asyncio
+import os
+import threading
+
+# Minutes of log time kept in the live view, counted back from the newest entry seen
+LIVE_WINDOW_MINUTES = int(os.getenv("LIVE_WINDOW_MINUTES", "60"))
+
+# Entries in the top IPs and paths lists
+LIVE_TOP_K = int(os.getenv("LIVE_TOP_K", "10"))
+
+# Burst alerts match detect_burst_requests' defaults
+BURST_WINDOW_SECONDS = 60
+BURST_THRESHOLD = 10
+
+# Recent burst alerts kept for clients that fall behind
+MAX_ALERTS = 200
+
+
+class LiveState:
+    """
+    Incrementally maintained dashboard state for the live stream.
+
+    Ingest feeds every parsed chunk in; per-minute buckets are merged, running
+    IP and path totals are adjusted as minutes enter and leave the window, and
+    burst alerts are raised from per-IP sliding windows. Every change bumps a
+    version number, and each minute remembers the version that last changed it,
+    so a client can ask for exactly what changed since the version it last saw.
+    Updates between two reads by a client are coalesced into one delta.
+    """
+
+    def __init__(self, window_minutes: int = LIVE_WINDOW_MINUTES, top_k: int = LIVE_TOP_K):
+        self.window_minutes = window_minutes
+        self.top_k = top_k
+        self.version = 0
+        self._lock = threading.Lock()
+        self._minutes: Dict[str, MinuteCounts] = {}
+        self._minute_versions: Dict[str, int] = {}
+        self._ip_totals = Counter()
+        self._path_totals = Counter()
+        self._top_version = 0
+        self._top_cache: Optional[tuple[int, Dict[str, Any]]] = None
+        self._window_start: Optional[str] = None
+        # Per-IP request times inside the burst window, least recently active first
+        self._ip_windows: "OrderedDict[str, deque]" = OrderedDict()
+        self._alerted: Set[str] = set()
+        self._alerts: deque = deque(maxlen=MAX_ALERTS)
+        self._alert_seq = 0
+        self._latest: Optional[datetime] = None
+        self._subscribers: Set["LiveSubscriber"] = set()
+
+    def ingest(self, rollups: Rollups, entries: List[Dict[str, Any]]) -> None:
+        """
+        Fold entries that have been indexed into the live state. Called from the ingest executor.
+
+        Args:
+            rollups: Per-minute counts of the entries
+            entries: The entries, for burst detection
+        """
+        if not rollups:
+            return
+        with self._lock:
+            self.version += 1
+            for key, theirs in rollups.minutes.items():
+                minute = self._minutes.get(key)
+                if minute is None:
+                    minute = self._minutes[key] = MinuteCounts()
+                minute.merge(theirs)
+                self._ip_totals.update(theirs.ips)
+                self._path_totals.update(theirs.paths)
+                self._minute_versions[key] = self.version
+            self._top_version = self.version
+            self._detect_bursts(entries)
+            self._expire()
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.notify()
+
+    def _detect_bursts(self, entries: List[Dict[str, Any]]) -> None:
+        window = timedelta(seconds=BURST_WINDOW_SECONDS)
+        for entry in entries:
+            when = entry.get('datetime')
+            if not isinstance(when, datetime):
+                continue
+            if self._latest is None or when > self._latest:
+                self._latest = when
+            ip = entry.get('remote_addr', '')
+            times = self._ip_windows.get(ip)
+            if times is None:
+                times = self._ip_windows[ip] = deque()
+            else:
+                self._ip_windows.move_to_end(ip)
+            times.append(when)
+            while times and when - times[0] > window:
+                times.popleft()
+            if len(times) >= BURST_THRESHOLD and ip not in self._alerted:
+                self._alerted.add(ip)
+                self._alert_seq += 1
+                self._alerts.append({
+                    'seq': self._alert_seq,
+                    'ip': ip,
+                    'requests': len(times),
+                    'window_start': times[0].isoformat(),
+                    'window_end': when.isoformat(),
+                })
+
+        # Forget IPs that have been quiet for longer than the window, re-arming their alert
+        if self._latest is not None:
+            while self._ip_windows:
+                ip, times = next(iter(self._ip_windows.items()))
+                if times and self._latest - times[-1] <= window:
+                    break
+                del self._ip_windows[ip]
+                self._alerted.discard(ip)
+
+    def _expire(self) -> None:
+        if self._latest is None:
+            return
+        start = (self._latest - timedelta(minutes=self.window_minutes - 1)).strftime(MINUTE_KEY_FORMAT)
+        self._window_start = start
+        for key in [key for key in self._minutes if key < start]:
+            minute = self._minutes.pop(key)
+            del self._minute_versions[key]
+            self._ip_totals.subtract(minute.ips)
+            self._path_totals.subtract(minute.paths)
+        for totals in (self._ip_totals, self._path_totals):
+            if len(totals) > 2 * self.top_k:
+                for key in [key for key, count in totals.items() if count <= 0]:
+                    del totals[key]
+
+    def _top(self) -> Dict[str, Any]:
+        # Shared by every client reading the same version
+        if self._top_cache is None or self._top_cache[0] != self._top_version:
+            self._top_cache = (self._top_version, {
+                'ips': self._ip_totals.most_common(self.top_k),
+                'paths': self._path_totals.most_common(self.top_k),
+            })
+        return self._top_cache[1]
+
+    @staticmethod
+    def _bucket(key: str, minute: MinuteCounts) -> Dict[str, Any]:
+        return {
+            'minute': key,
+            'count': minute.count,
+            'bot': minute.bot,
+            'human': minute.human,
+            'statuses': dict(minute.statuses),
+            'methods': dict(minute.methods),
+        }
+
+    def delta(self, since_version: int, since_alert: int) -> Dict[str, Any]:
+        """
+        Everything that changed after a version
+
+        Args:
+            since_version: Version the client last saw (0 for a full snapshot)
+            since_alert: Sequence number of the last burst alert the client saw
+
+        Returns:
+            Dict[str, Any]: version, changed minute buckets, window start, top IPs and
+            paths if they changed, and new burst alerts
+        """
+        with self._lock:
+            delta: Dict[str, Any] = {
+                'version': self.version,
+                'window_start': self._window_start,
+                'minutes': [
+                    self._bucket(key, self._minutes[key])
+                    for key, version in sorted(self._minute_versions.items())
+                    if version > since_version
+                ],
+            }
+            if self._top_version > since_version:
+                delta['top'] = self._top()
+            alerts = [alert for alert in self._alerts if alert['seq'] > since_alert]
+            if alerts:
+                delta['burst_alerts'] = alerts
+                # Alerts rotate out of the buffer if a client falls far behind
+                delta['alerts_missed'] = max(0, alerts[0]['seq'] - since_alert - 1)
+            delta['alert_seq'] = self._alert_seq
+            return delta
+
+    def subscribe(self) -> "LiveSubscriber":
+        subscriber = LiveSubscriber(self)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: "LiveSubscriber") -> None:
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+
+class LiveSubscriber:
+    """
+    One streaming client's position in the live state.
+
+    Holds no queue: it only records the last version and alert it was sent, and a
+    flag set when anything changes. However far a slow client falls behind, its next
+    delta is built from current state, so memory per client stays constant.
+    """
+
+    def __init__(self, state: LiveState):
+        self.state = state
+        self.version = 0
+        self.alert_seq = 0
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._changed.set()
+
+    def notify(self) -> None:
+        # Ingest runs in worker threads, so hand the wake-up to the client's event loop
+        try:
+            self._loop.call_soon_threadsafe(self._changed.set)
+        except RuntimeError:
+            # The client's loop has closed
+            pass
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait until something changes. Returns False on timeout."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def next_delta(self) -> Optional[Dict[str, Any]]:
+        """The coalesced delta since the last call, or None if nothing changed"""
+        self._changed.clear()
+        if self.state.version == self.version and self.version:
+            return None
+        delta = self.state.delta(self.version, self.alert_seq)
+        self.version = delta['version']
+        self.alert_seq = delta['alert_seq']
+        return delta
+
+
+# Shared live state fed by every ingest
+live_state = LiveState()
+
+gauge_callback("danphobic_live_subscribers", "Clients connected to the live dashboard stream", lambda: len(live_state._subscribers))
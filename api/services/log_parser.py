@@ -21,6 +21,7 @@ import sys
 import argparse
 import json
 import csv
+import time
 from datetime import datetime
 from collections import Counter, defaultdict
 
@@ -70,15 +71,47 @@ class NginxLogParser:
         print(f"Successfully parsed {len(self.entries)} log entries")
         return self.entries
 
+    # Stages of parse_line, in order, as timed by parse_line_timed
+    PARSE_STAGES = ('match', 'datetime', 'request', 'numbers')
+
     def parse_line(self, line):
         """Parse a single line from the log file"""
+        data = self._match(line)
+        if data is None:
+            return None
+        self._parse_datetime(data)
+        self._parse_request(data)
+        self._convert_numbers(data)
+        return data
+
+    def parse_line_timed(self, line, totals):
+        """
+        Parse a single line, adding the seconds spent in each stage to totals
+
+        Args:
+            line: Log line
+            totals: Dict keyed by PARSE_STAGES, updated in place
+        """
+        start = time.perf_counter()
+        data = self._match(line)
+        now = time.perf_counter()
+        totals['match'] += now - start
+        if data is None:
+            return None
+        for stage, step in (('datetime', self._parse_datetime), ('request', self._parse_request), ('numbers', self._convert_numbers)):
+            start = now
+            step(data)
+            now = time.perf_counter()
+            totals[stage] += now - start
+        return data
+
+    def _match(self, line):
         match = self.pattern.match(line.strip())
         if not match:
             return None
-        
-        data = match.groupdict()
-        
-        # Further process some fields
+        return match.groupdict()
+
+    def _parse_datetime(self, data):
         if 'time_local' in data:
             # Convert nginx time format to datetime object
             time_str = data['time_local']
@@ -90,7 +123,8 @@ class NginxLogParser:
             except ValueError:
                 # If parsing fails, keep the original string
                 data['datetime'] = time_str
-        
+
+    def _parse_request(self, data):
         if 'request' in data:
             # Parse HTTP request into method, path, and protocol
             request_parts = data['request'].split()
@@ -106,13 +140,12 @@ class NginxLogParser:
                 data['method'] = data['request']
                 data['path'] = ''
                 data['protocol'] = ''
-        
+
+    def _convert_numbers(self, data):
         # Convert numeric fields to integers
         for field in ['status', 'body_bytes_sent']:
             if field in data and data[field].isdigit():
                 data[field] = int(data[field])
-        
-        return data
 
     def filter_entries(self, field, value):
         """Filter log entries by field value"""
@@ -0,0 +1,272 @@
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from functools import wraps
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge, disable_created_metrics
+from prometheus_client import Counter as _Counter, Histogram as _Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+from services.profiling import record_stage
+import os
+import time
+
+# Set METRICS_ENABLED=0 to turn off recording; /metrics then reports only the callback gauges
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Latency buckets in seconds, from sub-millisecond detector batches to multi-second searches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Nothing reads the _created series, which would add one per counter and histogram child
+disable_created_metrics()
+
+
+class Counter(_Counter):
+    """prometheus_client Counter that stops counting when METRICS_ENABLED=0. Names should end in _total."""
+
+    def inc(self, amount: float = 1, exemplar: Optional[Dict[str, str]] = None) -> None:
+        if METRICS_ENABLED:
+            super().inc(amount, exemplar)
+
+
+class Histogram(_Histogram):
+    """
+    prometheus_client Histogram, with LATENCY_BUCKETS by default, that stops recording
+    when METRICS_ENABLED=0.
+
+    Histograms given a stage name also add each observation to the current request's
+    Server-Timing breakdown, as the stage name followed by the label values. Look
+    children up with labels() once and keep them on hot paths.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS, stage: Optional[str] = None, **kwargs):
+        super().__init__(name, documentation, labelnames, buckets=tuple(buckets), **kwargs)
+        # Passed on to the children labels() creates
+        self._kwargs['stage'] = stage
+        self._stage = '.'.join((stage,) + self._labelvalues) if stage else None
+
+    def observe(self, amount: float, exemplar: Optional[Dict[str, str]] = None) -> None:
+        if self._stage is not None:
+            record_stage(self._stage, amount)
+        if METRICS_ENABLED:
+            super().observe(amount, exemplar)
+
+
+class CallbackMetric(Collector):
+    """
+    Metric read from existing state when scraped, e.g. cache counters or queue sizes,
+    so the code that owns the state needs no instrumentation
+    """
+
+    _families = {'gauge': GaugeMetricFamily, 'counter': CounterMetricFamily}
+
+    def __init__(self, name: str, documentation: str, type: str, callback: Callable[[], Iterable[Tuple[Dict[str, str], float]]], registry: Optional[CollectorRegistry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.callback = callback
+        if registry:
+            registry.register(self)
+
+    def describe(self):
+        # Registering only needs the name, and the state may not exist yet
+        return [self._families[self.type](self.name, self.documentation)]
+
+    def collect(self):
+        try:
+            samples = list(self.callback())
+        except Exception as e:
+            # One broken callback shouldn't take down the whole scrape
+            print(f"Error collecting metric {self.name}: {str(e)}")
+            samples = []
+        labelnames = list(samples[0][0]) if samples else []
+        family = self._families[self.type](self.name, self.documentation, labels=labelnames)
+        for labels, value in samples:
+            family.add_metric([str(labels[name]) for name in labelnames], value)
+        yield family
+
+
+def gauge_callback(name: str, documentation: str, callback: Callable[[], float]) -> CallbackMetric:
+    """Register an unlabelled gauge read from a callable at scrape time"""
+    return CallbackMetric(name, documentation, "gauge", lambda: [({}, callback())])
+
+
+def counter_callback(name: str, documentation: str, callback: Callable[[], float]) -> CallbackMetric:
+    """Register an unlabelled counter read from a callable at scrape time"""
+    return CallbackMetric(name, documentation, "counter", lambda: [({}, callback())])
+
+
+def timed(histogram):
+    """
+    Decorator observing a function's wall time on a histogram (or histogram child)
+
+    Args:
+        histogram: Histogram or child returned by Histogram.labels
+
+    Returns:
+        The decorator
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# Stages of /analyse and /upload. Children are resolved here once so hot paths only observe.
+ES_REQUEST_SECONDS = Histogram(
+    "danphobic_es_request_seconds",
+    "Elasticsearch request latency by operation",
+    ["operation"],
+    stage="es"
+)
+SQLITE_QUERY_SECONDS = Histogram(
+    "danphobic_sqlite_query_seconds",
+    "Embedded SQLite storage latency by operation",
+    ["operation"],
+    stage="sqlite"
+)
+MATERIALIZE_SECONDS = Histogram(
+    "danphobic_materialize_seconds",
+    "Time to turn a page of hits into log records",
+    stage="materialize"
+)
+DETECTOR_SECONDS = Histogram(
+    "danphobic_detector_seconds",
+    "Time spent in each detector per batch",
+    ["detector"],
+    stage="detector"
+)
+ANALYSIS_STAGE_SECONDS = Histogram(
+    "danphobic_analysis_stage_seconds",
+    "Time spent in the post-retrieval /analyse stages",
+    ["stage"],
+    stage="analysis"
+)
+GEMINI_SECONDS = Histogram(
+    "danphobic_gemini_seconds",
+    "Gemini request latency by outcome",
+    ["outcome"]
+)
+SERIALIZE_SECONDS = Histogram(
+    "danphobic_serialize_seconds",
+    "Response serialization time by stage",
+    ["stage"],
+    stage="serialize"
+)
+RESPONSE_BYTES = Histogram(
+    "danphobic_response_bytes",
+    "Serialized JSON response size",
+    buckets=(1024, 10240, 102400, 1048576, 10485760, 104857600)
+)
+PARSE_SECONDS = Histogram(
+    "danphobic_parse_seconds",
+    "Time to parse one ingest chunk",
+    stage="parse"
+)
+PARSE_LINES = Counter(
+    "danphobic_parse_lines_total",
+    "Lines handled by the ingest parser by outcome; divide by parse seconds for throughput",
+    ["outcome"]
+)
+BULK_REQUEST_SECONDS = Histogram(
+    "danphobic_bulk_request_seconds",
+    "Elasticsearch bulk request latency",
+    stage="bulk"
+)
+BULK_ITEMS = Counter(
+    "danphobic_bulk_items_total",
+    "Bulk items by outcome",
+    ["outcome"]
+)
+BULK_IN_FLIGHT = Gauge(
+    "danphobic_bulk_in_flight",
+    "Bulk requests currently in flight"
+)
+S3_REQUEST_SECONDS = Histogram(
+    "danphobic_s3_request_seconds",
+    "S3 request latency by operation",
+    ["operation"],
+    stage="s3"
+)
+S3_BYTES = Counter(
+    "danphobic_s3_bytes_total",
+    "Bytes downloaded from S3 for ingest"
+)
+S3_OBJECTS = Counter(
+    "danphobic_s3_objects_total",
+    "S3 objects handled by prefix ingests by outcome",
+    ["outcome"]
+)
+ARCHIVE_SECONDS = Histogram(
+    "danphobic_archive_seconds",
+    "Cold-tier archive latency by operation",
+    ["operation"],
+    stage="archive"
+)
+ARCHIVE_SEGMENTS = Counter(
+    "danphobic_archive_segments_total",
+    "Archive segments considered by queries by outcome (read, or pruned by time or statistics)",
+    ["outcome"]
+)
+SITE_ANALYSIS_SECONDS = Histogram(
+    "danphobic_site_analysis_seconds",
+    "Per-site retrieval time of fleet-wide /analyse requests by outcome (ok, timeout, error)",
+    ["outcome"]
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "danphobic_admission_wait_seconds",
+    "Time requests queued for a slot, by admission gate",
+    ["gate"],
+    stage="queue"
+)
+ADMISSION_REQUESTS = Counter(
+    "danphobic_admission_requests_total",
+    "Requests by admission gate and outcome (admitted, rejected with the queue full, timeout)",
+    ["gate", "outcome"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "danphobic_http_request_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"]
+)
+HTTP_IN_FLIGHT = Gauge(
+    "danphobic_http_requests_in_flight",
+    "HTTP requests currently being handled"
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per route template, so /jobs/{job_id}
+    is one series rather than one per job. Streaming responses are timed until their
+    last body chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path, status).observe(time.perf_counter() - start)
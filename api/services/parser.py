@@ -1,15 +1,25 @@
-from typing import List, Set, Dict, Tuple
+from typing import FrozenSet, Iterable, List, Dict, Optional, Tuple
 from model.log import LogEntry
-from collections import defaultdict
+from services.signatures import scan_request
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
+from functools import lru_cache
 import os
 import json
 
-def load_blacklist() -> Set[str]:
-    """Load IP addresses from blacklist file into a set for O(1) lookups"""
+@lru_cache(maxsize=1)
+def load_blacklist() -> FrozenSet[str]:
+    """Load IP addresses from blacklist file into a set for O(1) lookups. Read once per process."""
     blacklist_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'ip_blacklist.txt')
     with open(blacklist_path, 'r') as f:
-        return {line.strip() for line in f if line.strip()}
+        return frozenset(line.strip() for line in f if line.strip())
+
+@lru_cache(maxsize=1)
+def load_ip_cache() -> Dict[str, Dict]:
+    """Load the IP geolocation cache used for map markers. Read once per process."""
+    ip_cache_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'ip_cache.json')
+    with open(ip_cache_path, 'r') as f:
+        return json.load(f)
 
 def check_blacklist_occurance(logs: List[LogEntry]) -> List[str]:
     """
@@ -21,9 +31,20 @@ def check_blacklist_occurance(logs: List[LogEntry]) -> List[str]:
     Returns:
         List[str]: List of blacklisted IP addresses found in the logs
     """
+    return find_blacklisted_ips(log.remote_addr for log in logs)
+
+def find_blacklisted_ips(ips: Iterable[str]) -> List[str]:
+    """
+    Find the IP addresses that are in the blacklist
+    
+    Args:
+        ips: IP addresses to check, e.g. the keys of an aggregated request count
+        
+    Returns:
+        List[str]: List of unique blacklisted IP addresses
+    """
     blacklist = load_blacklist()
-    # Get unique IPs from logs that are in the blacklist
-    return list({log.remote_addr for log in logs if log.remote_addr in blacklist})
+    return list({ip for ip in ips if ip in blacklist})
 
 def count_requests_by_ip(logs: List[LogEntry]) -> dict[str, int]:
     """
@@ -69,18 +90,45 @@ def detect_high_frequency_ips(logs: List[LogEntry], std_dev_threshold: float = 2
     Returns:
         dict[str, int]: Dictionary mapping suspicious IPs to their request counts
     """
-    request_counts = count_requests_by_ip(logs)
-    
+    return find_high_frequency_ips(count_requests_by_ip(logs), std_dev_threshold)
+
+def find_high_frequency_ips(
+    request_counts: dict[str, int],
+    std_dev_threshold: float = 2.0,
+    ips: Optional[int] = None,
+    requests: Optional[int] = None
+) -> dict[str, int]:
+    """
+    Find IPs whose request count is more than std_dev_threshold standard deviations above the mean
+
+    request_counts may only list the busiest IPs (the top terms of an aggregation). The mean
+    and standard deviation are then taken over the whole population given by ips and
+    requests, with the requests of the unlisted IPs assumed to be spread evenly over them.
+
+    Args:
+        request_counts: Dictionary mapping IP addresses to their request counts
+        std_dev_threshold: Number of standard deviations above mean to consider suspicious (default: 2.0)
+        ips: Number of distinct IPs, if more than request_counts lists
+        requests: Number of requests from all ips
+        
+    Returns:
+        dict[str, int]: Dictionary mapping suspicious IPs to their request counts
+    """
     if not request_counts:
         return {}
     
     # Calculate mean and standard deviation
     counts = list(request_counts.values())
-    mean = sum(counts) / len(counts)
+    population = max(ips or 0, len(counts))
+    total = max(requests or 0, sum(counts))
+    mean = total / population
     
     # Calculate standard deviation
     squared_diff_sum = sum((count - mean) ** 2 for count in counts)
-    std_dev = (squared_diff_sum / len(counts)) ** 0.5
+    others = population - len(counts)
+    if others:
+        squared_diff_sum += others * ((total - sum(counts)) / others - mean) ** 2
+    std_dev = (squared_diff_sum / population) ** 0.5
     
     # Calculate threshold
     threshold = mean + (std_dev_threshold * std_dev)
@@ -142,6 +190,11 @@ def detect_sensitive_endpoint_access(logs: List[LogEntry]) -> dict[str, List[Log
     
     return sensitive_logs
 
+def _log_time(log) -> datetime:
+    """Request time of an entry, using the pre-decoded timestamp when the entry has one"""
+    timestamp = getattr(log, 'timestamp', None)
+    return timestamp if timestamp is not None else datetime.fromisoformat(log.datetime)
+
 def detect_burst_requests(logs: List[LogEntry], time_window_seconds: int = 60, request_threshold: int = 10) -> dict[str, List[tuple[LogEntry, float]]]:
     """
     Detect IPs making many requests within a short time window
@@ -163,22 +216,21 @@ def detect_burst_requests(logs: List[LogEntry], time_window_seconds: int = 60, r
     burst_requests = {}
     
     for ip, ip_entries in ip_logs.items():
-        # Sort logs by timestamp
-        sorted_logs = sorted(ip_entries, key=lambda x: x.datetime)
+        # Sort logs by timestamp, decoding each timestamp once
+        timed_logs = sorted(((_log_time(log), log) for log in ip_entries), key=lambda x: x[0])
         
         # Use sliding window to detect bursts
-        for i in range(len(sorted_logs)):
-            window_start = datetime.fromisoformat(sorted_logs[i].datetime) 
+        for i in range(len(timed_logs)):
+            window_start = timed_logs[i][0]
             window_end = window_start + timedelta(seconds=time_window_seconds)
-            window_end_str = window_end.isoformat()
             
             # Count requests in this window
             window_requests = []
-            for j in range(i, len(sorted_logs)):
-                if sorted_logs[j].datetime > window_end_str:
+            for j in range(i, len(timed_logs)):
+                log_time, log = timed_logs[j]
+                if log_time > window_end:
                     break
-                time_diff = (datetime.fromisoformat(sorted_logs[j].datetime) - window_start).total_seconds()
-                window_requests.append((sorted_logs[j], time_diff))
+                window_requests.append((log, (log_time - window_start).total_seconds()))
             
             # If we found a burst, add it to results
             if len(window_requests) >= request_threshold:
@@ -187,6 +239,27 @@ def detect_burst_requests(logs: List[LogEntry], time_window_seconds: int = 60, r
     
     return burst_requests
 
+def detect_attack_signatures(logs: List[LogEntry]) -> dict[str, List[LogEntry]]:
+    """
+    Detect requests matching SQL injection, path traversal, XSS and scanner probe signatures.
+    Uses the tags attached at ingest time where available and scans the request line otherwise.
+    
+    Args:
+        logs: List of LogEntry objects to analyse
+        
+    Returns:
+        dict[str, List[LogEntry]]: Dictionary mapping signature categories to their log entries
+    """
+    attack_logs = {}
+    for log in logs:
+        tags = log.attack_tags if log.attack_tags is not None else scan_request(log.request)
+        for tag in tags:
+            if tag not in attack_logs:
+                attack_logs[tag] = []
+            attack_logs[tag].append(log)
+    
+    return attack_logs
+
 def count_status_codes(logs: List[LogEntry]) -> Dict[str, int]:
     """
     Count HTTP status codes by their category (2xx, 3xx, 4xx, 5xx)
@@ -268,28 +341,21 @@ def calculate_requests_per_minute(logs: List[LogEntry]) -> List[Tuple[str, int]]
     if not logs:
         return []
     
-    # Sort logs by timestamp
-    sorted_logs = sorted(logs, key=lambda x: x.datetime)
+    # Sort request times, decoding each timestamp once
+    times = sorted(_log_time(log) for log in logs)
     
     # Get the time range
-    start_time = datetime.fromisoformat(sorted_logs[0].datetime)
-    end_time = datetime.fromisoformat(sorted_logs[-1].datetime)
-    
-    # Initialize the time series data
-    time_series = []
-    current_time = start_time
-    
-    # Group logs by minute
-    while current_time <= end_time:
-        next_time = current_time + timedelta(minutes=1)
-        # Count requests in this minute
-        count = sum(1 for log in sorted_logs 
-                   if current_time <= datetime.fromisoformat(log.datetime) < next_time)
-        
-        time_series.append((current_time.isoformat(), count))
-        current_time = next_time
+    start_time = times[0]
+    end_time = times[-1]
     
-    return time_series
+    # Group logs by minute since the first request in a single pass
+    minute = timedelta(minutes=1)
+    counts = Counter((log_time - start_time) // minute for log_time in times)
+    
+    return [
+        ((start_time + i * minute).isoformat(), counts.get(i, 0))
+        for i in range((end_time - start_time) // minute + 1)
+    ]
 
 def analyze_error_paths(logs: List[LogEntry], error_threshold: int = 3) -> Dict[str, Dict[str, int]]:
     """
@@ -333,39 +399,32 @@ def analyze_bot_vs_human_traffic(logs: List[LogEntry]) -> List[Tuple[str, int, i
     if not logs:
         return []
     
-    # Sort logs by timestamp
-    sorted_logs = sorted(logs, key=lambda x: x.datetime)
+    # Sort logs by timestamp, decoding each timestamp once
+    timed_logs = sorted(((_log_time(log), log) for log in logs), key=lambda x: x[0])
     
     # Get the time range
-    start_time = datetime.fromisoformat(sorted_logs[0].datetime)
-    end_time = datetime.fromisoformat(sorted_logs[-1].datetime)
-    
-    # Initialize the time series data
-    time_series = []
-    current_time = start_time
-    
-    # Group logs by minute
-    while current_time <= end_time:
-        next_time = current_time + timedelta(minutes=1)
-        
-        # Count bot and human requests in this minute
-        bot_count = 0
-        human_count = 0
-        
-        for log in sorted_logs:
-            log_time = datetime.fromisoformat(log.datetime)
-            if current_time <= log_time < next_time:
-                if 'bot' in log.http_user_agent.lower():
-                    print("bot", log.http_user_agent)
-                    bot_count += 1
-                else:
-                    print("human", log.http_user_agent)
-                    human_count += 1
-        
-        time_series.append((current_time.isoformat(), bot_count, human_count))
-        current_time = next_time
-    
-    return time_series
+    start_time = timed_logs[0][0]
+    end_time = timed_logs[-1][0]
+    
+    # Count bot and human requests per minute since the first request in a single pass
+    minute = timedelta(minutes=1)
+    bot_counts = Counter()
+    human_counts = Counter()
+    for log_time, log in timed_logs:
+        bucket = (log_time - start_time) // minute
+        if 'bot' in log.http_user_agent.lower():
+            bot_counts[bucket] += 1
+        else:
+            human_counts[bucket] += 1
+    
+    return [
+        ((start_time + i * minute).isoformat(), bot_counts.get(i, 0), human_counts.get(i, 0))
+        for i in range((end_time - start_time) // minute + 1)
+    ]
+
+def _entry_count(entries) -> int:
+    """Number of entries for a detector key, given either the entries themselves or their total"""
+    return entries if isinstance(entries, int) else len(entries)
 
 def generate_insights(
     blacklist_occurance: List[str],
@@ -379,13 +438,15 @@ def generate_insights(
     method_counts: dict[str, int],
     requests_per_minute: List[Tuple[str, int]],
     error_paths: Dict[str, Dict[str, int]],
-    path_counts: Dict[str, int]
+    path_counts: Dict[str, int],
+    attack_signatures: dict[str, List[LogEntry]] = None
 ) -> List[str]:
     """
     Generate key insights from the analysis results
     
     Args:
-        Various analysis results from other functions
+        Various analysis results from other functions. The entry-returning detector results
+        may be passed as totals per key instead of entry lists.
         
     Returns:
         List[str]: List of key insights about potential anomalies
@@ -422,17 +483,24 @@ def generate_insights(
     
     # Suspicious user agent insights
     if suspicious_user_agents:
-        total_suspicious = sum(len(entries) for entries in suspicious_user_agents.values())
+        total_suspicious = sum(_entry_count(entries) for entries in suspicious_user_agents.values())
         insights.append(f"Detected {total_suspicious} requests from suspicious user agents")
         for pattern, entries in suspicious_user_agents.items():
-            insights.append(f"Found {len(entries)} requests using {pattern} user agent")
+            insights.append(f"Found {_entry_count(entries)} requests using {pattern} user agent")
     
     # Sensitive endpoint insights
     if sensitive_endpoint_access:
-        total_sensitive = sum(len(entries) for entries in sensitive_endpoint_access.values())
+        total_sensitive = sum(_entry_count(entries) for entries in sensitive_endpoint_access.values())
         insights.append(f"Detected {total_sensitive} accesses to sensitive endpoints")
         for endpoint, entries in sensitive_endpoint_access.items():
-            insights.append(f"Found {len(entries)} accesses to {endpoint}")
+            insights.append(f"Found {_entry_count(entries)} accesses to {endpoint}")
+    
+    # Attack signature insights
+    if attack_signatures:
+        total_attacks = sum(_entry_count(entries) for entries in attack_signatures.values())
+        insights.append(f"Detected {total_attacks} attack signature matches")
+        for category, entries in attack_signatures.items():
+            insights.append(f"Found {_entry_count(entries)} requests matching {category} signatures")
     
     # Burst request insights
     if burst_requests:
@@ -562,24 +630,25 @@ def generate_map_markers(logs: List[LogEntry]) -> List[Dict]:
     Returns:
         List[Dict]: List of marker objects with coordinates and metadata
     """
-    # Load IP cache
-    ip_cache_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'ip_cache.json')
-    with open(ip_cache_path, 'r') as f:
-        ip_cache = json.load(f)
-    
     # Count requests by IP to determine marker size
-    request_counts = count_requests_by_ip(logs)
+    return generate_map_markers_from_counts(count_requests_by_ip(logs))
+
+def generate_map_markers_from_counts(request_counts: dict[str, int]) -> List[Dict]:
+    """
+    Generate map markers from per-IP request counts using IP geolocation data
+    
+    Args:
+        request_counts: Dictionary mapping IP addresses to their request counts
+        
+    Returns:
+        List[Dict]: List of marker objects with coordinates and metadata
+    """
+    ip_cache = load_ip_cache()
     
     # Create markers for each unique IP
     markers = []
-    seen_ips = set()
     
-    for log in logs:
-        ip = log.remote_addr
-        if ip in seen_ips:
-            continue
-            
-        seen_ips.add(ip)
+    for ip in request_counts:
         if ip not in ip_cache:
             continue
             
@@ -0,0 +1,272 @@
+from typing import Dict, List, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from urllib.parse import parse_qs
+import asyncio
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+
+# The timing and profiling flags are ignored unless REQUEST_PROFILING_ENABLED=1. With
+# REQUEST_PROFILING_TOKEN set, only requests sending it in X-Debug-Token may use them
+# or download profiles.
+REQUEST_PROFILING_ENABLED = os.getenv("REQUEST_PROFILING_ENABLED", "0") == "1"
+REQUEST_PROFILING_TOKEN = os.getenv("REQUEST_PROFILING_TOKEN", "")
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), '..', 'data', 'profiles'))
+
+# Most recent profiles kept on disk; older ones are deleted as new ones are saved
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+# A request opts in with ?timing=1 or ?profile=1, or the equivalent header
+TIMING_HEADER = b'x-debug-timing'
+PROFILE_HEADER = b'x-debug-profile'
+TOKEN_HEADER = b'x-debug-token'
+
+_PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+_TRUTHY = {'1', 'true', 'yes', 'on'}
+
+
+class RequestTimings:
+    """
+    Per-stage time spent on one request, reported in its Server-Timing header.
+
+    Stages are recorded from the event loop and from analysis worker threads, and
+    the same stage may run many times (once per page of hits), so each stage keeps
+    a total and a call count.
+    """
+
+    def __init__(self, profile: bool = False):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+        self.profile = profile
+        self.profiles: List[cProfile.Profile] = []
+        self.notes: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, calls: int = 1) -> None:
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = [seconds, calls]
+            else:
+                stage[0] += seconds
+                stage[1] += calls
+
+    def note(self, name: str, description: str) -> None:
+        """Attach a duration-less entry, e.g. whether the result cache was used"""
+        self.notes[name] = description
+
+    def server_timing(self) -> str:
+        """
+        Returns:
+            str: Server-Timing header value with every stage in milliseconds and the total so far
+        """
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1][0], reverse=True)
+        parts = []
+        for name, (seconds, calls) in stages:
+            part = f"{name};dur={seconds * 1000:.2f}"
+            if calls > 1:
+                part += f';desc="{calls} calls"'
+            parts.append(part)
+        parts.extend(f'{name};desc="{description}"' for name, description in self.notes.items())
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """The timings of the request being handled, or None if it didn't opt in"""
+    return _current.get()
+
+
+def record_stage(name: str, seconds: float, calls: int = 1) -> None:
+    """Add time to a stage of the current request, if it is being timed"""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds, calls)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a stage of the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def profiled(func):
+    """
+    Wrap a function so that, when the current request asked for a profile, it runs
+    under its own cProfile profiler. cProfile only sees the thread it is enabled on,
+    so each call on an analysis worker gets a profiler that is merged when saving.
+    """
+    timings = _current.get()
+    if timings is None or not timings.profile:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with timings._lock:
+                timings.profiles.append(profile)
+    return wrapper
+
+
+# Profiles are merged and written on one thread, off the event loop, so saves and
+# pruning happen in order
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profile-writer')
+
+# Saved profiles, oldest first, listed from PROFILE_DIR on the first save
+_saved: Optional[deque] = None
+
+
+async def save_profile(timings: RequestTimings) -> Optional[str]:
+    """
+    Merge a request's profiles and write them to PROFILE_DIR
+
+    Returns:
+        Optional[str]: The profile id, or None if nothing was profiled
+    """
+    with timings._lock:
+        profiles = list(timings.profiles)
+    if not profiles:
+        return None
+    profile_id = uuid.uuid4().hex
+    await asyncio.get_running_loop().run_in_executor(_writer, _write_profile, profiles, profile_id)
+    return profile_id
+
+
+def _write_profile(profiles: List[cProfile.Profile], profile_id: str) -> None:
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+    stats.dump_stats(path)
+    _prune_profiles(path)
+
+
+def _prune_profiles(path: str) -> None:
+    global _saved
+    if _saved is None:
+        paths = [os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.endswith('.prof')]
+        paths.sort(key=os.path.getmtime)
+        _saved = deque(paths)
+    else:
+        _saved.append(path)
+    while len(_saved) > PROFILE_MAX_FILES:
+        try:
+            os.remove(_saved.popleft())
+        except FileNotFoundError:
+            pass
+
+
+def profile_path(profile_id: str) -> Optional[str]:
+    """Path of a saved profile, or None if the id is malformed or unknown"""
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+    return path if os.path.exists(path) else None
+
+
+def profile_text(path: str, sort: str = 'cumulative', limit: int = 60) -> str:
+    """Human-readable report of a saved profile"""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+def profiling_authorized(token: Optional[str]) -> bool:
+    """Whether a request sending this X-Debug-Token may use timing and profiling"""
+    if not REQUEST_PROFILING_ENABLED:
+        return False
+    if not REQUEST_PROFILING_TOKEN:
+        return True
+    return token is not None and hmac.compare_digest(token.encode('latin-1'), REQUEST_PROFILING_TOKEN.encode('latin-1'))
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware enabling per-request timing for requests that ask for it.
+
+    A timed request gets a Server-Timing header listing every stage it went through.
+    A profiled request is also timed; its CPU-bound work is run under cProfile and
+    the merged profile is saved, with its download path in the X-Profile header.
+    Requests that don't opt in only pay for a header and query string check.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _flags(scope) -> tuple[bool, bool]:
+        timing = profile = False
+        token = None
+        for name, value in scope.get('headers', []):
+            if name == TIMING_HEADER:
+                timing = value.decode('latin-1').lower() in _TRUTHY
+            elif name == PROFILE_HEADER:
+                profile = value.decode('latin-1').lower() in _TRUTHY
+            elif name == TOKEN_HEADER:
+                token = value.decode('latin-1')
+        query_string = scope.get('query_string', b'')
+        if query_string and (b'timing=' in query_string or b'profile=' in query_string):
+            params = parse_qs(query_string.decode('latin-1'))
+            timing = timing or params.get('timing', [''])[-1].lower() in _TRUTHY
+            profile = profile or params.get('profile', [''])[-1].lower() in _TRUTHY
+        if (timing or profile) and not profiling_authorized(token):
+            return False, False
+        return timing or profile, profile
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not REQUEST_PROFILING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        timed, profile = self._flags(scope)
+        if not timed:
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(profile=profile)
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', timings.server_timing().encode('latin-1')))
+                if profile:
+                    profile_id = await save_profile(timings)
+                    if profile_id is not None:
+                        headers.append((b'x-profile', f"/profiles/{profile_id}".encode('latin-1')))
+                headers.append((b'timing-allow-origin', b'*'))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        token = _current.set(timings)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
@@ -0,0 +1,208 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from datetime import datetime
+from fastapi.responses import Response
+from pydantic import BaseModel
+from model.log import LogRecord
+from services.metrics import RESPONSE_BYTES, SERIALIZE_SECONDS, timed
+import functools
+import orjson
+import time
+
+# Default number of items kept per large section in compact mode
+DEFAULT_SECTION_LIMIT = 100
+
+# Sections keyed by detector pattern whose values are lists of entries
+ENTRY_SECTIONS = ['suspicious_user_agents', 'sensitive_endpoint_access', 'attack_signatures']
+
+# Count dictionaries that grow with the cardinality of the data
+COUNT_SECTIONS = ['request_counts', 'path_counts', 'user_agent_counts']
+
+# Fields of the entries table each section references entries for; what a section is keyed
+# by (the IP of a burst, the category of a signature) is left out. The logs sample keeps
+# every field.
+SECTION_FIELDS = {
+    'suspicious_user_agents': ('remote_addr', 'datetime', 'method', 'path', 'status', 'http_user_agent'),
+    'sensitive_endpoint_access': ('remote_addr', 'datetime', 'method', 'path', 'status'),
+    'attack_signatures': ('remote_addr', 'datetime', 'request', 'status'),
+    'burst_requests': ('datetime', 'method', 'path', 'status'),
+}
+
+# Per-minute series, with the names of their value columns after the timestamp
+MINUTE_SERIES = {
+    'requests_per_minute': ('counts',),
+    'bot_vs_human_traffic': ('bots', 'humans'),
+}
+
+MINUTE_SECONDS = 60
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+_json_seconds = SERIALIZE_SECONDS.labels('json')
+
+
+class FastJSONResponse(Response):
+    """JSON response serialized with orjson, bypassing FastAPI's jsonable_encoder"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        start = time.perf_counter()
+        body = orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        _json_seconds.observe(time.perf_counter() - start)
+        RESPONSE_BYTES.observe(len(body))
+        return body
+
+
+class _EntryTable:
+    """Assigns each distinct entry an index so detectors can reference it instead of embedding it"""
+
+    def __init__(self):
+        self._entries: List[Any] = []
+        # Fields referenced for each entry; None keeps the whole entry
+        self._fields: List[Optional[set]] = []
+        self._index: Dict[int, int] = {}
+
+    def ref(self, entry: Any, fields: Optional[Iterable[str]] = None) -> int:
+        key = id(entry)
+        index = self._index.get(key)
+        if index is None:
+            index = self._index[key] = len(self._entries)
+            self._entries.append(entry)
+            self._fields.append(set(fields) if fields is not None else None)
+        elif self._fields[index] is not None:
+            if fields is None:
+                self._fields[index] = None
+            else:
+                self._fields[index].update(fields)
+        return index
+
+    @property
+    def entries(self) -> List[Any]:
+        """Each entry with the fields the sections referencing it need"""
+        rows = []
+        for entry, fields in zip(self._entries, self._fields):
+            if fields is not None:
+                # Entries are LogRecords, LogEntry models or plain documents
+                get = entry.get if isinstance(entry, dict) else functools.partial(getattr, entry)
+                entry = {field: get(field) for field in LogRecord.FIELDS if field in fields}
+            rows.append(entry)
+        return rows
+
+
+def _minute_series(series: Sequence[Sequence[Any]], columns: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    """
+    Encode a per-minute series of (timestamp, value, ...) rows as its first minute and
+    one array per value column, with missing minutes filled with zeros
+
+    Returns:
+        The encoded series, or None if its timestamps aren't whole minutes in order
+    """
+    if not series:
+        return {'start': None, 'interval_seconds': MINUTE_SECONDS, **{column: [] for column in columns}}
+    try:
+        minutes = [datetime.fromisoformat(row[0]) for row in series]
+    except (TypeError, ValueError):
+        return None
+    start = minutes[0]
+    values = {column: [] for column in columns}
+    for minute, row in zip(minutes, series):
+        offset, remainder = divmod((minute - start).total_seconds(), MINUTE_SECONDS)
+        position = int(offset)
+        if remainder or position < len(values[columns[0]]):
+            return None
+        for column, value in zip(columns, row[1:]):
+            values[column].extend([0] * (position - len(values[column])))
+            values[column].append(value)
+    return {'start': series[0][0], 'interval_seconds': MINUTE_SECONDS, **values}
+
+
+def _top(counts: Dict[str, int], limit: int) -> Dict[str, Any]:
+    items = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    return {
+        'items': dict(items[:limit]),
+        'total': len(items),
+        'truncated': len(items) > limit,
+    }
+
+
+@timed(SERIALIZE_SECONDS.labels('compact'))
+def compact_result(result: Dict[str, Any], limit: int = DEFAULT_SECTION_LIMIT) -> Dict[str, Any]:
+    """
+    Convert an /analyse result into the compact response shape
+
+    Every log entry appears once in the "entries" table, with only the fields the
+    sections referencing it use; the logs sample and the entry-returning detectors
+    reference entries by their index in that table. Per-key evidence lists, the logs
+    sample and high-cardinality count sections are truncated to limit items and report
+    how many there were in total. Per-minute series become their start, interval and
+    an array of values per column.
+
+    Args:
+        result: Result produced by run_analysis
+        limit: Maximum number of items kept per section
+
+    Returns:
+        Dict[str, Any]: The compact result
+    """
+    table = _EntryTable()
+    compact = dict(result)
+    logs = result.get('logs', [])
+    compact['logs'] = [table.ref(entry) for entry in logs[:limit]]
+    compact['logs_total'] = len(logs)
+
+    totals = result.get('detector_totals', {})
+    for section in ENTRY_SECTIONS:
+        if section not in result:
+            continue
+        compact[section] = {
+            key: {
+                'entries': [table.ref(entry, SECTION_FIELDS[section]) for entry in entries[:limit]],
+                'total': totals.get(section, {}).get(key, len(entries)),
+            }
+            for key, entries in result[section].items()
+        }
+
+    if 'burst_requests' in result:
+        bursts = list(result['burst_requests'].items())
+        compact['burst_requests'] = {
+            'items': {
+                ip: [[table.ref(entry, SECTION_FIELDS['burst_requests']), offset] for entry, offset in window[:limit]]
+                for ip, window in bursts[:limit]
+            },
+            'total': len(bursts),
+            'truncated': len(bursts) > limit,
+        }
+
+    for section in COUNT_SECTIONS:
+        if section in result:
+            compact[section] = _top(result[section], limit)
+
+    if 'error_paths' in result:
+        error_paths = sorted(result['error_paths'].items(), key=lambda item: sum(item[1].values()), reverse=True)
+        compact['error_paths'] = {
+            'items': dict(error_paths[:limit]),
+            'total': len(error_paths),
+            'truncated': len(error_paths) > limit,
+        }
+
+    if 'map_markers' in result:
+        markers = sorted(result['map_markers'], key=lambda marker: marker['request_count'], reverse=True)
+        compact['map_markers'] = markers[:limit]
+        compact['map_markers_total'] = len(markers)
+
+    for section, columns in MINUTE_SERIES.items():
+        if section in result:
+            encoded = _minute_series(result[section], columns)
+            if encoded is not None:
+                compact[section] = encoded
+
+    compact['entries'] = table.entries
+    compact['compact'] = True
+    return compact
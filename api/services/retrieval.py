@@ -0,0 +1,117 @@
+from typing import Any, AsyncIterator, Dict, List, Optional
+import asyncio
+import time
+from model.log import LogEntry, LogRecord
+from services.metrics import ES_REQUEST_SECONDS
+
+# Fields fetched for row-based detectors. Detectors return entries as evidence,
+# so this is the LogEntry projection rather than the full stored document.
+ENTRY_FIELDS = list(LogEntry.model_fields)
+
+# Documents per page; well under the default index.max_result_window
+DEFAULT_BATCH_SIZE = 2000
+
+# Sort by request time so streaming detectors see each IP's requests in order.
+# _shard_doc is the cheapest unique tiebreaker within a point-in-time.
+SORT = [{'datetime': 'asc'}, {'_shard_doc': 'asc'}]
+
+
+async def scan_hits(
+    client,
+    index: str,
+    query: Dict[str, Any],
+    source_fields: Optional[List[str]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    keep_alive: str = '1m'
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Page through every document matching a query using a point-in-time and search_after
+
+    Unlike from/size paging this is not limited by the index's result window. The
+    next page is requested while the caller processes the current one, and at most
+    two pages of hits are held in memory at a time.
+
+    Args:
+        client: AsyncElasticsearch client
+        index: Index (or comma-separated indices) to search; missing indices are skipped
+        query: Elasticsearch query DSL
+        source_fields: _source fields to fetch (default: ENTRY_FIELDS)
+        batch_size: Number of hits per page
+        keep_alive: How long Elasticsearch keeps the point-in-time open between pages
+
+    Yields:
+        List[Dict[str, Any]]: The _source of each hit in the next page
+    """
+    pit_id = (await client.open_point_in_time(index=index, keep_alive=keep_alive, ignore_unavailable=True))['id']
+
+    page_seconds = ES_REQUEST_SECONDS.labels('scan_page')
+
+    async def search(**kwargs):
+        start = time.perf_counter()
+        page = await client.search(
+            query=query,
+            size=batch_size,
+            pit={'id': pit_id, 'keep_alive': keep_alive},
+            sort=SORT,
+            source=source_fields or ENTRY_FIELDS,
+            track_total_hits=False,
+            **kwargs
+        )
+        page_seconds.observe(time.perf_counter() - start)
+        return page
+
+    def fetch(search_after):
+        kwargs = {}
+        if search_after is not None:
+            kwargs['search_after'] = search_after
+        return asyncio.ensure_future(search(**kwargs))
+
+    pending = fetch(None)
+    try:
+        while pending is not None:
+            page = await pending
+            pending = None
+            # The point-in-time id may change between pages
+            pit_id = page.get('pit_id', pit_id)
+            hits = page['hits']['hits']
+            if not hits:
+                break
+            if len(hits) == batch_size:
+                pending = fetch(hits[-1]['sort'])
+            yield [hit['_source'] for hit in hits]
+    finally:
+        if pending is not None:
+            pending.cancel()
+        await client.close_point_in_time(id=pit_id)
+
+
+def to_log_records(sources: List[Dict[str, Any]], trusted: bool = True) -> List[LogRecord]:
+    """
+    Convert a page of _source documents to LogRecord objects
+
+    Args:
+        sources: _source of each hit
+        trusted: The documents were indexed by this app and match the index template, so
+            records are built directly; otherwise each document is validated as a LogEntry first
+
+    Returns:
+        List[LogRecord]: One record per valid document; invalid documents are skipped
+    """
+    if trusted:
+        try:
+            return [LogRecord.from_source(source) for source in sources]
+        except KeyError:
+            # A document without some field; fall back to validation to skip just that one
+            pass
+    return [LogRecord.from_entry(entry) for entry in to_log_entries(sources)]
+
+
+def to_log_entries(sources: List[Dict[str, Any]]) -> List[LogEntry]:
+    """Convert a page of _source documents to LogEntry objects, skipping invalid ones"""
+    logs = []
+    for source in sources:
+        try:
+            logs.append(LogEntry(**source))
+        except Exception as e:
+            print(f"Error converting log entry: {str(e)}")
+    return logs
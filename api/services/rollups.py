@@ -0,0 +1,276 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import uuid
+
+# Entries are counted per minute, matching the /analyse time series
+MINUTE_KEY_FORMAT = '%Y-%m-%dT%H:%M:00'
+
+# Minutes buffered before rollups are written mid-ingest, bounding memory on long uploads
+ROLLUP_FLUSH_MINUTES = 1440
+
+STATUS_CLASSES = ('2xx', '3xx', '4xx', '5xx')
+
+ROLLUP_MAPPINGS = {
+    'dynamic': False,
+    'properties': {
+        'minute': {'type': 'date', 'format': 'strict_date_optional_time'},
+        'count': {'type': 'long'},
+        'bot': {'type': 'long'},
+        'human': {'type': 'long'},
+        **{f"status_{status_class}": {'type': 'long'} for status_class in STATUS_CLASSES},
+        'methods': {'type': 'object', 'enabled': False},
+    }
+}
+
+
+def rollup_index(base: str) -> str:
+    # Deliberately outside the f"{base}-*" pattern so raw log searches never see rollups
+    return f"{base}_rollup"
+
+
+async def ensure_rollup_index(client, base: str) -> None:
+    """Install or update the index template for the rollup index"""
+    await client.indices.put_index_template(
+        name=f"{rollup_index(base)}-template",
+        index_patterns=[rollup_index(base)],
+        priority=200,
+        template={'settings': {'number_of_shards': 1}, 'mappings': ROLLUP_MAPPINGS}
+    )
+
+
+async def expire_rollups(client, base: str, retention_days: int, today: Optional[datetime] = None) -> int:
+    """Delete rollup documents older than the retention period. Returns the number deleted."""
+    if retention_days <= 0:
+        return 0
+    cutoff = ((today or datetime.now()) - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+    response = await client.delete_by_query(
+        index=rollup_index(base),
+        query={'range': {'minute': {'lt': cutoff}}},
+        ignore_unavailable=True,
+        allow_no_indices=True,
+        conflicts='proceed'
+    )
+    return response.get('deleted', 0)
+
+
+class MinuteCounts:
+    """Counts for the entries in one minute"""
+    __slots__ = ('count', 'bot', 'human', 'statuses', 'methods', 'ips', 'paths')
+
+    def __init__(self):
+        self.count = 0
+        self.bot = 0
+        self.human = 0
+        self.statuses = Counter()
+        self.methods = Counter()
+        self.ips = Counter()
+        self.paths = Counter()
+
+    def merge(self, other: "MinuteCounts") -> None:
+        self.count += other.count
+        self.bot += other.bot
+        self.human += other.human
+        self.statuses.update(other.statuses)
+        self.methods.update(other.methods)
+        self.ips.update(other.ips)
+        self.paths.update(other.paths)
+
+
+class Rollups:
+    """
+    Per-minute counts accumulated from parsed entries at ingest time.
+
+    Each write produces one document per minute holding that ingest's contribution.
+    Documents are additive: the dashboard sums every document for a minute, so
+    several ingests covering the same minute never need to update each other.
+    """
+
+    def __init__(self):
+        self.minutes: Dict[str, MinuteCounts] = {}
+
+    def __len__(self) -> int:
+        return len(self.minutes)
+
+    def add(self, entries: List[Dict[str, Any]]) -> "Rollups":
+        for entry in entries:
+            when = entry.get('datetime')
+            if not isinstance(when, datetime):
+                continue
+            key = when.strftime(MINUTE_KEY_FORMAT)
+            minute = self.minutes.get(key)
+            if minute is None:
+                minute = self.minutes[key] = MinuteCounts()
+            minute.count += 1
+            if 'bot' in entry.get('http_user_agent', '').lower():
+                minute.bot += 1
+            else:
+                minute.human += 1
+            status = entry.get('status')
+            if isinstance(status, int) and 200 <= status < 600:
+                minute.statuses[f"{status // 100}xx"] += 1
+            minute.methods[entry.get('method', '').upper()] += 1
+            minute.ips[entry.get('remote_addr', '')] += 1
+            minute.paths[entry.get('path', '').split('?')[0]] += 1
+        return self
+
+    def merge(self, other: "Rollups") -> None:
+        for key, theirs in other.minutes.items():
+            minute = self.minutes.get(key)
+            if minute is None:
+                self.minutes[key] = theirs
+            else:
+                minute.merge(theirs)
+
+    def documents(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Rollup documents as (id, source) pairs"""
+        batch = uuid.uuid4().hex[:12]
+        documents = []
+        for key, minute in self.minutes.items():
+            source = {
+                'minute': key,
+                'count': minute.count,
+                'bot': minute.bot,
+                'human': minute.human,
+                'methods': dict(minute.methods),
+            }
+            for status_class in STATUS_CLASSES:
+                source[f"status_{status_class}"] = minute.statuses.get(status_class, 0)
+            documents.append((f"{key}_{batch}", source))
+        return documents
+
+
+async def write_rollups(writer, base: str, rollups: Rollups) -> None:
+    """Queue rollup documents on a BulkWriter"""
+    index = rollup_index(base)
+    for doc_id, source in rollups.documents():
+        await writer.add({"index": {"_index": index, "_id": doc_id}}, source)
+
+
+def _minute_bound(value: Any, has_format: bool) -> Optional[str]:
+    """A range bound as date math rounded to its minute, or None if it isn't a date"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # Epoch milliseconds, unless the query gives a format; the rollup index only reads ISO dates
+        value = str(value) if has_format else datetime.fromtimestamp(value / 1000, tz=timezone.utc).isoformat()
+    if not isinstance(value, str):
+        return None
+    if value.startswith('now') or '||' in value:
+        return f"{value}/m"
+    return f"{value}||/m"
+
+
+def _whole_minutes(bounds: Any) -> Optional[Dict[str, Any]]:
+    """
+    Narrow range bounds to the whole minutes inside them. Elasticsearch rounds a gt bound
+    up to the end of its minute and an lt bound down to the start of its minute, so the
+    range never includes part of a minute, whatever the bounds are (including "now-1h").
+    """
+    if not isinstance(bounds, dict):
+        return None
+    narrowed = {key: bounds[key] for key in ('format', 'time_zone') if key in bounds}
+    for operator, keys in (('gt', ('gte', 'gt', 'from')), ('lt', ('lte', 'lt', 'to'))):
+        value = next((bounds[key] for key in keys if bounds.get(key) is not None), None)
+        if value is not None:
+            narrowed[operator] = _minute_bound(value, 'format' in bounds)
+            if narrowed[operator] is None:
+                return None
+    return narrowed
+
+
+def whole_minutes_query(query: Dict[str, Any], field: str = 'datetime', target: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Restrict a query to the whole minutes inside its time range
+
+    Only queries that filter purely by time can be translated: match_all, range clauses
+    on the datetime field, and bool must/filter combinations of those.
+
+    Args:
+        query: Elasticsearch query DSL
+        field: Date field in the raw documents
+        target: Date field the translated query filters on (default: field)
+
+    Returns:
+        The translated query, or None if the query filters on anything other than time
+    """
+    target = target or field
+    if not isinstance(query, dict) or len(query) != 1:
+        return None
+    (kind, body), = query.items()
+    if kind == 'match_all':
+        return {'match_all': {}}
+    if kind == 'range' and isinstance(body, dict) and list(body) == [field]:
+        bounds = _whole_minutes(body[field])
+        return {'range': {target: bounds}} if bounds is not None else None
+    if kind == 'bool' and isinstance(body, dict):
+        if set(body) - {'must', 'filter'}:
+            return None
+        clauses = []
+        for occur in ('must', 'filter'):
+            items = body.get(occur, [])
+            for item in items if isinstance(items, list) else [items]:
+                translated = whole_minutes_query(item, field, target)
+                if translated is None:
+                    return None
+                clauses.append(translated)
+        return {'bool': {'filter': clauses}}
+    return None
+
+
+def rollup_query(query: Dict[str, Any], field: str = 'datetime') -> Optional[Dict[str, Any]]:
+    """
+    The query over rollup documents for the whole minutes inside a query's time range.
+    The logs in the partial minutes at its edges are matched by edge_query.
+
+    Returns:
+        The rollup query, or None if the query filters on anything other than time
+    """
+    return whole_minutes_query(query, field, 'minute')
+
+
+def edge_query(query: Dict[str, Any], field: str = 'datetime') -> Optional[Dict[str, Any]]:
+    """
+    The logs a query matches outside the whole minutes its rollups cover: those in the
+    minutes where its time range starts and ends
+
+    Returns:
+        The query, or None if the rollups cover every match
+    """
+    minutes = whole_minutes_query(query, field)
+    if minutes is None or minutes == {'match_all': {}}:
+        return None
+    return {'bool': {'filter': [query], 'must_not': [minutes]}}
+
+
+def build_rollup_aggregations(minute_format: str) -> Dict[str, Any]:
+    """Per-minute sums over rollup documents, shaped like the raw requests_per_minute histogram"""
+    return {
+        'total': {'sum': {'field': 'count'}},
+        'requests_per_minute': {
+            'date_histogram': {
+                'field': 'minute',
+                'fixed_interval': '1m',
+                'min_doc_count': 0,
+                'format': minute_format
+            },
+            'aggs': {
+                'count': {'sum': {'field': 'count'}},
+                'bot': {'sum': {'field': 'bot'}},
+                'human': {'sum': {'field': 'human'}},
+            }
+        }
+    }
+
+
+def parse_rollup_aggregations(aggregations: Dict[str, Any]) -> Tuple[int, List[Tuple[str, int]], List[Tuple[str, int, int]]]:
+    """
+    Returns:
+        Tuple of (total entries covered, requests_per_minute, bot_vs_human_traffic)
+    """
+    requests_per_minute = []
+    bot_vs_human_traffic = []
+    for bucket in aggregations.get('requests_per_minute', {}).get('buckets', []):
+        minute = bucket['key_as_string']
+        requests_per_minute.append((minute, int(bucket['count']['value'])))
+        bot_vs_human_traffic.append((minute, int(bucket['bot']['value']), int(bucket['human']['value'])))
+    total = int(aggregations.get('total', {}).get('value', 0))
+    return total, requests_per_minute, bot_vs_human_traffic
@@ -0,0 +1,148 @@
+from typing import Any, Dict, Iterable, List
+from collections import deque
+from datetime import datetime
+from model.log import LogRecord
+from services.parser import detect_suspicious_user_agents, detect_sensitive_endpoint_access, detect_attack_signatures
+from services.metrics import DETECTOR_SECONDS
+import time
+
+# Evidence entries kept per detector key; totals are still counted past this
+DEFAULT_MAX_EXAMPLES = 100
+
+# Entries returned in the "logs" section of /analyse
+DEFAULT_SAMPLE_SIZE = 100
+
+
+class BurstTracker:
+    """
+    Streaming equivalent of detect_burst_requests for entries arriving in time order.
+
+    Each IP keeps a deque of its requests inside the current window. A window is
+    only evaluated once it is complete (a later request, or the end of the stream,
+    falls outside it), so the reported bursts match the batch detector exactly
+    while memory stays bounded by the number of requests per window.
+    """
+
+    def __init__(self, time_window_seconds: int = 60, request_threshold: int = 10):
+        self.time_window_seconds = time_window_seconds
+        self.request_threshold = request_threshold
+        self._windows: Dict[str, deque] = {}
+        self.bursts: Dict[str, List[tuple[LogRecord, float]]] = {}
+
+    def feed(self, logs: Iterable[LogRecord]) -> None:
+        """Add entries, which must be sorted by datetime across calls"""
+        latest = None
+        for log in logs:
+            ip = log.remote_addr
+            if ip in self.bursts:
+                continue
+            ts = log.timestamp
+            if ts is None:
+                continue
+            window = self._windows.get(ip)
+            if window is None:
+                window = self._windows[ip] = deque()
+            self._close_windows(ip, window, ts)
+            if ip in self.bursts:
+                continue
+            window.append((log, ts))
+            latest = ts
+
+        # Evaluate IPs that have gone quiet so their windows don't linger
+        if latest is not None:
+            for ip in list(self._windows):
+                window = self._windows[ip]
+                if window and (latest - window[-1][1]).total_seconds() > self.time_window_seconds:
+                    self._flush(ip, window)
+
+    def _close_windows(self, ip: str, window: deque, ts: datetime) -> None:
+        """Evaluate every window that ends before ts"""
+        while window and (ts - window[0][1]).total_seconds() > self.time_window_seconds:
+            if self._report(ip, window):
+                return
+            window.popleft()
+
+    def _report(self, ip: str, window: deque) -> bool:
+        if len(window) < self.request_threshold:
+            return False
+        start = window[0][1]
+        self.bursts[ip] = [(log, (ts - start).total_seconds()) for log, ts in window]
+        del self._windows[ip]
+        return True
+
+    def _flush(self, ip: str, window: deque) -> None:
+        # Every remaining window is a subset of the earliest one, so only it can be a burst
+        if not self._report(ip, window):
+            del self._windows[ip]
+
+    def results(self) -> Dict[str, List[tuple[LogRecord, float]]]:
+        """Close all open windows and return the detected bursts"""
+        for ip in list(self._windows):
+            self._flush(ip, self._windows[ip])
+        return self.bursts
+
+
+# Entry-returning detectors run on every batch, each timed separately
+BATCH_DETECTORS = (
+    ('suspicious_user_agents', detect_suspicious_user_agents, DETECTOR_SECONDS.labels('suspicious_user_agents')),
+    ('sensitive_endpoint_access', detect_sensitive_endpoint_access, DETECTOR_SECONDS.labels('sensitive_endpoint_access')),
+    ('attack_signatures', detect_attack_signatures, DETECTOR_SECONDS.labels('attack_signatures')),
+)
+_burst_requests_seconds = DETECTOR_SECONDS.labels('burst_requests')
+
+
+class RowDetectors:
+    """
+    Runs the entry-returning detectors over batches of entries as they are retrieved.
+
+    Evidence lists are capped at max_examples per key while totals keep counting,
+    so memory does not grow with the size of the match set.
+    """
+
+    def __init__(self, max_examples: int = DEFAULT_MAX_EXAMPLES, sample_size: int = DEFAULT_SAMPLE_SIZE):
+        self.max_examples = max_examples
+        self.sample_size = sample_size
+        self.sample: List[LogRecord] = []
+        self.entries_seen = 0
+        self.bursts = BurstTracker()
+        self.suspicious_user_agents: Dict[str, List[LogRecord]] = {}
+        self.sensitive_endpoint_access: Dict[str, List[LogRecord]] = {}
+        self.attack_signatures: Dict[str, List[LogRecord]] = {}
+        self.totals: Dict[str, Dict[str, int]] = {
+            'suspicious_user_agents': {},
+            'sensitive_endpoint_access': {},
+            'attack_signatures': {},
+        }
+
+    def feed(self, logs: List[LogRecord]) -> None:
+        """Run the detectors over the next batch of entries"""
+        self.entries_seen += len(logs)
+        if len(self.sample) < self.sample_size:
+            self.sample.extend(logs[:self.sample_size - len(self.sample)])
+
+        for name, detector, seconds in BATCH_DETECTORS:
+            start = time.perf_counter()
+            self._merge(name, getattr(self, name), detector(logs))
+            seconds.observe(time.perf_counter() - start)
+        start = time.perf_counter()
+        self.bursts.feed(logs)
+        _burst_requests_seconds.observe(time.perf_counter() - start)
+
+    def _merge(self, name: str, merged: Dict[str, List[LogRecord]], batch: Dict[str, List[LogRecord]]) -> None:
+        totals = self.totals[name]
+        for key, entries in batch.items():
+            totals[key] = totals.get(key, 0) + len(entries)
+            examples = merged.setdefault(key, [])
+            if len(examples) < self.max_examples:
+                examples.extend(entries[:self.max_examples - len(examples)])
+
+    def results(self) -> Dict[str, Any]:
+        """Return the detector results in the /analyse response shapes"""
+        return {
+            'logs': self.sample,
+            'suspicious_user_agents': self.suspicious_user_agents,
+            'sensitive_endpoint_access': self.sensitive_endpoint_access,
+            'attack_signatures': self.attack_signatures,
+            'burst_requests': self.bursts.results(),
+            'detector_totals': self.totals,
+        }
@@ -1,11 +1,34 @@
-import boto3
+from functools import lru_cache
 import os
 
-# AWS S3 setup
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION')
-)
-S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
\ No newline at end of file
+S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME')
+
+# Set S3_STUB=1 to use an in-memory bucket instead, or also S3_STUB_DIR to serve a local
+# directory (S3_STUB_DIR/<bucket>/<key>). S3_ENDPOINT_URL points the real client at an
+# S3-compatible server such as MinIO.
+S3_STUB_DIR = os.getenv('S3_STUB_DIR')
+
+
+@lru_cache(maxsize=None)
+def get_s3():
+    """AWS S3 client, built on first use so importing this module doesn't import boto3"""
+    if os.getenv('S3_STUB') == '1':
+        from services.stub_s3 import StubS3Client
+        return StubS3Client(S3_STUB_DIR)
+    import boto3
+    from botocore.config import Config
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        region_name=os.getenv('AWS_REGION'),
+        endpoint_url=os.getenv('S3_ENDPOINT_URL'),
+        # Ranged GETs of several objects run at once on worker threads
+        config=Config(max_pool_connections=int(os.getenv('S3_MAX_POOL_CONNECTIONS', '32')))
+    )
+
+
+def __getattr__(name: str):
+    if name == 's3':
+        return get_s3()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
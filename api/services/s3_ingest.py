@@ -0,0 +1,475 @@
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from collections import deque
+from dataclasses import dataclass, field, asdict, fields
+from services.ingest import IngestStats, ingest_stream
+from services.dedup import DedupIndex, dedup_for
+from services.jobs import QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED
+from services.concurrency import run_ingest_cpu
+from services.metrics import S3_BYTES, S3_OBJECTS, S3_REQUEST_SECONDS
+import asyncio
+import bz2
+import hashlib
+import json
+import os
+import time
+import zlib
+
+S3_INGEST_DIR = os.getenv("S3_INGEST_DIR", os.path.join(os.path.dirname(__file__), '..', 'data', 's3_ingest'))
+
+# Objects downloaded and ingested at once
+S3_INGEST_CONCURRENCY = int(os.getenv("S3_INGEST_CONCURRENCY", "4"))
+
+# Objects are fetched as ranged GETs of this many bytes, several parts at a time, so a
+# large object downloads at the speed of several connections rather than one
+S3_PART_SIZE = int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024)))
+S3_PART_CONCURRENCY = int(os.getenv("S3_PART_CONCURRENCY", "4"))
+
+# Compressed input is fed to the decompressor in slices of this size, bounding the
+# size of each decompressed chunk handed to the parser
+DECOMPRESS_SLICE_SIZE = 1024 * 1024
+
+# Minimum seconds between state writes while objects are being ingested
+CHECKPOINT_INTERVAL_SECONDS = 1.0
+
+_list_seconds = S3_REQUEST_SECONDS.labels('list')
+_get_seconds = S3_REQUEST_SECONDS.labels('get')
+_ingested_objects = S3_OBJECTS.labels('ingested')
+_skipped_objects = S3_OBJECTS.labels('skipped')
+_failed_objects = S3_OBJECTS.labels('failed')
+
+
+@dataclass
+class S3Object:
+    key: str
+    size: int
+    etag: str
+
+
+def _timed_call(histogram, func: Callable, **kwargs):
+    start = time.perf_counter()
+    try:
+        return func(**kwargs)
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+async def list_objects(client, bucket: str, prefix: str) -> List[S3Object]:
+    """Every object under a prefix, in key order"""
+    objects = []
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    while True:
+        page = await asyncio.to_thread(_timed_call, _list_seconds, client.list_objects_v2, **kwargs)
+        objects.extend(S3Object(item['Key'], item['Size'], item['ETag']) for item in page.get('Contents', []))
+        if not page.get('IsTruncated'):
+            return objects
+        kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+def _get_range(client, bucket: str, obj: S3Object, first: int, last: int) -> bytes:
+    # IfMatch makes every part come from the same version of the object
+    response = _timed_call(_get_seconds, client.get_object, Bucket=bucket, Key=obj.key, Range=f"bytes={first}-{last}", IfMatch=obj.etag)
+    data = response['Body'].read()
+    S3_BYTES.inc(len(data))
+    return data
+
+
+async def read_object(
+    client,
+    bucket: str,
+    obj: S3Object,
+    start: int = 0,
+    part_size: int = S3_PART_SIZE,
+    concurrency: int = S3_PART_CONCURRENCY
+) -> AsyncIterator[bytes]:
+    """
+    Download an object as ranged GETs, several parts in flight at a time
+
+    Parts are yielded in order; at most `concurrency` parts are held in memory.
+
+    Args:
+        client: boto3 S3 client (or StubS3Client)
+        bucket: Bucket name
+        obj: The object, as listed
+        start: Byte offset to start at, when resuming
+        part_size: Bytes per ranged GET
+        concurrency: Parts requested at once
+
+    Yields:
+        bytes: The next part of the object
+    """
+    ranges = iter(range(start, obj.size, part_size))
+    pending: deque = deque()
+
+    def fetch_next() -> None:
+        first = next(ranges, None)
+        if first is not None:
+            last = min(first + part_size, obj.size) - 1
+            pending.append(asyncio.ensure_future(asyncio.to_thread(_get_range, client, bucket, obj, first, last)))
+
+    try:
+        for _ in range(concurrency):
+            fetch_next()
+        while pending:
+            part = await pending.popleft()
+            fetch_next()
+            yield part
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+# Decompressors by file extension; objects with other extensions are read as plain text
+DECOMPRESSORS = {
+    '.gz': lambda: zlib.decompressobj(zlib.MAX_WBITS | 16),
+    '.bz2': bz2.BZ2Decompressor,
+}
+
+
+def decompressor_for(key: str) -> Optional[Callable]:
+    for extension, decompressor in DECOMPRESSORS.items():
+        if key.endswith(extension):
+            return decompressor
+    return None
+
+
+async def decompress(chunks: AsyncIterator[bytes], new_decompressor: Callable) -> AsyncIterator[bytes]:
+    """
+    Stream-decompress chunks as they arrive, on the analysis workers
+
+    Concatenated streams (e.g. gzip members appended by log rotation) are all decompressed.
+    """
+    decompressor = new_decompressor()
+    async for chunk in chunks:
+        for offset in range(0, len(chunk), DECOMPRESS_SLICE_SIZE):
+            data = chunk[offset:offset + DECOMPRESS_SLICE_SIZE]
+            while data:
+                if decompressor.eof:
+                    decompressor = new_decompressor()
+                output = await run_ingest_cpu(decompressor.decompress, data)
+                data = decompressor.unused_data if decompressor.eof else b''
+                if output:
+                    yield output
+
+
+@dataclass
+class S3ObjectState:
+    """Per-object checkpoint of a prefix ingest"""
+    key: str
+    size: int
+    etag: str
+    status: str = QUEUED
+    # Plain-text objects resume from here: every line before checkpoint_offset has been
+    # indexed, producing checkpoint_entries entries. Compressed objects restart from the
+    # beginning; document IDs are derived from line content, so nothing is duplicated.
+    checkpoint_offset: int = 0
+    checkpoint_entries: int = 0
+    lines_indexed: int = 0
+    lines_failed: int = 0
+    lines_skipped: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class S3Ingest:
+    """Persistent state of the ingest of one bucket prefix"""
+    id: str
+    bucket: str
+    prefix: str
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    objects: Dict[str, S3ObjectState] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @staticmethod
+    def id_for(bucket: str, prefix: str) -> str:
+        # One state per bucket and prefix, so a re-run picks up the previous checkpoints
+        return hashlib.sha256(f"{bucket}/{prefix}".encode('utf-8')).hexdigest()[:32]
+
+    def progress(self, live: Optional[Dict[str, IngestStats]] = None) -> Dict[str, Any]:
+        """Return the state with per-status object counts and totals, including objects still being ingested"""
+        state = asdict(self)
+        live = live or {}
+        for key, stats in live.items():
+            if key in state['objects']:
+                counters = state['objects'][key]
+                counters['lines_indexed'] += stats.lines_indexed
+                counters['lines_failed'] += stats.lines_failed
+                counters['lines_skipped'] += stats.lines_skipped
+        objects = list(state['objects'].values())
+        counts: Dict[str, int] = {}
+        for obj in objects:
+            counts[obj['status']] = counts.get(obj['status'], 0) + 1
+        state['object_counts'] = counts
+        state['bytes_total'] = sum(obj['size'] for obj in objects)
+        state['bytes_completed'] = sum(obj['size'] for obj in objects if obj['status'] == COMPLETED)
+        state['lines_indexed'] = sum(obj['lines_indexed'] for obj in objects)
+        state['lines_failed'] = sum(obj['lines_failed'] for obj in objects)
+        state['lines_skipped'] = sum(obj['lines_skipped'] for obj in objects)
+        return state
+
+
+class S3IngestManager:
+    """
+    Ingests every object under an S3 prefix.
+
+    Objects are listed, then downloaded and ingested S3_INGEST_CONCURRENCY at a time, each
+    as concurrent ranged GETs streamed through decompression into the parser and a bulk
+    writer (see ingest_stream). Progress is checkpointed per object in S3_INGEST_DIR:
+    running the same prefix again skips objects already ingested with an unchanged ETag
+    and resumes the rest, and ingests interrupted by a restart are resumed on start.
+    """
+
+    def __init__(
+        self,
+        storage,
+        index: str,
+        client=None,
+        state_dir: str = S3_INGEST_DIR,
+        concurrency: int = S3_INGEST_CONCURRENCY,
+        part_size: int = S3_PART_SIZE,
+        part_concurrency: int = S3_PART_CONCURRENCY
+    ):
+        self.storage = storage
+        self.index = index
+        self.state_dir = state_dir
+        self.concurrency = concurrency
+        self.part_size = part_size
+        self.part_concurrency = part_concurrency
+        self._client = client
+        self.ingests: Dict[str, S3Ingest] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Ingests whose state changed since it was last written, and a lock per ingest
+        # keeping its writes in order
+        self._dirty: set = set()
+        self._save_locks: Dict[str, asyncio.Lock] = {}
+        # Counters of the objects being ingested, by ingest id and key
+        self._stats: Dict[str, Dict[str, IngestStats]] = {}
+        # Called after an object indexes documents, e.g. to invalidate cached results
+        self.on_indexed = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from services.s3 import get_s3
+            self._client = get_s3()
+        return self._client
+
+    def _state_path(self, ingest_id: str) -> str:
+        return os.path.join(self.state_dir, f"{ingest_id}.json")
+
+    async def _save(self, ingest: S3Ingest) -> None:
+        """
+        Write an ingest's state
+
+        The state is copied on the event loop, so the write sees a consistent checkpoint,
+        and serialized and written on a thread, as a large prefix has many objects.
+        """
+        self._dirty.discard(ingest.id)
+        state = {f.name: getattr(ingest, f.name) for f in fields(S3Ingest) if f.name != 'objects'}
+        state['objects'] = {key: dict(vars(obj)) for key, obj in ingest.objects.items()}
+        async with self._save_locks.setdefault(ingest.id, asyncio.Lock()):
+            await asyncio.to_thread(self._write, self._state_path(ingest.id), state)
+
+    def _write(self, path: str, state: Dict[str, Any]) -> None:
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    async def _checkpoint(self, ingest: S3Ingest) -> None:
+        """Write the state of a running ingest at most every CHECKPOINT_INTERVAL_SECONDS"""
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL_SECONDS)
+            if ingest.id in self._dirty:
+                # Once started, a write finishes (holding the ingest's lock) even if the ingest stops
+                await asyncio.shield(self._save(ingest))
+
+    def _load(self, path: str) -> S3Ingest:
+        with open(path) as f:
+            state = json.load(f)
+        objects = {
+            key: S3ObjectState(**{f.name: value[f.name] for f in fields(S3ObjectState) if f.name in value})
+            for key, value in state.pop('objects', {}).items()
+        }
+        ingest = S3Ingest(**{f.name: state[f.name] for f in fields(S3Ingest) if f.name in state and f.name != 'objects'})
+        ingest.objects = objects
+        return ingest
+
+    async def start(self) -> None:
+        """Resume ingests interrupted by a restart"""
+        if not os.path.isdir(self.state_dir):
+            return
+        for name in sorted(os.listdir(self.state_dir)):
+            if not name.endswith('.json'):
+                continue
+            ingest = self._load(os.path.join(self.state_dir, name))
+            self.ingests[ingest.id] = ingest
+            if ingest.status in (QUEUED, RUNNING):
+                self._launch(ingest)
+
+    async def stop(self) -> None:
+        """Stop running ingests; they keep their checkpoints and resume on the next start"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(self, bucket: str, prefix: str) -> S3Ingest:
+        """
+        Start (or restart) ingesting a prefix in the background
+
+        Returns:
+            S3Ingest: The ingest state; if the prefix is already being ingested, that ingest
+        """
+        ingest_id = S3Ingest.id_for(bucket, prefix)
+        ingest = self.ingests.get(ingest_id)
+        if ingest is not None and ingest_id in self._tasks:
+            return ingest
+        if ingest is None and os.path.exists(self._state_path(ingest_id)):
+            ingest = self._load(self._state_path(ingest_id))
+        if ingest is None:
+            ingest = S3Ingest(id=ingest_id, bucket=bucket, prefix=prefix)
+        ingest.status = QUEUED
+        ingest.error = None
+        ingest.finished_at = None
+        self.ingests[ingest_id] = ingest
+        await self._save(ingest)
+        self._launch(ingest)
+        return ingest
+
+    def get(self, ingest_id: str) -> Optional[Dict[str, Any]]:
+        ingest = self.ingests.get(ingest_id)
+        return ingest.progress(self._stats.get(ingest_id)) if ingest is not None else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [self.get(ingest_id) for ingest_id in self.ingests]
+
+    def cancel(self, ingest_id: str) -> bool:
+        """Cancel a running ingest. Returns False if it isn't running."""
+        ingest = self.ingests.get(ingest_id)
+        task = self._tasks.get(ingest_id)
+        if ingest is None or task is None:
+            return False
+        ingest.status = CANCELLED
+        task.cancel()
+        return True
+
+    def _launch(self, ingest: S3Ingest) -> None:
+        task = asyncio.create_task(self._run(ingest))
+        self._tasks[ingest.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(ingest.id, None))
+
+    def _plan(self, ingest: S3Ingest, listed: List[S3Object]) -> List[S3Object]:
+        """Merge a fresh listing into the saved checkpoints; returns the objects still to ingest"""
+        objects = {}
+        todo = []
+        for obj in listed:
+            state = ingest.objects.get(obj.key)
+            if state is None or state.etag != obj.etag or state.size != obj.size:
+                # New, or replaced since the last run
+                state = S3ObjectState(obj.key, obj.size, obj.etag)
+            objects[obj.key] = state
+            if state.status == COMPLETED:
+                _skipped_objects.inc()
+            else:
+                state.status = QUEUED
+                state.error = None
+                todo.append(obj)
+        ingest.objects = objects
+        return todo
+
+    async def _run(self, ingest: S3Ingest) -> None:
+        ingest.status = RUNNING
+        ingest.started_at = time.time()
+        checkpoint = asyncio.create_task(self._checkpoint(ingest))
+        try:
+            todo = self._plan(ingest, await list_objects(self.client, ingest.bucket, ingest.prefix))
+            await self._save(ingest)
+            dedup = await dedup_for(self.storage)
+            queue: asyncio.Queue = asyncio.Queue()
+            for obj in todo:
+                queue.put_nowait(obj)
+
+            async def worker():
+                while not queue.empty():
+                    await self._ingest_object(ingest, queue.get_nowait(), dedup)
+
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(todo)))))
+            failed = [state.key for state in ingest.objects.values() if state.status == FAILED]
+            ingest.status = FAILED if failed else COMPLETED
+            if failed:
+                ingest.error = f"{len(failed)} objects failed"
+        except asyncio.CancelledError:
+            # Cancelled by the API, or the app is stopping and it resumes on the next start
+            for state in ingest.objects.values():
+                if state.status == RUNNING:
+                    state.status = QUEUED if ingest.status != CANCELLED else CANCELLED
+            raise
+        except Exception as e:
+            print(f"S3 ingest of s3://{ingest.bucket}/{ingest.prefix} failed: {str(e)}")
+            ingest.status = FAILED
+            ingest.error = str(e)
+        finally:
+            checkpoint.cancel()
+            if ingest.status != RUNNING:
+                ingest.finished_at = time.time()
+            await self._save(ingest)
+
+    async def _ingest_object(self, ingest: S3Ingest, obj: S3Object, dedup: Optional[DedupIndex] = None) -> None:
+        state = ingest.objects[obj.key]
+        state.status = RUNNING
+        new_decompressor = decompressor_for(obj.key)
+        if new_decompressor is not None:
+            # Decompressed offsets can't be resumed from with a ranged GET
+            state.checkpoint_offset = state.checkpoint_entries = 0
+        start_offset, start_entries = state.checkpoint_offset, state.checkpoint_entries
+
+        chunks = read_object(self.client, ingest.bucket, obj, start_offset, self.part_size, self.part_concurrency)
+        if new_decompressor is not None:
+            chunks = decompress(chunks, new_decompressor)
+
+        def on_checkpoint(offset: int, entries: int):
+            if new_decompressor is None:
+                state.checkpoint_offset = offset
+                state.checkpoint_entries = entries
+            self._dirty.add(ingest.id)
+
+        stats = IngestStats()
+        live = self._stats.setdefault(ingest.id, {})
+        live[obj.key] = stats
+        try:
+            await ingest_stream(
+                chunks,
+                self.storage,
+                self.index,
+                stats=stats,
+                start_offset=start_offset,
+                start_id=start_entries,
+                on_checkpoint=on_checkpoint,
+                dedup=dedup
+            )
+            state.status = COMPLETED
+            state.checkpoint_offset = obj.size
+            _ingested_objects.inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"S3 ingest of s3://{ingest.bucket}/{obj.key} failed: {str(e)}")
+            state.status = FAILED
+            state.error = str(e)
+            _failed_objects.inc()
+        finally:
+            live.pop(obj.key, None)
+            state.lines_indexed += stats.lines_indexed
+            state.lines_failed += stats.lines_failed
+            state.lines_skipped += stats.lines_skipped
+            if state.status != COMPLETED:
+                # Entries past the checkpoint are processed again on resume, so don't count them yet
+                excess = state.lines_indexed + state.lines_failed - state.checkpoint_entries
+                state.lines_indexed -= min(max(excess, 0), state.lines_indexed)
+            self._dirty.add(ingest.id)
+            if stats.lines_indexed and self.on_indexed:
+                self.on_indexed()
@@ -0,0 +1,444 @@
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from collections import defaultdict
+from services.storage import StorageBackend
+from services.aggregations import MAX_TERMS, error_path_buckets, minute_buckets, parse_aggregations
+from services.indices import ELASTIC_RETENTION_DAYS, INDEX_DATE_FORMAT, _parse_bound
+from services.retrieval import DEFAULT_BATCH_SIZE, ENTRY_FIELDS
+from services.metrics import SQLITE_QUERY_SECONDS
+import asyncio
+import functools
+import os
+import orjson
+import sqlite3
+import threading
+import time
+
+# Columns of the logs table; attack_tags is stored as a JSON array
+COLUMNS = ENTRY_FIELDS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    index_name TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    remote_addr TEXT,
+    remote_user TEXT,
+    time_local TEXT,
+    request TEXT,
+    status INTEGER,
+    body_bytes_sent INTEGER,
+    http_referer TEXT,
+    http_user_agent TEXT,
+    datetime TEXT NOT NULL DEFAULT '',
+    method TEXT,
+    path TEXT,
+    protocol TEXT,
+    attack_tags TEXT,
+    UNIQUE (index_name, doc_id)
+);
+CREATE INDEX IF NOT EXISTS logs_datetime ON logs (datetime);
+CREATE INDEX IF NOT EXISTS logs_remote_addr ON logs (remote_addr, datetime);
+CREATE INDEX IF NOT EXISTS logs_status ON logs (status, path);
+CREATE INDEX IF NOT EXISTS logs_path ON logs (path);
+"""
+
+# Query DSL fields that map to a column; the text subfield is searched like the keyword
+FIELD_COLUMNS = {field: field for field in COLUMNS}
+FIELD_COLUMNS['http_user_agent.text'] = 'http_user_agent'
+
+_INSERT = f"INSERT OR REPLACE INTO logs (index_name, doc_id, {', '.join(COLUMNS)}) VALUES ({', '.join('?' * (len(COLUMNS) + 2))})"
+_CREATE = _INSERT.replace('INSERT OR REPLACE', 'INSERT OR IGNORE', 1)
+
+_bulk_seconds = SQLITE_QUERY_SECONDS.labels('bulk')
+_aggregate_seconds = SQLITE_QUERY_SECONDS.labels('aggregate')
+_search_seconds = SQLITE_QUERY_SECONDS.labels('search')
+_count_seconds = SQLITE_QUERY_SECONDS.labels('count')
+
+
+def _column(field: str) -> str:
+    column = FIELD_COLUMNS.get(field)
+    if column is None:
+        raise ValueError(f"Unsupported field {field!r}")
+    return column
+
+
+def _single(clause: Dict[str, Any]) -> Tuple[str, Any]:
+    if not isinstance(clause, dict) or len(clause) != 1:
+        raise ValueError(f"Malformed query clause {clause!r}")
+    return next(iter(clause.items()))
+
+
+def _clauses(value: Any) -> List[Dict[str, Any]]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _glob(pattern: str) -> str:
+    # Query DSL wildcards are * and ?, which GLOB shares; GLOB's [ has to be escaped
+    return pattern.replace('[', '[[]')
+
+
+def _bound(column: str, value: Any) -> Any:
+    if column != 'datetime':
+        return value
+    parsed = _parse_bound(value)
+    if parsed is None:
+        raise ValueError(f"Unsupported date bound {value!r}")
+    return parsed.isoformat()
+
+
+def _membership(column: str, operator: str) -> str:
+    # attack_tags holds several values; a document matches if any of them does
+    if column == 'attack_tags':
+        return f"EXISTS (SELECT 1 FROM json_each(logs.attack_tags) WHERE value {operator})"
+    return f"{column} {operator}"
+
+
+def translate(query: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    """
+    Translate the query DSL subset the dashboard sends into a WHERE clause
+
+    Supports match_all, match_none, bool, term, terms, range, wildcard, prefix, exists
+    and match / match_phrase (as a case-insensitive substring, like the Elasticsearch stub).
+
+    Args:
+        query: Elasticsearch query DSL
+
+    Returns:
+        Tuple of (SQL expression, parameters)
+
+    Raises:
+        ValueError: For query types or fields the embedded backend doesn't support
+    """
+    if not query:
+        return '1', []
+    kind, body = _single(query)
+    if kind == 'match_all':
+        return '1', []
+    if kind == 'match_none':
+        return '0', []
+    if kind == 'bool':
+        parts: List[str] = []
+        params: List[Any] = []
+        must = _clauses(body.get('must')) + _clauses(body.get('filter'))
+        for clause in must:
+            sql, clause_params = translate(clause)
+            parts.append(f"({sql})")
+            params.extend(clause_params)
+        for clause in _clauses(body.get('must_not')):
+            sql, clause_params = translate(clause)
+            parts.append(f"NOT ({sql})")
+            params.extend(clause_params)
+        should = _clauses(body.get('should'))
+        if should:
+            required = int(body.get('minimum_should_match', 0 if must else 1))
+            if required > 0:
+                matched = []
+                for clause in should:
+                    sql, clause_params = translate(clause)
+                    matched.append(f"(CASE WHEN {sql} THEN 1 ELSE 0 END)")
+                    params.extend(clause_params)
+                parts.append(f"({' + '.join(matched)}) >= {required}")
+        return (' AND '.join(parts) or '1'), params
+    if kind == 'exists':
+        return f"{_column(body['field'])} IS NOT NULL", []
+
+    field, condition = _single(body)
+    column = _column(field)
+    if kind == 'term':
+        value = condition.get('value') if isinstance(condition, dict) else condition
+        return _membership(column, '= ?'), [value]
+    if kind == 'terms':
+        if not condition:
+            return '0', []
+        return _membership(column, f"IN ({', '.join('?' * len(condition))})"), list(condition)
+    if kind == 'range':
+        parts = []
+        params = []
+        for key, operator in (('gte', '>='), ('gt', '>'), ('lte', '<='), ('lt', '<'), ('from', '>='), ('to', '<=')):
+            if condition.get(key) is not None:
+                parts.append(f"{column} {operator} ?")
+                params.append(_bound(column, condition[key]))
+        return (' AND '.join(parts) or '1'), params
+    if kind in ('wildcard', 'prefix'):
+        pattern = condition.get('value') if isinstance(condition, dict) else condition
+        insensitive = isinstance(condition, dict) and condition.get('case_insensitive', False)
+        pattern = _glob(str(pattern)) + ('*' if kind == 'prefix' else '')
+        if insensitive:
+            return _membership(f"lower({column})" if column != 'attack_tags' else column, 'GLOB lower(?)'), [pattern]
+        return _membership(column, 'GLOB ?'), [pattern]
+    if kind in ('match', 'match_phrase'):
+        text = condition.get('query') if isinstance(condition, dict) else condition
+        return f"instr(lower({column}), lower(?)) > 0", [str(text)]
+    raise ValueError(f"Unsupported query type {kind!r}")
+
+
+def _decode(value: Any) -> Any:
+    return orjson.loads(value) if isinstance(value, (bytes, bytearray, memoryview, str)) else value
+
+
+def _is_timestamp(value: str) -> bool:
+    # Like the Elasticsearch mapping's ignore_malformed: a timestamp the parser couldn't
+    # read is stored as missing, leaving its raw text in time_local
+    try:
+        datetime.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _row(index: str, doc_id: str, source: Dict[str, Any]) -> Tuple[Any, ...]:
+    values = [index, doc_id]
+    for column in COLUMNS:
+        value = source.get(column)
+        if column == 'attack_tags':
+            value = orjson.dumps(value).decode() if value is not None else None
+        elif column == 'datetime':
+            value = value if value and _is_timestamp(value) else ''
+        values.append(value)
+    return tuple(values)
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Logs in a local SQLite database, for running and load-testing the API without a cluster.
+
+    Every log is one row of an indexed table; the dashboard's queries are translated to
+    SQL and the /analyse aggregations computed with GROUP BY, then returned in the shape
+    Elasticsearch would give so they go through the same parsing. Writes are serialized
+    on one connection, while reads use a connection per worker thread (the database is
+    in WAL mode, so reads don't wait for writes).
+    """
+
+    def __init__(self, path: str, index: str, max_terms: int = MAX_TERMS, error_threshold: int = 3):
+        self.path = path
+        self.index = index
+        self.max_terms = max_terms
+        self.error_threshold = error_threshold
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-writer')
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def for_index(self, index: str) -> "SQLiteStorage":
+        return SQLiteStorage(self.path, index, self.max_terms, self.error_threshold)
+
+    @property
+    def dedup_scope(self) -> Optional[str]:
+        if self.path == ':memory:':
+            return None
+        return f"sqlite:{os.path.abspath(self.path)}/{self.index}"
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _scope(self) -> Tuple[str, List[Any]]:
+        """Restrict a query to this backend's daily partitions"""
+        return "(index_name = ? OR index_name GLOB ?)", [self.index, f"{_glob(self.index)}-*"]
+
+    def _where(self, query: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        scope, scope_params = self._scope()
+        sql, params = translate(query)
+        return f"{scope} AND ({sql})", scope_params + params
+
+    async def _write(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, functools.partial(func, *args))
+
+    async def _read(self, histogram, func, *args):
+        start = time.perf_counter()
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    async def setup(self) -> None:
+        await self._write(self._connection)
+
+    async def bulk(self, operations: List[Any], **kwargs) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            return await self._write(self._bulk, operations)
+        finally:
+            _bulk_seconds.observe(time.perf_counter() - start)
+
+    def _bulk(self, operations: List[Any]) -> Dict[str, Any]:
+        connection = self._connection()
+        items = []
+        errors = False
+        with connection:
+            for i in range(0, len(operations), 2):
+                op_type, meta = next(iter(_decode(operations[i]).items()))
+                index = meta.get('_index') or self.index
+                doc_id = meta.get('_id') or os.urandom(12).hex()
+                if op_type not in ('index', 'create'):
+                    errors = True
+                    items.append({op_type: {'_index': index, '_id': doc_id, 'status': 400, 'error': {'type': 'illegal_argument_exception', 'reason': f"unsupported bulk action {op_type}"}}})
+                    continue
+                row = _row(index, doc_id, _decode(operations[i + 1]))
+                if op_type == 'create':
+                    if connection.execute(_CREATE, row).rowcount == 0:
+                        errors = True
+                        items.append({op_type: {'_index': index, '_id': doc_id, 'status': 409, 'error': {'type': 'version_conflict_engine_exception', 'reason': 'document already exists'}}})
+                        continue
+                else:
+                    connection.execute(_INSERT, row)
+                items.append({op_type: {'_index': index, '_id': doc_id, 'status': 201, 'result': 'created'}})
+        return {'errors': errors, 'items': items}
+
+    async def count(self, query: Dict[str, Any]) -> int:
+        where, params = self._where(query)
+        return await self._read(_count_seconds, self._count, where, params)
+
+    def _count(self, where: str, params: List[Any]) -> int:
+        return self._connection().execute(f"SELECT COUNT(*) FROM logs WHERE {where}", params).fetchone()[0]
+
+    async def aggregate(self, query: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        where, params = self._where(query)
+        return await self._read(_aggregate_seconds, self._aggregate, where, params)
+
+    def _terms(self, connection, column: str, where: str, params: List[Any], size: int) -> Dict[str, Any]:
+        rows = connection.execute(
+            f"SELECT {column}, COUNT(*) AS doc_count FROM logs WHERE {where} AND {column} IS NOT NULL "
+            f"GROUP BY {column} ORDER BY doc_count DESC, {column} LIMIT ?",
+            params + [size]
+        ).fetchall()
+        return {'buckets': [{'key': key, 'doc_count': count} for key, count in rows]}
+
+    def _aggregate(self, where: str, params: List[Any]) -> Tuple[int, Dict[str, Any]]:
+        connection = self._connection()
+        # Read everything from one snapshot, as a single Elasticsearch search would
+        connection.execute('BEGIN')
+        try:
+            total, ok, redirect, client_error, server_error = connection.execute(
+                f"SELECT COUNT(*), "
+                f"COALESCE(SUM(status >= 200 AND status < 300), 0), COALESCE(SUM(status >= 300 AND status < 400), 0), "
+                f"COALESCE(SUM(status >= 400 AND status < 500), 0), COALESCE(SUM(status >= 500 AND status < 600), 0) "
+                f"FROM logs WHERE {where}",
+                params
+            ).fetchone()
+            if not total:
+                return 0, parse_aggregations({})
+            ips, requests = connection.execute(
+                f"SELECT COUNT(DISTINCT remote_addr), COUNT(remote_addr) FROM logs WHERE {where}", params
+            ).fetchone()
+            request_counts = self._terms(connection, 'remote_addr', where, params, self.max_terms)
+            request_counts['sum_other_doc_count'] = requests - sum(bucket['doc_count'] for bucket in request_counts['buckets'])
+            aggregations = {
+                'status_counts': {'buckets': [
+                    {'key': '2xx', 'doc_count': ok},
+                    {'key': '3xx', 'doc_count': redirect},
+                    {'key': '4xx', 'doc_count': client_error},
+                    {'key': '5xx', 'doc_count': server_error},
+                ]},
+                'method_counts': self._terms(connection, 'method', where, params, 100),
+                'request_counts': request_counts,
+                'distinct_ips': {'value': ips},
+                'path_counts': self._terms(connection, 'path', where, params, self.max_terms),
+                'user_agent_counts': self._terms(connection, 'http_user_agent', where, params, self.max_terms),
+                'requests_per_minute': self._requests_per_minute(connection, where, params),
+                'error_paths': self._error_paths(connection, where, params),
+            }
+        finally:
+            connection.execute('COMMIT')
+        return total, parse_aggregations(aggregations)
+
+    def _requests_per_minute(self, connection, where: str, params: List[Any]) -> Dict[str, Any]:
+        rows = connection.execute(
+            f"SELECT substr(datetime, 1, 16) AS minute, COUNT(*), "
+            f"SUM(instr(lower(http_user_agent), 'bot') > 0) "
+            f"FROM logs WHERE {where} AND datetime != '' GROUP BY minute ORDER BY minute",
+            params
+        ).fetchall()
+        return minute_buckets({minute: (count, bots) for minute, count, bots in rows})
+
+    def _error_paths(self, connection, where: str, params: List[Any]) -> Dict[str, Any]:
+        rows = connection.execute(
+            f"SELECT path, status, COUNT(*) FROM logs WHERE {where} AND status >= 400 AND status < 600 "
+            f"AND path IS NOT NULL GROUP BY path, status",
+            params
+        ).fetchall()
+        statuses: Dict[str, Dict[int, int]] = defaultdict(dict)
+        for path, status, count in rows:
+            statuses[path][status] = count
+        return error_path_buckets(statuses, self.error_threshold, self.max_terms)
+
+    async def search(self, query, size=DEFAULT_BATCH_SIZE, search_after=None, fields=None):
+        where, params = self._where(query)
+        return await self._read(_search_seconds, self._search, where, params, size, search_after, fields or ENTRY_FIELDS)
+
+    def _search(self, where: str, params: List[Any], size: int, search_after: Optional[List[Any]], fields: List[str]):
+        columns = [_column(field) for field in fields]
+        if search_after is not None:
+            # Keyset pagination on (datetime, rowid), served by the datetime index
+            where = f"{where} AND (datetime, rowid) > (?, ?)"
+            params = params + list(search_after)
+        rows = self._connection().execute(
+            f"SELECT {', '.join(columns)}, datetime, rowid FROM logs WHERE {where} ORDER BY datetime, rowid LIMIT ?",
+            params + [size]
+        ).fetchall()
+        documents = []
+        for row in rows:
+            document = dict(zip(fields, row))
+            if document.get('attack_tags') is not None:
+                document['attack_tags'] = orjson.loads(document['attack_tags'])
+            documents.append(document)
+        cursor = list(rows[-1][-2:]) if len(rows) == size else None
+        return documents, cursor
+
+    async def expire(self, retention_days: int = ELASTIC_RETENTION_DAYS) -> Dict[str, Any]:
+        expired = await self._write(self._expire, retention_days)
+        return {"expired": expired, "rollups_expired": 0}
+
+    def _expire(self, retention_days: int) -> List[str]:
+        if retention_days <= 0:
+            return []
+        cutoff = (datetime.now() - timedelta(days=retention_days)).date()
+        connection = self._connection()
+        expired = []
+        for (name,) in connection.execute("SELECT DISTINCT index_name FROM logs WHERE index_name GLOB ?", [f"{_glob(self.index)}-*"]):
+            try:
+                day = datetime.strptime(name[len(self.index) + 1:], INDEX_DATE_FORMAT).date()
+            except ValueError:
+                continue
+            if day < cutoff:
+                expired.append(name)
+        with connection:
+            for name in expired:
+                connection.execute("DELETE FROM logs WHERE index_name = ?", [name])
+        return expired
+
+    async def days(self) -> List[str]:
+        return await asyncio.to_thread(self._days)
+
+    def _days(self) -> List[str]:
+        days = []
+        rows = self._connection().execute("SELECT DISTINCT index_name FROM logs WHERE index_name GLOB ?", [f"{_glob(self.index)}-*"])
+        for (name,) in rows:
+            day = name[len(self.index) + 1:]
+            try:
+                datetime.strptime(day, INDEX_DATE_FORMAT)
+            except ValueError:
+                continue
+            days.append(day)
+        return sorted(days)
+
+    async def close(self) -> None:
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
@@ -0,0 +1,317 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from services.aggregations import MINUTE_FORMAT, build_aggregations, minute_buckets, parse_aggregations, parse_requests_per_minute
+from services.indices import ELASTIC_RETENTION_DAYS, ensure_index_template, expire_indices, index_days, target_indices
+from services.retrieval import DEFAULT_BATCH_SIZE, ENTRY_FIELDS, SORT, scan_hits
+from services.rollups import build_rollup_aggregations, edge_query, ensure_rollup_index, expire_rollups, parse_rollup_aggregations, rollup_index, rollup_query
+from services.metrics import ES_REQUEST_SECONDS
+import asyncio
+import os
+import time
+
+# Where logs are stored and queried: "elasticsearch" (default) or "sqlite", an embedded
+# engine for running and load-testing the API without a cluster
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "elasticsearch").lower()
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(os.path.dirname(__file__), '..', 'data', 'logs.sqlite3'))
+
+# How long a paginated search's point-in-time is kept open between pages
+PIT_KEEP_ALIVE = '1m'
+
+_aggregate_seconds = ES_REQUEST_SECONDS.labels('aggregate')
+_rollup_seconds = ES_REQUEST_SECONDS.labels('rollup')
+_time_series_seconds = ES_REQUEST_SECONDS.labels('time_series')
+_search_seconds = ES_REQUEST_SECONDS.labels('search')
+_count_seconds = ES_REQUEST_SECONDS.labels('count')
+
+
+class StorageBackend:
+    """
+    Where log entries are written and queried.
+
+    Queries are Elasticsearch query DSL, as sent by the dashboard; backends other than
+    Elasticsearch support the subset the dashboard uses and raise ValueError for the rest.
+    Writes use the bulk API format, so a backend can be handed straight to a BulkWriter.
+    """
+
+    # Whether ingest should also write per-minute rollup documents (see services/rollups.py)
+    uses_rollups = False
+
+    def for_index(self, index: str) -> "StorageBackend":
+        """The same backend over another base index, e.g. another site's logs"""
+        raise NotImplementedError
+
+    async def setup(self) -> None:
+        """Create whatever the backend needs before the first write"""
+
+    async def bulk(self, operations: List[Any], **kwargs) -> Dict[str, Any]:
+        """
+        Write a batch of documents
+
+        Args:
+            operations: Alternating bulk actions and documents, as dicts or serialized JSON
+
+        Returns:
+            Dict[str, Any]: A bulk API response with one item per action
+        """
+        raise NotImplementedError
+
+    async def count(self, query: Dict[str, Any]) -> int:
+        """Number of logs matching a query, or an upper bound where counting exactly is costly"""
+        raise NotImplementedError
+
+    async def aggregate(self, query: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Count-based checks over every log matching a query
+
+        Returns:
+            Tuple of (total matches, aggregates in the parse_aggregations shape)
+        """
+        raise NotImplementedError
+
+    async def search(
+        self,
+        query: Dict[str, Any],
+        size: int = DEFAULT_BATCH_SIZE,
+        search_after: Optional[Any] = None,
+        fields: Optional[List[str]] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[Any]]:
+        """
+        One page of matching logs in time order
+
+        Args:
+            query: Elasticsearch query DSL
+            size: Maximum number of logs to return
+            search_after: Opaque cursor returned with the previous page
+            fields: Fields to return (default: ENTRY_FIELDS)
+
+        Returns:
+            Tuple of (documents, cursor for the next page or None after the last page)
+        """
+        raise NotImplementedError
+
+    async def scan(
+        self,
+        query: Dict[str, Any],
+        fields: Optional[List[str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Page through every matching log in time order"""
+        cursor = None
+        while True:
+            documents, cursor = await self.search(query, batch_size, cursor, fields)
+            if documents:
+                yield documents
+            if cursor is None:
+                return
+
+    async def expire(self, retention_days: int = ELASTIC_RETENTION_DAYS) -> Dict[str, Any]:
+        """
+        Delete logs older than the retention period
+
+        Returns:
+            Dict[str, Any]: expired (names of the deleted daily partitions) and rollups_expired
+        """
+        raise NotImplementedError
+
+    # Identifies this backend and base index in the dedup record (see services/dedup.py);
+    # None for backends ingest doesn't write to, or whose data doesn't outlive the process
+    dedup_scope: Optional[str] = None
+
+    async def days(self) -> List[str]:
+        """Days (in INDEX_DATE_FORMAT) that have a daily partition"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Release connections and files"""
+
+
+async def _timed(histogram, request):
+    start = time.perf_counter()
+    try:
+        return await request
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+class ElasticStorage(StorageBackend):
+    """Logs in daily Elasticsearch indices, with per-minute rollups in a side index"""
+
+    uses_rollups = True
+
+    def __init__(self, index: str, client=None):
+        self.index = index
+        self._client = client
+
+    @property
+    def client(self):
+        # Built on first use, so importing this module doesn't import elasticsearch
+        if self._client is None:
+            from services.elastic import get_aes
+            self._client = get_aes()
+        return self._client
+
+    def for_index(self, index: str) -> "ElasticStorage":
+        # Shares the client, and so its connection pool
+        return ElasticStorage(index, self._client)
+
+    @property
+    def dedup_scope(self) -> str:
+        return f"elasticsearch:{os.getenv('ELASTIC_URL', '')}/{self.index}"
+
+    async def setup(self) -> None:
+        await ensure_index_template(self.client, self.index)
+        await ensure_rollup_index(self.client, self.index)
+
+    async def bulk(self, operations: List[Any], **kwargs) -> Dict[str, Any]:
+        return await self.client.bulk(operations=operations, **kwargs)
+
+    async def count(self, query: Dict[str, Any]) -> int:
+        response = await _timed(_count_seconds, self.client.count(
+            index=target_indices(self.index, query),
+            query=query,
+            ignore_unavailable=True,
+            allow_no_indices=True
+        ))
+        return response.get('count', 0)
+
+    async def aggregate(self, query: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        # Only the daily indices overlapping the query's time range are searched
+        indices = target_indices(self.index, query)
+
+        # Queries that only filter by time read the per-minute series from the rollup index for
+        # the whole minutes in their range, and from the logs in the minutes at its edges
+        rollups = rollup_query(query)
+        edges = edge_query(query) if rollups is not None else None
+
+        # Counts and time series are aggregated by Elasticsearch over the full match set
+        searches = [_timed(_aggregate_seconds, self.client.search(
+            index=indices,
+            ignore_unavailable=True,
+            allow_no_indices=True,
+            query=query,
+            size=0,
+            aggs=build_aggregations(time_series=rollups is None),
+            track_total_hits=True
+        ))]
+        if rollups is not None:
+            searches.append(_timed(_rollup_seconds, self.client.search(
+                index=rollup_index(self.index),
+                ignore_unavailable=True,
+                allow_no_indices=True,
+                query=rollups,
+                size=0,
+                aggs=build_rollup_aggregations(MINUTE_FORMAT)
+            )))
+        if edges is not None:
+            searches.append(_timed(_time_series_seconds, self.client.search(
+                index=indices,
+                ignore_unavailable=True,
+                allow_no_indices=True,
+                query=edges,
+                size=0,
+                aggs=self._time_series_aggregations(min_doc_count=1),
+                track_total_hits=True
+            )))
+        log_search, *rest = await asyncio.gather(*searches)
+        total = log_search.get("hits", {}).get("total", {}).get("value", 0)
+        aggregates = parse_aggregations(log_search.get("aggregations", {}))
+        if total and rollups is not None:
+            rollup_search, *edge_search = rest
+            rollup_total, _, bot_vs_human_traffic = parse_rollup_aggregations(rollup_search.get("aggregations", {}))
+            edge_total = 0
+            if edge_search:
+                edge_total = edge_search[0].get("hits", {}).get("total", {}).get("value", 0)
+                _, edge_traffic = parse_requests_per_minute(edge_search[0].get("aggregations", {}).get("requests_per_minute", {}))
+                bot_vs_human_traffic = bot_vs_human_traffic + edge_traffic
+            if rollup_total + edge_total == total:
+                # Minutes of both series share the key_as_string format of the date histogram
+                minutes: Dict[str, Tuple[int, int]] = {}
+                for minute, bots, humans in bot_vs_human_traffic:
+                    count, bot_count = minutes.get(minute[:16], (0, 0))
+                    minutes[minute[:16]] = (count + bots + humans, bot_count + bots)
+                requests_per_minute, bot_vs_human_traffic = parse_requests_per_minute(minute_buckets(minutes))
+            else:
+                # Rollups don't cover the matching logs (data indexed before rollups existed),
+                # so aggregate the raw documents instead
+                time_series = await _timed(_time_series_seconds, self.client.search(
+                    index=indices,
+                    ignore_unavailable=True,
+                    allow_no_indices=True,
+                    query=query,
+                    size=0,
+                    aggs=self._time_series_aggregations()
+                ))
+                requests_per_minute, bot_vs_human_traffic = parse_requests_per_minute(
+                    time_series.get("aggregations", {}).get("requests_per_minute", {})
+                )
+            aggregates["requests_per_minute"] = requests_per_minute
+            aggregates["bot_vs_human_traffic"] = bot_vs_human_traffic
+        return total, aggregates
+
+    @staticmethod
+    def _time_series_aggregations(min_doc_count: int = 0) -> Dict[str, Any]:
+        """The per-minute histogram of the raw logs alone"""
+        histogram = build_aggregations()["requests_per_minute"]
+        histogram["date_histogram"]["min_doc_count"] = min_doc_count
+        return {"requests_per_minute": histogram}
+
+    async def search(self, query, size=DEFAULT_BATCH_SIZE, search_after=None, fields=None):
+        # The cursor carries a point-in-time so _shard_doc can break ties between pages;
+        # it is closed after the last page, or expires if the caller stops early
+        if search_after is None:
+            pit_id = (await self.client.open_point_in_time(index=target_indices(self.index, query), keep_alive=PIT_KEEP_ALIVE, ignore_unavailable=True))['id']
+            kwargs = {}
+        else:
+            pit_id, after = search_after
+            kwargs = {'search_after': after}
+        page = await _timed(_search_seconds, self.client.search(
+            query=query,
+            size=size,
+            pit={'id': pit_id, 'keep_alive': PIT_KEEP_ALIVE},
+            sort=SORT,
+            source=fields or ENTRY_FIELDS,
+            track_total_hits=False,
+            **kwargs
+        ))
+        hits = page.get('hits', {}).get('hits', [])
+        if len(hits) < size:
+            await self.client.close_point_in_time(id=pit_id)
+            return [hit['_source'] for hit in hits], None
+        return [hit['_source'] for hit in hits], [page.get('pit_id', pit_id), hits[-1]['sort']]
+
+    async def scan(self, query, fields=None, batch_size=DEFAULT_BATCH_SIZE):
+        # A point-in-time keeps the pages consistent while ingest is writing
+        async for batch in scan_hits(self.client, target_indices(self.index, query), query, fields, batch_size):
+            yield batch
+
+    async def expire(self, retention_days: int = ELASTIC_RETENTION_DAYS) -> Dict[str, Any]:
+        expired = await expire_indices(self.client, self.index, retention_days)
+        rollups_expired = await expire_rollups(self.client, self.index, retention_days)
+        return {"expired": expired, "rollups_expired": rollups_expired}
+
+    async def days(self) -> List[str]:
+        return await index_days(self.client, self.index)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+
+
+def create_storage(backend: str = STORAGE_BACKEND, index: Optional[str] = None) -> StorageBackend:
+    """
+    Build the configured storage backend
+
+    Args:
+        backend: "elasticsearch" or "sqlite"
+        index: Base index name (default: ELASTIC_INDEX)
+    """
+    from services.elastic import es_index
+    if backend == 'sqlite':
+        from services.sqlite_storage import SQLiteStorage
+        return SQLiteStorage(SQLITE_PATH, index or es_index)
+    if backend in ('elasticsearch', 'elastic'):
+        return ElasticStorage(index or es_index)
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}")
+
+
+storage = create_storage()
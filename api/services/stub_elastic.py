@@ -0,0 +1,602 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+from elasticsearch import ApiError, BadRequestError, NotFoundError
+from services.indices import INDEX_MAPPINGS
+from fnmatch import fnmatchcase
+from functools import cmp_to_key
+import asyncio
+import calendar
+import orjson
+import os
+import random
+import re
+import uuid
+
+# Fraction of bulk items (and whole requests) the stub rejects with 429, to exercise retries
+ELASTIC_STUB_REJECT_RATE = float(os.getenv("ELASTIC_STUB_REJECT_RATE", "0"))
+ELASTIC_STUB_REQUEST_REJECT_RATE = float(os.getenv("ELASTIC_STUB_REQUEST_REJECT_RATE", "0"))
+
+# Bulk requests the stub handles at once before rejecting further ones, like a full write queue
+ELASTIC_STUB_MAX_CONCURRENT_BULKS = int(os.getenv("ELASTIC_STUB_MAX_CONCURRENT_BULKS", "0"))
+
+
+def _meta(status: int) -> ApiResponseMeta:
+    return ApiResponseMeta(
+        status=status,
+        http_version="1.1",
+        headers=HttpHeaders(),
+        duration=0.0,
+        node=NodeConfig("http", "localhost", 9200)
+    )
+
+
+def _bad_request(reason: str) -> BadRequestError:
+    return BadRequestError("parsing_exception", _meta(400), {"error": {"type": "parsing_exception", "reason": reason}})
+
+
+def _field_value(source: Dict[str, Any], field: str) -> Any:
+    # Sub-fields such as http_user_agent.text index the same value
+    value = source.get(field)
+    if value is None and '.' in field:
+        value = source.get(field.split('.', 1)[0])
+    return value
+
+
+def _as_datetime(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    return None
+
+
+# Date math operations: +1h, -30m, and rounding such as /d
+_DATE_MATH_OPERATION = re.compile(r'([+-])(\d+)([yMwdhHms])|/([yMwdhHms])')
+_DATE_MATH_UNITS = {'w': timedelta(weeks=1), 'd': timedelta(days=1), 'h': timedelta(hours=1), 'H': timedelta(hours=1), 'm': timedelta(minutes=1), 's': timedelta(seconds=1)}
+
+# Operators that round up, to the last millisecond of the unit, rather than down
+_ROUND_UP = ('gt', 'lte', 'to')
+
+
+def _add_months(when: datetime, months: int) -> datetime:
+    month = when.month - 1 + months
+    year, month = when.year + month // 12, month % 12 + 1
+    return when.replace(year=year, month=month, day=min(when.day, calendar.monthrange(year, month)[1]))
+
+
+def _round(when: datetime, unit: str, up: bool) -> datetime:
+    if unit in ('y', 'M'):
+        start = when.replace(month=1 if unit == 'y' else when.month, day=1, hour=0, minute=0, second=0, microsecond=0)
+        end = _add_months(start, 12 if unit == 'y' else 1)
+    else:
+        step = _DATE_MATH_UNITS[unit]
+        epoch = datetime(1970, 1, 5) if unit == 'w' else datetime(1970, 1, 1)
+        start = epoch + (when - epoch) // step * step
+        end = start + step
+    return end - timedelta(milliseconds=1) if up else start
+
+
+def _date_math(bound: Any, operator: str) -> Any:
+    """Resolve "now-1h/m" and "2024-01-01||+1d" style bounds; other bounds are returned unchanged"""
+    if not isinstance(bound, str):
+        return bound
+    if bound.startswith('now'):
+        when, expression = datetime.now(timezone.utc).replace(tzinfo=None), bound[3:]
+    elif '||' in bound:
+        anchor, expression = bound.split('||', 1)
+        when = _as_datetime(anchor)
+        if when is None:
+            raise _bad_request(f"failed to parse date field [{anchor}]")
+    else:
+        return bound
+    position = 0
+    for match in _DATE_MATH_OPERATION.finditer(expression):
+        if match.start() != position:
+            break
+        position = match.end()
+        sign, amount, unit, rounding = match.groups()
+        if rounding:
+            when = _round(when, rounding, operator in _ROUND_UP)
+        elif unit in ('y', 'M'):
+            when = _add_months(when, (1 if sign == '+' else -1) * int(amount) * (12 if unit == 'y' else 1))
+        else:
+            when += (1 if sign == '+' else -1) * int(amount) * _DATE_MATH_UNITS[unit]
+    if position != len(expression):
+        raise _bad_request(f"failed to parse date math [{bound}]")
+    return when
+
+
+def _comparable(value: Any, bound: Any) -> Tuple[Any, Any]:
+    """Bring a document value and a query bound to the same type: numbers, dates or strings"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return value, float(bound)
+        except (TypeError, ValueError):
+            return None, None
+    value_time, bound_time = _as_datetime(value), _as_datetime(bound)
+    if value_time is not None and bound_time is not None:
+        return value_time, bound_time
+    return str(value), str(bound)
+
+
+def _values(source: Dict[str, Any], field: str) -> List[Any]:
+    value = _field_value(source, field)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _in_range(value: Any, bounds: Dict[str, Any]) -> bool:
+    checks = (('gte', lambda v, b: v >= b), ('gt', lambda v, b: v > b), ('lte', lambda v, b: v <= b), ('lt', lambda v, b: v < b),
+              ('from', lambda v, b: v >= b), ('to', lambda v, b: v <= b))
+    for key, check in checks:
+        bound = bounds.get(key)
+        if bound is None:
+            continue
+        left, right = _comparable(value, _date_math(bound, key))
+        if left is None or not check(left, right):
+            return False
+    return True
+
+
+def _single(clause: Any) -> Tuple[str, Any]:
+    if not isinstance(clause, dict) or len(clause) != 1:
+        raise _bad_request(f"expected a single-field clause, got {clause!r}")
+    return next(iter(clause.items()))
+
+
+def _clauses(value: Any) -> List[Dict[str, Any]]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _matches(query: Optional[Dict[str, Any]], source: Dict[str, Any]) -> bool:
+    """
+    Evaluate the subset of the query DSL the app sends: match_all, term(s), range,
+    wildcard, prefix, exists, match (as a case-insensitive substring) and bool
+    """
+    if not query:
+        return True
+    kind, body = _single(query)
+    if kind == 'match_all':
+        return True
+    if kind == 'match_none':
+        return False
+    if kind == 'bool':
+        must = _clauses(body.get('must')) + _clauses(body.get('filter'))
+        if not all(_matches(clause, source) for clause in must):
+            return False
+        if any(_matches(clause, source) for clause in _clauses(body.get('must_not'))):
+            return False
+        should = _clauses(body.get('should'))
+        if should:
+            required = int(body.get('minimum_should_match', 0 if must else 1))
+            if sum(1 for clause in should if _matches(clause, source)) < required:
+                return False
+        return True
+    if kind == 'exists':
+        return bool(_values(source, body['field']))
+
+    field, condition = _single(body)
+    values = _values(source, field)
+    if kind == 'term':
+        expected = condition.get('value') if isinstance(condition, dict) else condition
+        return any(value == expected or str(value) == str(expected) for value in values)
+    if kind == 'terms':
+        expected = {str(item) for item in condition}
+        return any(str(value) in expected for value in values)
+    if kind == 'range':
+        return any(_in_range(value, condition) for value in values)
+    if kind in ('wildcard', 'prefix'):
+        pattern = condition.get('value') if isinstance(condition, dict) else condition
+        insensitive = isinstance(condition, dict) and condition.get('case_insensitive', False)
+        # Only * and ? are wildcards; fnmatch's [ character classes are matched literally
+        pattern = str(pattern).replace('[', '[[]')
+        if kind == 'prefix':
+            pattern = f"{pattern}*"
+        if insensitive:
+            pattern = pattern.lower()
+        return any(fnmatchcase(str(value).lower() if insensitive else str(value), pattern) for value in values)
+    if kind in ('match', 'match_phrase'):
+        text = condition.get('query') if isinstance(condition, dict) else condition
+        return any(str(text).lower() in str(value).lower() for value in values)
+    raise _bad_request(f"unsupported query [{kind}] in the stub")
+
+
+# Java date format tokens used by the app, translated for strftime
+_DATE_FORMAT_TOKENS = (("yyyy", "%Y"), ("MM", "%m"), ("dd", "%d"), ("HH", "%H"), ("mm", "%M"), ("ss", "%S"), ("'T'", "T"))
+
+_INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def _strftime_format(java_format: Optional[str]) -> str:
+    if not java_format:
+        return '%Y-%m-%dT%H:%M:%S.000Z'
+    for token, replacement in _DATE_FORMAT_TOKENS:
+        java_format = java_format.replace(token, replacement)
+    return java_format
+
+
+def _epoch_millis(when: datetime) -> int:
+    return int(when.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _aggregate(aggs: Dict[str, Any], sources: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Run bucket and metric aggregations over the matching documents"""
+    results = {}
+    for name, spec in aggs.items():
+        sub_aggs = spec.get('aggs') or spec.get('aggregations') or {}
+        kinds = [key for key in spec if key not in ('aggs', 'aggregations', 'meta')]
+        if len(kinds) != 1:
+            raise _bad_request(f"aggregation [{name}] must have exactly one type")
+        kind = kinds[0]
+        body = spec[kind]
+        results[name] = _AGGREGATIONS.get(kind, _unsupported_aggregation(kind))(body, sources, sub_aggs)
+    return results
+
+
+def _unsupported_aggregation(kind: str):
+    def fail(body, sources, sub_aggs):
+        raise _bad_request(f"unsupported aggregation [{kind}] in the stub")
+    return fail
+
+
+def _bucket(sources: List[Dict[str, Any]], sub_aggs: Dict[str, Any], **fields) -> Dict[str, Any]:
+    return {**fields, 'doc_count': len(sources), **_aggregate(sub_aggs, sources)}
+
+
+def _terms_aggregation(body, sources, sub_aggs):
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for source in sources:
+        for value in set(_values(source, body['field'])):
+            groups.setdefault(value, []).append(source)
+    min_doc_count = body.get('min_doc_count', 1)
+    ordered = sorted(groups.items(), key=lambda item: (-len(item[1]), str(item[0])))
+    kept = [(key, docs) for key, docs in ordered if len(docs) >= min_doc_count][:body.get('size', 10)]
+    return {
+        'doc_count_error_upper_bound': 0,
+        'sum_other_doc_count': sum(len(docs) for _, docs in ordered) - sum(len(docs) for _, docs in kept),
+        'buckets': [_bucket(docs, sub_aggs, key=key) for key, docs in kept],
+    }
+
+
+def _range_aggregation(body, sources, sub_aggs):
+    buckets = []
+    for spec in body['ranges']:
+        bounds = {}
+        if 'from' in spec:
+            bounds['gte'] = spec['from']
+        if 'to' in spec:
+            bounds['lt'] = spec['to']
+        docs = [source for source in sources if any(_in_range(value, bounds) for value in _values(source, body['field']))]
+        key = spec.get('key') or f"{spec.get('from', '*')}-{spec.get('to', '*')}"
+        buckets.append(_bucket(docs, sub_aggs, key=key, **{bound: spec[bound] for bound in ('from', 'to') if bound in spec}))
+    return {'buckets': buckets}
+
+
+def _date_histogram_aggregation(body, sources, sub_aggs):
+    interval = body.get('fixed_interval') or body.get('calendar_interval') or '1m'
+    if interval in ('minute', 'hour', 'day'):
+        interval = f"1{interval[0]}"
+    seconds = int(interval[:-1]) * _INTERVAL_UNITS[interval[-1]]
+    width = timedelta(seconds=seconds)
+    epoch = datetime(1970, 1, 1)
+    groups: Dict[datetime, List[Dict[str, Any]]] = {}
+    for source in sources:
+        for value in _values(source, body['field']):
+            when = _as_datetime(value)
+            if when is not None:
+                groups.setdefault(epoch + (when - epoch) // width * width, []).append(source)
+    if not groups:
+        return {'buckets': []}
+    keys = sorted(groups)
+    if body.get('min_doc_count', 1) == 0:
+        filled = []
+        key = keys[0]
+        while key <= keys[-1]:
+            filled.append(key)
+            key += width
+        keys = filled
+    date_format = _strftime_format(body.get('format'))
+    min_doc_count = body.get('min_doc_count', 1)
+    return {'buckets': [
+        _bucket(groups.get(key, []), sub_aggs, key_as_string=key.strftime(date_format), key=_epoch_millis(key))
+        for key in keys if len(groups.get(key, [])) >= min_doc_count
+    ]}
+
+
+def _filters_aggregation(body, sources, sub_aggs):
+    filters = body['filters']
+    buckets = {}
+    matched = set()
+    for key, query in filters.items():
+        docs = []
+        for i, source in enumerate(sources):
+            if _matches(query, source):
+                docs.append(source)
+                matched.add(i)
+        buckets[key] = _bucket(docs, sub_aggs)
+    other = body.get('other_bucket_key') or ('_other_' if body.get('other_bucket') else None)
+    if other:
+        buckets[other] = _bucket([source for i, source in enumerate(sources) if i not in matched], sub_aggs)
+    return {'buckets': buckets}
+
+
+def _filter_aggregation(body, sources, sub_aggs):
+    return _bucket([source for source in sources if _matches(body, source)], sub_aggs)
+
+
+def _numbers(body, sources) -> List[float]:
+    return [value for source in sources for value in _values(source, body['field']) if isinstance(value, (int, float))]
+
+
+def _avg_aggregation(body, sources, sub_aggs):
+    numbers = _numbers(body, sources)
+    return {'value': sum(numbers) / len(numbers) if numbers else None}
+
+
+_AGGREGATIONS = {
+    'terms': _terms_aggregation,
+    'range': _range_aggregation,
+    'date_histogram': _date_histogram_aggregation,
+    'filters': _filters_aggregation,
+    'filter': _filter_aggregation,
+    'sum': lambda body, sources, sub_aggs: {'value': float(sum(_numbers(body, sources)))},
+    'min': lambda body, sources, sub_aggs: {'value': min(_numbers(body, sources), default=None)},
+    'max': lambda body, sources, sub_aggs: {'value': max(_numbers(body, sources), default=None)},
+    'avg': _avg_aggregation,
+    'value_count': lambda body, sources, sub_aggs: {'value': sum(len(_values(source, body['field'])) for source in sources)},
+    'cardinality': lambda body, sources, sub_aggs: {'value': len({str(value) for source in sources for value in _values(source, body['field'])})},
+}
+
+
+_DATE_FIELDS = {field for field, mapping in INDEX_MAPPINGS['properties'].items() if mapping['type'] == 'date'}
+
+
+def _sort_value(source: Dict[str, Any], field: str, position: Tuple[int, int]) -> Any:
+    if field == '_shard_doc' or field == '_doc':
+        return position[0] * 1_000_000_000 + position[1]
+    value = _field_value(source, field)
+    when = _as_datetime(value) if isinstance(value, str) else None
+    if when is None and isinstance(value, str) and field in _DATE_FIELDS:
+        # Malformed dates are ignored by the mapping, so they sort as missing
+        return None
+    return _epoch_millis(when) if when is not None else value
+
+
+def _compare(left: List[Any], right: List[Any], orders: List[str]) -> int:
+    for a, b, order in zip(left, right, orders):
+        if a == b:
+            continue
+        # Missing values sort last in either direction
+        if a is None or b is None:
+            return 1 if a is None else -1
+        result = -1 if a < b else 1
+        return result if order == 'asc' else -result
+    return 0
+
+
+def _parse_sort(sort: Any) -> List[Tuple[str, str]]:
+    fields = []
+    for item in _clauses(sort):
+        if isinstance(item, str):
+            fields.append((item, 'asc'))
+            continue
+        field, order = _single(item)
+        fields.append((field, order.get('order', 'asc') if isinstance(order, dict) else order))
+    return fields
+
+
+class _StubIndices:
+    """The subset of the indices API the app uses"""
+
+    def __init__(self, client: "StubAsyncElasticsearch"):
+        self._client = client
+        self.templates: Dict[str, Dict[str, Any]] = {}
+
+    async def put_index_template(self, name: str, **body) -> Dict[str, Any]:
+        self.templates[name] = body
+        return {"acknowledged": True}
+
+    async def get(self, index: str, **kwargs) -> Dict[str, Any]:
+        prefix = index.rstrip('*')
+        names = [name for name in self._client.indices_docs if name.startswith(prefix)] if index.endswith('*') else \
+            [name for name in index.split(',') if name in self._client.indices_docs]
+        if not names and not index.endswith('*'):
+            raise NotFoundError("index_not_found_exception", _meta(404), {"error": {"type": "index_not_found_exception"}})
+        return {name: {} for name in names}
+
+    async def delete(self, index: str, **kwargs) -> Dict[str, Any]:
+        for name in index.split(','):
+            self._client.indices_docs.pop(name, None)
+        return {"acknowledged": True}
+
+
+class StubAsyncElasticsearch:
+    """
+    In-memory stand-in for AsyncElasticsearch's document APIs, used for tests, benchmarks
+    and offline development. Supports bulk indexing (with optional injected rejections),
+    get, count, delete_by_query, search with the subset of the query DSL and aggregations
+    the app sends, point-in-time paging, and enough of the indices API to manage
+    templates and daily indices. Searches scan every document, so it is for modest
+    volumes only.
+    """
+
+    def __init__(
+        self,
+        reject_rate: float = ELASTIC_STUB_REJECT_RATE,
+        request_reject_rate: float = ELASTIC_STUB_REQUEST_REJECT_RATE,
+        max_concurrent_bulks: int = ELASTIC_STUB_MAX_CONCURRENT_BULKS,
+        latency: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.indices_docs: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.reject_rate = reject_rate
+        self.request_reject_rate = request_reject_rate
+        self.max_concurrent_bulks = max_concurrent_bulks
+        self.latency = latency
+        self.bulk_requests = 0
+        self.active_bulks = 0
+        self.max_active_bulks = 0
+        self._random = random.Random(seed)
+        self._pits: Dict[str, str] = {}
+        self.indices = _StubIndices(self)
+
+    @staticmethod
+    def _decode(operation: Any) -> Dict[str, Any]:
+        if isinstance(operation, (bytes, str)):
+            return orjson.loads(operation)
+        return operation
+
+    async def bulk(self, operations: List[Any], **kwargs) -> Dict[str, Any]:
+        self.bulk_requests += 1
+        if self.max_concurrent_bulks and self.active_bulks >= self.max_concurrent_bulks:
+            raise ApiError("es_rejected_execution_exception", _meta(429), {"error": {"type": "es_rejected_execution_exception"}})
+        if self._random.random() < self.request_reject_rate:
+            raise ApiError("es_rejected_execution_exception", _meta(429), {"error": {"type": "es_rejected_execution_exception"}})
+
+        self.active_bulks += 1
+        self.max_active_bulks = max(self.max_active_bulks, self.active_bulks)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            items = []
+            errors = False
+            for i in range(0, len(operations), 2):
+                action = self._decode(operations[i])
+                op_type, meta = next(iter(action.items()))
+                if self._random.random() < self.reject_rate:
+                    errors = True
+                    items.append({op_type: {
+                        "_index": meta.get("_index"),
+                        "_id": meta.get("_id"),
+                        "status": 429,
+                        "error": {"type": "es_rejected_execution_exception", "reason": "rejected by stub"}
+                    }})
+                    continue
+                source = self._decode(operations[i + 1])
+                docs = self.indices_docs.setdefault(meta.get("_index"), {})
+                doc_id = meta.get("_id") or str(len(docs))
+                if op_type == "create" and doc_id in docs:
+                    errors = True
+                    items.append({op_type: {
+                        "_index": meta.get("_index"),
+                        "_id": doc_id,
+                        "status": 409,
+                        "error": {"type": "version_conflict_engine_exception", "reason": "document already exists"}
+                    }})
+                    continue
+                result = "updated" if doc_id in docs else "created"
+                docs[doc_id] = source
+                items.append({op_type: {"_index": meta.get("_index"), "_id": doc_id, "status": 201 if result == "created" else 200, "result": result}})
+            return {"took": 0, "errors": errors, "items": items}
+        finally:
+            self.active_bulks -= 1
+
+    async def get(self, index: str, id: str, **kwargs) -> Dict[str, Any]:
+        source = self.indices_docs.get(index, {}).get(id)
+        if source is None:
+            raise NotFoundError("not_found", _meta(404), {"found": False})
+        return {"_index": index, "_id": id, "found": True, "_source": source}
+
+    def _resolve(self, index: str, ignore_unavailable: bool = False) -> List[str]:
+        names = []
+        for name in index.split(','):
+            if '*' in name:
+                names.extend(sorted(existing for existing in self.indices_docs if fnmatchcase(existing, name)))
+            elif name in self.indices_docs:
+                names.append(name)
+            elif not ignore_unavailable:
+                raise NotFoundError("index_not_found_exception", _meta(404), {"error": {"type": "index_not_found_exception", "index": name}})
+        return list(dict.fromkeys(names))
+
+    def _documents(self, index: str, query: Optional[Dict[str, Any]], ignore_unavailable: bool = False) -> Iterable[Tuple[str, str, Tuple[int, int], Dict[str, Any]]]:
+        for index_position, name in enumerate(self._resolve(index, ignore_unavailable)):
+            for doc_position, (doc_id, source) in enumerate(self.indices_docs[name].items()):
+                if _matches(query, source):
+                    yield name, doc_id, (index_position, doc_position), source
+
+    async def search(
+        self,
+        index: Optional[str] = None,
+        query: Optional[Dict[str, Any]] = None,
+        size: int = 10,
+        aggs: Optional[Dict[str, Any]] = None,
+        aggregations: Optional[Dict[str, Any]] = None,
+        sort: Any = None,
+        search_after: Optional[List[Any]] = None,
+        source: Any = True,
+        pit: Optional[Dict[str, Any]] = None,
+        from_: int = 0,
+        ignore_unavailable: bool = False,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Search with the supported query DSL subset, aggregations, sorting and search_after paging"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if pit is not None:
+            if pit['id'] not in self._pits:
+                raise NotFoundError("search_context_missing_exception", _meta(404), {"error": {"type": "search_context_missing_exception"}})
+            index, ignore_unavailable = self._pits[pit['id']], True
+        matched = list(self._documents(index or '*', query, ignore_unavailable))
+
+        response: Dict[str, Any] = {
+            "took": 0,
+            "timed_out": False,
+            "hits": {"total": {"value": len(matched), "relation": "eq"}, "hits": []},
+        }
+        if pit is not None:
+            response["pit_id"] = pit['id']
+        if aggs or aggregations:
+            response["aggregations"] = _aggregate(aggs or aggregations, [doc[3] for doc in matched])
+
+        if size:
+            sort_fields = _parse_sort(sort)
+            orders = [order for _, order in sort_fields]
+            rows = [
+                ([_sort_value(source, field, position) for field, _ in sort_fields], name, doc_id, source)
+                for name, doc_id, position, source in matched
+            ]
+            if sort_fields:
+                rows.sort(key=cmp_to_key(lambda a, b: _compare(a[0], b[0], orders)))
+            if search_after is not None:
+                rows = [row for row in rows if _compare(row[0], search_after, orders) > 0]
+            for values, name, doc_id, doc in rows[from_:from_ + size]:
+                hit = {"_index": name, "_id": doc_id, "_score": None if sort_fields else 1.0}
+                if source is not False:
+                    hit["_source"] = {field: doc[field] for field in source if field in doc} if isinstance(source, list) else doc
+                if sort_fields:
+                    hit["sort"] = values
+                response["hits"]["hits"].append(hit)
+        return response
+
+    async def open_point_in_time(self, index: str, keep_alive: str, **kwargs) -> Dict[str, Any]:
+        # Point-in-times see later writes; the stub only needs stable paging while nothing is indexed
+        pit_id = uuid.uuid4().hex
+        self._pits[pit_id] = index
+        return {"id": pit_id}
+
+    async def close_point_in_time(self, id: str, **kwargs) -> Dict[str, Any]:
+        return {"succeeded": self._pits.pop(id, None) is not None, "num_freed": 1}
+
+    async def count(self, index: str, query: Optional[Dict[str, Any]] = None, ignore_unavailable: bool = False, **kwargs) -> Dict[str, Any]:
+        return {"count": sum(1 for _ in self._documents(index, query, ignore_unavailable))}
+
+    async def delete_by_query(self, index: str, query: Dict[str, Any], ignore_unavailable: bool = False, **kwargs) -> Dict[str, Any]:
+        matched = list(self._documents(index, query, ignore_unavailable))
+        for name, doc_id, _, _ in matched:
+            del self.indices_docs[name][doc_id]
+        return {"deleted": len(matched), "failures": []}
+
+    async def close(self) -> None:
+        pass
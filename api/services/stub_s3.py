@@ -0,0 +1,146 @@
+from typing import Any, Dict, List, Optional
+from collections import Counter
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+import hashlib
+import io
+import os
+import threading
+import time
+
+
+def _error(code: str, message: str, status: int) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status}}, code)
+
+
+class _Body(io.BytesIO):
+    """The StreamingBody subset the app uses"""
+
+    def iter_chunks(self, chunk_size: int = 1024 * 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class StubS3Client:
+    """
+    Local stand-in for the boto3 S3 client, used for tests and offline development.
+
+    Objects are kept in memory, or with root set, read from and written to files under
+    root/<bucket>/<key>, so a directory of logs can be ingested as if it were a bucket.
+    Supports the calls the app makes: list_objects_v2 (with pagination), head_object,
+    get_object (with Range and IfMatch), put_object and delete_object. Requests are counted by
+    operation and can be given a fixed latency to make concurrency visible.
+    """
+
+    def __init__(self, root: Optional[str] = None, latency: float = 0.0, max_keys: int = 1000):
+        self.root = root
+        self.latency = latency
+        self.max_keys = max_keys
+        self.buckets: Dict[str, Dict[str, bytes]] = {}
+        self.requests: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _request(self, operation: str) -> None:
+        with self._lock:
+            self.requests[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def _keys(self, bucket: str) -> List[str]:
+        if self.root is None:
+            return sorted(self.buckets.get(bucket, {}))
+        base = os.path.join(self.root, bucket)
+        keys = []
+        for directory, _, names in os.walk(base):
+            for name in names:
+                keys.append(os.path.relpath(os.path.join(directory, name), base).replace(os.sep, '/'))
+        return sorted(keys)
+
+    def _read(self, bucket: str, key: str) -> bytes:
+        if self.root is None:
+            try:
+                return self.buckets[bucket][key]
+            except KeyError:
+                raise _error('NoSuchKey', 'The specified key does not exist.', 404)
+        try:
+            with open(self._path(bucket, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise _error('NoSuchKey', 'The specified key does not exist.', 404)
+
+    def _size(self, bucket: str, key: str) -> int:
+        if self.root is None:
+            return len(self.buckets[bucket][key])
+        return os.path.getsize(self._path(bucket, key))
+
+    def _etag(self, bucket: str, key: str) -> str:
+        if self.root is None:
+            return f'"{hashlib.md5(self.buckets[bucket][key]).hexdigest()}"'
+        # Files can be large, so their ETag is derived from size and modification time
+        stat = os.stat(self._path(bucket, key))
+        return f'"{hashlib.md5(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()}"'
+
+    def put_object(self, Bucket: str, Key: str, Body: Any, **kwargs) -> Dict[str, Any]:
+        self._request('put_object')
+        data = Body.encode('utf-8') if isinstance(Body, str) else Body if isinstance(Body, bytes) else Body.read()
+        if self.root is None:
+            self.buckets.setdefault(Bucket, {})[Key] = data
+        else:
+            path = self._path(Bucket, Key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        return {'ETag': self._etag(Bucket, Key)}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        self._request('delete_object')
+        if self.root is None:
+            self.buckets.get(Bucket, {}).pop(Key, None)
+        else:
+            try:
+                os.remove(self._path(Bucket, Key))
+            except FileNotFoundError:
+                pass
+        return {}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        self._request('head_object')
+        if Key not in self._keys(Bucket):
+            raise _error('404', 'Not Found', 404)
+        return {'ContentLength': self._size(Bucket, Key), 'ETag': self._etag(Bucket, Key)}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', ContinuationToken: Optional[str] = None, MaxKeys: Optional[int] = None, **kwargs) -> Dict[str, Any]:
+        self._request('list_objects_v2')
+        limit = min(MaxKeys or self.max_keys, self.max_keys)
+        keys = [key for key in self._keys(Bucket) if key.startswith(Prefix) and (ContinuationToken is None or key > ContinuationToken)]
+        page = keys[:limit]
+        now = datetime.now(timezone.utc)
+        response = {
+            'KeyCount': len(page),
+            'IsTruncated': len(keys) > limit,
+            'Contents': [{'Key': key, 'Size': self._size(Bucket, key), 'ETag': self._etag(Bucket, key), 'LastModified': now} for key in page],
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, IfMatch: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self._request('get_object')
+        data = self._read(Bucket, Key)
+        etag = self._etag(Bucket, Key)
+        if IfMatch is not None and IfMatch != etag:
+            raise _error('PreconditionFailed', 'At least one of the pre-conditions you specified did not hold', 412)
+        if Range is not None:
+            first, _, last = Range.removeprefix('bytes=').partition('-')
+            first = int(first)
+            last = min(int(last) if last else len(data) - 1, len(data) - 1)
+            if first >= len(data):
+                raise _error('InvalidRange', 'The requested range is not satisfiable', 416)
+            data = data[first:last + 1]
+        return {'Body': _Body(data), 'ContentLength': len(data), 'ETag': etag}
@@ -0,0 +1,107 @@
+from typing import Any, Dict, List, Optional, Tuple
+from cachetools import TTLCache
+from services.gemini import generate_content_async
+from services.metrics import Counter, gauge_callback
+import asyncio
+import hashlib
+import json
+import os
+
+SUMMARY_PROMPT = "<instructions>The following are key insights from a group of Nginx logs. In the response, only provide a bulletpointed, formatted summary of the key insights. Only use one level of bullet points. Include at most 7 bullet points. Ensure they are informative. Only provide the bulletpoints, no other text.</instructions> <insights>Total number of logs: {total}. Key insights: {insights}</insights>"
+
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1024"))
+SUMMARY_CACHE_TTL_SECONDS = int(os.getenv("SUMMARY_CACHE_TTL_SECONDS", str(6 * 60 * 60)))
+
+# Failures are remembered briefly so pollers get an answer, then retried
+SUMMARY_FAILURE_TTL_SECONDS = 60
+
+_summaries: TTLCache = TTLCache(maxsize=SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL_SECONDS)
+_failures: TTLCache = TTLCache(maxsize=SUMMARY_CACHE_SIZE, ttl=SUMMARY_FAILURE_TTL_SECONDS)
+_pending: Dict[str, asyncio.Task] = {}
+
+SUMMARY_REQUESTS = Counter(
+    "danphobic_summary_requests_total",
+    "Summary lookups by result; coalesced requests joined a generation already running",
+    ["result"]
+)
+_summary_hits = SUMMARY_REQUESTS.labels('hit')
+_summary_misses = SUMMARY_REQUESTS.labels('miss')
+_summary_coalesced = SUMMARY_REQUESTS.labels('coalesced')
+gauge_callback("danphobic_summary_pending", "Summaries being generated", lambda: len(_pending))
+gauge_callback("danphobic_summary_cache_entries", "Summaries held in the cache", lambda: len(_summaries))
+
+
+def summary_key(total: int, insights: List[str]) -> str:
+    """Hash of everything the summary prompt depends on"""
+    payload = json.dumps({'total': total, 'insights': insights}, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+async def _generate(key: str, total: int, insights: List[str]) -> Optional[str]:
+    try:
+        summary = await generate_content_async(SUMMARY_PROMPT.format(total=total, insights=insights))
+        if summary is None:
+            _failures[key] = True
+        else:
+            _summaries[key] = summary
+        return summary
+    finally:
+        _pending.pop(key, None)
+
+
+def request_summary(total: int, insights: List[str]) -> Tuple[str, Optional[str]]:
+    """
+    Return the cached summary for a set of insights, starting background generation on a miss
+
+    Must be called from the event loop. Concurrent requests for the same insights share
+    one generation task.
+
+    Args:
+        total: Total number of logs the insights cover
+        insights: Insights produced by generate_insights
+
+    Returns:
+        Tuple[str, Optional[str]]: The summary key and the summary, or None if it is still being generated
+    """
+    key = summary_key(total, insights)
+    summary = _summaries.get(key)
+    if summary is not None:
+        _summary_hits.inc()
+        return key, summary
+    if key in _pending:
+        _summary_coalesced.inc()
+    else:
+        _summary_misses.inc()
+        _failures.pop(key, None)
+        _pending[key] = asyncio.create_task(_generate(key, total, insights))
+    return key, None
+
+
+def get_summary(key: str) -> Dict[str, Any]:
+    """
+    Look up the state of a summary
+
+    Returns:
+        Dict[str, Any]: The key, a status of ready, pending, failed or unknown, and the summary if ready
+    """
+    summary = _summaries.get(key)
+    if summary is not None:
+        status = 'ready'
+    elif key in _pending:
+        status = 'pending'
+    elif key in _failures:
+        status = 'failed'
+    else:
+        status = 'unknown'
+    return {'key': key, 'status': status, 'summary': summary}
+
+
+async def wait_for_summary(key: str, timeout: float) -> Dict[str, Any]:
+    """Wait up to timeout seconds for a pending summary and return its state"""
+    task = _pending.get(key)
+    if task is not None:
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            pass
+    return get_summary(key)
@@ -0,0 +1,33 @@
+"""
+Test configuration: the app's services read their settings from the environment when
+they are imported, so point them at stub clients and a scratch directory first.
+"""
+
+import os
+import sys
+import tempfile
+
+_data_dir = tempfile.mkdtemp(prefix='danphobic-tests-')
+
+for name, value in {
+    'STORAGE_BACKEND': 'sqlite',
+    'SQLITE_PATH': os.path.join(_data_dir, 'logs.sqlite3'),
+    'ELASTIC_URL': 'http://localhost:9200',
+    'ELASTIC_INDEX': 'logs',
+    'ELASTIC_STUB': '1',
+    'GEMINI_STUB': '1',
+    'S3_STUB': '1',
+    'INGEST_JOBS_DIR': os.path.join(_data_dir, 'jobs'),
+    'S3_INGEST_DIR': os.path.join(_data_dir, 's3_ingest'),
+    'ARCHIVE_DIR': os.path.join(_data_dir, 'archive'),
+    'DEDUP_DIR': os.path.join(_data_dir, 'dedup'),
+    'PROFILE_DIR': os.path.join(_data_dir, 'profiles'),
+}.items():
+    os.environ.setdefault(name, value)
+
+# Tests import the app's modules as main.py does, from the api directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The configured backend is built when services.storage is first imported, which in turn
+# imports its module, so load it first as main.py does
+import services.storage  # noqa: E402,F401
@@ -0,0 +1,168 @@
+import asyncio
+
+import orjson
+
+from services.bulk import INITIAL_BACKOFF_SECONDS, BulkWriter
+from services.stub_elastic import StubAsyncElasticsearch
+
+
+class FakeBulkClient:
+    """
+    Bulk endpoint that answers each item with the status reject() gives it, and records
+    how many requests were in flight and the writer's concurrency limit at each request
+    """
+
+    def __init__(self, reject=lambda doc_id, attempt, request: None):
+        self.reject = reject
+        self.writer = None
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.limits = []
+        self.attempts = {}
+        self.indexed = set()
+
+    async def bulk(self, operations):
+        self.requests += 1
+        request = self.requests
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        self.limits.append(self.writer.limit)
+        try:
+            # Let other requests start, so several are in flight at once
+            await asyncio.sleep(0)
+            items = []
+            for action in operations[::2]:
+                doc_id = orjson.loads(action)['index']['_id']
+                attempt = self.attempts[doc_id] = self.attempts.get(doc_id, 0) + 1
+                status = self.reject(doc_id, attempt, request)
+                if status is None:
+                    self.indexed.add(doc_id)
+                    items.append({'index': {'_id': doc_id, 'status': 201}})
+                else:
+                    items.append({'index': {'_id': doc_id, 'status': status, 'error': {'type': f"error_{status}", 'reason': 'fake'}}})
+            return {'errors': any(item['index']['status'] >= 300 for item in items), 'items': items}
+        finally:
+            self.active -= 1
+
+
+def _write(client, count, **kwargs):
+    """
+    Index count documents, one per request
+
+    Returns:
+        Tuple of (writer, (backoff, concurrency limit) at each backoff, on_progress values, on_failed values)
+    """
+    sleeps = []
+    progress = []
+    failed = []
+    writer = None
+
+    async def sleep(seconds):
+        sleeps.append((seconds, writer.limit))
+        await asyncio.sleep(0)
+
+    async def run():
+        nonlocal writer
+        writer = BulkWriter(
+            client,
+            max_batch_bytes=1,
+            sleep=sleep,
+            on_progress=progress.append,
+            on_failed=failed.append,
+            **kwargs
+        )
+        client.writer = writer
+        for i in range(count):
+            await writer.add({'index': {'_index': 'logs', '_id': str(i)}}, {'n': i})
+        await writer.close()
+
+    asyncio.run(run())
+    return writer, sleeps, progress, failed
+
+
+def test_retries_only_rejected_items():
+    # Every item of the first two requests is rejected once
+    client = FakeBulkClient(lambda doc_id, attempt, request: 429 if request <= 2 else None)
+    writer, sleeps, progress, failed = _write(client, 20, max_in_flight=4)
+
+    assert client.indexed == {str(i) for i in range(20)}
+    assert writer.stats.indexed == 20
+    assert writer.stats.failed == 0
+    assert writer.stats.retried == 2
+    assert sum(client.attempts.values()) == 22
+    assert failed == []
+    assert progress[-1] == writer.completed == 20
+
+
+def test_rejections_halve_concurrency_and_successes_restore_it():
+    client = FakeBulkClient(lambda doc_id, attempt, request: 429 if request == 1 else None)
+    writer, sleeps, _, _ = _write(client, 40, max_in_flight=4)
+
+    # The rejection halves the limit and starts the backoff ...
+    assert sleeps[0] == (INITIAL_BACKOFF_SECONDS, 2)
+    assert all(limit <= 4 for limit in client.limits)
+    assert client.max_active <= 4
+    # ... and successful requests grow it back one at a time
+    assert writer.limit == 4
+
+
+def test_repeated_rejections_back_off_exponentially():
+    client = FakeBulkClient(lambda doc_id, attempt, request: 429 if doc_id == '0' and attempt <= 3 else None)
+    writer, sleeps, _, _ = _write(client, 1, max_in_flight=4)
+
+    assert sleeps == [(INITIAL_BACKOFF_SECONDS, 2), (2 * INITIAL_BACKOFF_SECONDS, 1), (4 * INITIAL_BACKOFF_SECONDS, 1)]
+    assert writer.stats.indexed == 1
+
+
+def test_item_fails_after_max_retries():
+    client = FakeBulkClient(lambda doc_id, attempt, request: 429 if doc_id == '3' else None)
+    writer, sleeps, progress, failed = _write(client, 10, max_in_flight=2, max_retries=3)
+
+    assert client.attempts['3'] == 3
+    assert writer.stats.failed == 1
+    assert writer.stats.indexed == 9
+    assert writer.stats.errors == {'es_rejected_execution_exception': 1}
+    assert failed == [3]
+    # A failed item still reaches a final outcome, so checkpoints move past it
+    assert progress[-1] == 10
+
+
+def test_permanent_item_errors_are_not_retried():
+    client = FakeBulkClient(lambda doc_id, attempt, request: 400 if doc_id in ('1', '5') else None)
+    writer, sleeps, progress, failed = _write(client, 8, max_in_flight=4)
+
+    assert client.attempts['1'] == client.attempts['5'] == 1
+    assert writer.stats.failed == 2
+    assert writer.stats.retried == 0
+    assert writer.stats.errors == {'error_400': 2}
+    assert sorted(failed) == [1, 5]
+    assert sleeps == []
+    assert writer.limit == 4
+
+
+def test_rejected_requests_are_resent():
+    # The stub rejects whole requests with HTTP 429 while another is still running
+    client = StubAsyncElasticsearch(reject_rate=0.0, request_reject_rate=0.0, max_concurrent_bulks=1, latency=0.001)
+
+    sleeps = []
+
+    async def sleep(seconds):
+        # Back off for real, scaled down to keep the test fast
+        sleeps.append(seconds)
+        await asyncio.sleep(seconds / 100)
+
+    async def run():
+        writer = BulkWriter(client, max_batch_bytes=1, max_in_flight=4, sleep=sleep)
+        for i in range(30):
+            await writer.add({'index': {'_index': 'logs', '_id': str(i)}}, {'n': i})
+        return await writer.close()
+
+    stats = asyncio.run(run())
+
+    assert stats.rejected_requests > 0
+    assert stats.indexed == 30
+    assert stats.failed == 0
+    assert len(client.indices_docs['logs']) == 30
+    assert client.max_active_bulks == 1
+    assert sleeps
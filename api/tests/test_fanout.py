@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from model.log import LogRecord
+from services.analysis import build_analysis, collect_analysis
+from services.fanout import merge_aggregates, merge_rows, run_fleet_analysis
+from services.ingest import ingest_stream
+from services.sqlite_storage import SQLiteStorage
+
+SITES = {'a': 'logs-a', 'b': 'logs-b'}
+
+REQUESTS = [
+    ('GET', '/index.html', 200, 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'),
+    ('GET', '/products?id=1%27%20OR%201=1--', 500, 'sqlmap/1.7'),
+    ('GET', '/admin', 403, 'Mozilla/5.0 (X11; Linux x86_64)'),
+    ('POST', '/login', 401, 'curl/8.4.0'),
+    ('GET', '/.env', 404, 'Googlebot/2.1'),
+    ('GET', '/../../etc/passwd', 400, 'python-requests/2.31'),
+    ('GET', '/about', 301, 'Bingbot/2.0'),
+]
+
+
+def _site_lines(site_number):
+    """A day of logs for one site, with its own IPs; the sites' lines interleave in time"""
+    start = datetime(2024, 10, 10, 12, 0, 0)
+    lines = []
+    for i in range(240):
+        method, path, status, user_agent = REQUESTS[(i * 3 + site_number) % len(REQUESTS)]
+        timestamp = start + timedelta(seconds=i * 20 + site_number * 7)
+        ip = f"10.{site_number}.{i % 9}.{i % 4}"
+        lines.append(f'{ip} - - [{timestamp:%d/%b/%Y:%H:%M:%S} +0000] "{method} {path} HTTP/1.1" {status} 100 "-" "{user_agent}"')
+    # One IP per site bursts within a single minute
+    for i in range(40):
+        timestamp = start + timedelta(hours=1, seconds=i + site_number * 0.5)
+        lines.append(f'10.{site_number}.99.1 - - [{timestamp:%d/%b/%Y:%H:%M:%S} +0000] "GET /search?q={i} HTTP/1.1" 200 100 "-" "Mozilla/5.0"')
+    return '\n'.join(lines).encode()
+
+
+def _plain(value):
+    """Compare log entries by their fields"""
+    if isinstance(value, LogRecord):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+@pytest.fixture(scope='module')
+def whole(tmp_path_factory):
+    """The backend over both sites' indices: logs covers logs-a-* and logs-b-*"""
+    storage = SQLiteStorage(str(tmp_path_factory.mktemp('fanout') / 'logs.sqlite3'), 'logs')
+
+    async def load():
+        for number, index in enumerate(SITES.values(), start=1):
+            async def chunks(data=_site_lines(number)):
+                yield data
+            await ingest_stream(chunks(), storage.for_index(index), index)
+
+    asyncio.run(load())
+    return storage
+
+
+QUERIES = [
+    {'match_all': {}},
+    {'range': {'datetime': {'gte': '2024-10-10T12:30:00', 'lt': '2024-10-10T13:30:00'}}},
+    {'bool': {'must_not': [{'term': {'status': 200}}]}},
+]
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_merged_parts_match_single_site(whole, query):
+    async def run():
+        parts = [await collect_analysis(query, whole.for_index(index)) for index in SITES.values()]
+        return await collect_analysis(query, whole), parts
+
+    (total, aggregates, rows), parts = asyncio.run(run())
+
+    assert total == sum(part_total for part_total, _, _ in parts)
+    assert merge_aggregates([part_aggregates for _, part_aggregates, _ in parts]) == aggregates
+    assert _plain(merge_rows([part_rows for _, _, part_rows in parts])) == _plain(rows)
+
+
+def test_top_terms_are_cut_after_merging(whole):
+    async def run():
+        parts = [await collect_analysis({'match_all': {}}, whole.for_index(index)) for index in SITES.values()]
+        return await collect_analysis({'match_all': {}}, whole), parts
+
+    (_, aggregates, _), parts = asyncio.run(run())
+    merged = merge_aggregates([part_aggregates for _, part_aggregates, _ in parts], max_terms=3)
+
+    expected = sorted(aggregates['path_counts'].items(), key=lambda item: (-item[1], item[0]))[:3]
+    assert list(merged['path_counts'].items()) == expected
+    assert merged['request_count_stats'] == aggregates['request_count_stats']
+
+
+def test_fleet_analysis_matches_single_site(whole):
+    query = {'match_all': {}}
+
+    async def run():
+        fleet = await run_fleet_analysis(query, SITES, whole)
+        total, aggregates, rows = await collect_analysis(query, whole)
+        return fleet, await build_analysis(total, aggregates, rows)
+
+    fleet, single = asyncio.run(run())
+
+    assert fleet.pop('partial') is False
+    assert {site: status['status'] for site, status in fleet.pop('sites').items()} == {'a': 'ok', 'b': 'ok'}
+    assert _plain(fleet) == _plain(single)
+    # Insights follow the order detectors first saw each key, which the merge has to keep
+    assert fleet['insights'] == single['insights']
@@ -0,0 +1,130 @@
+import asyncio
+import gzip
+
+from services.s3_ingest import COMPLETED, QUEUED, RUNNING, S3Ingest, S3IngestManager, S3ObjectState
+from services.sqlite_storage import SQLiteStorage
+from services.stub_s3 import StubS3Client
+
+BUCKET = 'logs-bucket'
+
+
+class RecordingS3Client(StubS3Client):
+    """StubS3Client that records the key and range of every GET"""
+
+    def __init__(self):
+        super().__init__()
+        self.gets = []
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.gets.append((Key, Range))
+        return super().get_object(Bucket, Key, Range=Range, **kwargs)
+
+
+def _lines(name, count):
+    return [
+        f'10.0.{name}.{i} - - [10/Oct/2024:13:{i:02d}:00 +0000] "GET /{name}/{i} HTTP/1.1" 200 1 "-" "test"\n'.encode()
+        for i in range(count)
+    ]
+
+
+def _count(storage, name):
+    return asyncio.run(storage.count({'prefix': {'path': f"/{name}/"}}))
+
+
+def _run(manager, ingest_id):
+    """Resume interrupted ingests, as on startup, and wait for one to finish"""
+    async def run():
+        await manager.start()
+        await manager._tasks[ingest_id]
+
+    asyncio.run(run())
+    return manager.ingests[ingest_id]
+
+
+def _setup(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'logs.sqlite3'), 'logs')
+    client = RecordingS3Client()
+    manager = S3IngestManager(storage, 'logs', client=client, state_dir=str(tmp_path / 's3_ingest'), part_size=256)
+    return storage, client, manager
+
+
+def _put(client, key, lines, compress=False):
+    body = b''.join(lines)
+    client.put_object(Bucket=BUCKET, Key=key, Body=gzip.compress(body) if compress else body)
+    head = client.head_object(Bucket=BUCKET, Key=key)
+    return head['ContentLength'], head['ETag']
+
+
+def _save_interrupted(manager, objects):
+    """Write the state an ingest of the prefix had when the process stopped"""
+    ingest = S3Ingest(id=S3Ingest.id_for(BUCKET, 'p/'), bucket=BUCKET, prefix='p/', status=RUNNING, objects=objects)
+    asyncio.run(manager._save(ingest))
+    return ingest.id
+
+
+def test_resumes_from_checkpoints(tmp_path):
+    storage, client, manager = _setup(tmp_path)
+    done_lines, partial_lines, new_lines = _lines(1, 20), _lines(2, 30), _lines(3, 25)
+    done_size, done_etag = _put(client, 'p/done.log', done_lines)
+    partial_size, partial_etag = _put(client, 'p/partial.log', partial_lines)
+    _put(client, 'p/new.log.gz', new_lines, compress=True)
+
+    # done.log was fully ingested and the first 12 lines of partial.log were checkpointed
+    checkpoint = sum(len(line) for line in partial_lines[:12])
+    ingest_id = _save_interrupted(manager, {
+        'p/done.log': S3ObjectState('p/done.log', done_size, done_etag, status=COMPLETED, checkpoint_offset=done_size, checkpoint_entries=20, lines_indexed=20),
+        'p/partial.log': S3ObjectState('p/partial.log', partial_size, partial_etag, status=RUNNING, checkpoint_offset=checkpoint, checkpoint_entries=12, lines_indexed=12),
+    })
+    client.gets.clear()
+
+    ingest = _run(manager, ingest_id)
+
+    assert ingest.status == COMPLETED
+    assert {key: state.status for key, state in ingest.objects.items()} == dict.fromkeys(['p/done.log', 'p/partial.log', 'p/new.log.gz'], COMPLETED)
+    # The completed object isn't read again, and the partial one only from its checkpoint
+    assert all(key != 'p/done.log' for key, _ in client.gets)
+    assert min(int(byte_range[6:].partition('-')[0]) for key, byte_range in client.gets if key == 'p/partial.log') == checkpoint
+    assert _count(storage, 1) == 0
+    assert _count(storage, 2) == 18
+    assert _count(storage, 3) == 25
+    assert ingest.objects['p/partial.log'].lines_indexed == 30
+    assert ingest.objects['p/new.log.gz'].lines_indexed == 25
+
+    # The final state is saved, so running the prefix again has nothing to do
+    reloaded = manager._load(manager._state_path(ingest_id))
+    assert reloaded.status == COMPLETED
+    assert reloaded.objects['p/partial.log'].checkpoint_offset == partial_size
+
+
+def test_replaced_object_is_ingested_again(tmp_path):
+    storage, client, manager = _setup(tmp_path)
+    size, etag = _put(client, 'p/a.log', _lines(4, 10))
+    ingest_id = _save_interrupted(manager, {
+        'p/a.log': S3ObjectState('p/a.log', size, etag, status=COMPLETED, checkpoint_offset=size, checkpoint_entries=10, lines_indexed=10),
+    })
+    # Replaced after the checkpoint, so its checkpoint no longer applies
+    _put(client, 'p/a.log', _lines(5, 15))
+    client.gets.clear()
+
+    ingest = _run(manager, ingest_id)
+
+    assert ingest.status == COMPLETED
+    assert client.gets[0] == ('p/a.log', 'bytes=0-255')
+    assert _count(storage, 5) == 15
+    assert ingest.objects['p/a.log'].lines_indexed == 15
+
+
+def test_compressed_object_restarts_from_the_beginning(tmp_path):
+    storage, client, manager = _setup(tmp_path)
+    lines = _lines(6, 40)
+    size, etag = _put(client, 'p/a.log.gz', lines, compress=True)
+    # A checkpoint can't be resumed from inside a compressed stream
+    ingest_id = _save_interrupted(manager, {
+        'p/a.log.gz': S3ObjectState('p/a.log.gz', size, etag, status=QUEUED, checkpoint_offset=size // 2, checkpoint_entries=20),
+    })
+
+    ingest = _run(manager, ingest_id)
+
+    assert ingest.status == COMPLETED
+    assert ('p/a.log.gz', 'bytes=0-255') in client.gets
+    assert _count(storage, 6) == 40
@@ -0,0 +1,97 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from services.sqlite_storage import SCHEMA, _row, translate
+from services.stub_elastic import StubAsyncElasticsearch
+from services.bulk import serialize
+
+DOCUMENTS = {
+    '1': {'remote_addr': '10.0.0.1', 'request': 'GET /index.html HTTP/1.1', 'status': 200, 'body_bytes_sent': 512,
+          'http_referer': '-', 'http_user_agent': 'Mozilla/5.0 (X11; Linux x86_64)', 'datetime': '2024-10-10T13:00:05',
+          'method': 'GET', 'path': '/index.html', 'protocol': 'HTTP/1.1', 'attack_tags': []},
+    '2': {'remote_addr': '10.0.0.2', 'request': 'GET /wp-admin/?id=1%27%20OR%201=1 HTTP/1.1', 'status': 403, 'body_bytes_sent': 0,
+          'http_referer': '-', 'http_user_agent': 'Googlebot/2.1', 'datetime': '2024-10-10T13:05:00',
+          'method': 'GET', 'path': '/wp-admin/', 'protocol': 'HTTP/1.1', 'attack_tags': ['sql_injection']},
+    '3': {'remote_addr': '10.0.0.1', 'request': 'POST /login HTTP/1.1', 'status': 401, 'body_bytes_sent': 31,
+          'http_referer': 'https://example.com/', 'http_user_agent': 'curl/8.4.0', 'datetime': '2024-10-11T08:30:00',
+          'method': 'POST', 'path': '/login', 'protocol': 'HTTP/1.1', 'attack_tags': ['brute_force', 'sql_injection']},
+    '4': {'remote_addr': '192.168.1.9', 'request': 'GET /etc/passwd HTTP/1.0', 'status': 500, 'body_bytes_sent': 0,
+          'http_referer': None, 'http_user_agent': 'BadBot', 'datetime': '2024-10-12T23:59:59',
+          'method': 'GET', 'path': '/etc/passwd', 'protocol': 'HTTP/1.0', 'attack_tags': ['path_traversal']},
+    '5': {'remote_addr': '10.0.0.3', 'request': 'GET /[brackets] HTTP/1.1', 'status': 404, 'body_bytes_sent': 0,
+          'http_referer': '-', 'http_user_agent': None, 'datetime': '2024-10-12T00:00:00',
+          'method': 'GET', 'path': '/[brackets]', 'protocol': 'HTTP/1.1', 'attack_tags': None},
+}
+
+# Query DSL the dashboard and the API send, one case per supported clause
+QUERIES = [
+    None,
+    {'match_all': {}},
+    {'match_none': {}},
+    {'term': {'remote_addr': '10.0.0.1'}},
+    {'term': {'status': {'value': 403}}},
+    {'terms': {'method': ['POST', 'PUT']}},
+    {'terms': {'status': []}},
+    {'term': {'attack_tags': 'sql_injection'}},
+    {'terms': {'attack_tags': ['path_traversal', 'brute_force']}},
+    {'range': {'status': {'gte': 400, 'lt': 500}}},
+    {'range': {'datetime': {'gte': '2024-10-11T00:00:00', 'lte': '2024-10-12T23:59:59'}}},
+    {'range': {'datetime': {'gt': '2024-10-10T13:00:05Z'}}},
+    {'wildcard': {'path': '/wp-*'}},
+    {'wildcard': {'http_user_agent': {'value': '*bot*', 'case_insensitive': True}}},
+    {'wildcard': {'path': '/[brackets]'}},
+    {'prefix': {'path': '/etc'}},
+    {'exists': {'field': 'http_user_agent'}},
+    {'match': {'http_user_agent.text': 'googlebot'}},
+    {'match_phrase': {'request': {'query': 'OR 1=1'}}},
+    {'bool': {'must': [{'term': {'method': 'GET'}}], 'must_not': [{'range': {'status': {'gte': 400}}}]}},
+    {'bool': {'filter': {'term': {'remote_addr': '10.0.0.1'}}, 'should': [{'term': {'status': 401}}]}},
+    {'bool': {'should': [{'term': {'status': 200}}, {'prefix': {'path': '/etc'}}]}},
+    {'bool': {'should': [{'term': {'method': 'GET'}}, {'range': {'status': {'gte': 400}}}], 'minimum_should_match': 2}},
+    {'bool': {'must_not': {'exists': {'field': 'http_referer'}}}},
+]
+
+
+@pytest.fixture(scope='module')
+def stub():
+    client = StubAsyncElasticsearch(reject_rate=0.0, request_reject_rate=0.0, max_concurrent_bulks=0)
+    operations = []
+    for doc_id, source in DOCUMENTS.items():
+        operations += [serialize({'index': {'_index': f"logs-{source['datetime'][:10].replace('-', '.')}", '_id': doc_id}}), serialize(source)]
+    asyncio.run(client.bulk(operations=operations))
+    return client
+
+
+@pytest.fixture(scope='module')
+def connection():
+    connection = sqlite3.connect(':memory:')
+    connection.executescript(SCHEMA)
+    connection.executemany(
+        f"INSERT INTO logs VALUES ({', '.join('?' * len(_row('logs', '', {})))})",
+        [_row('logs', doc_id, source) for doc_id, source in DOCUMENTS.items()]
+    )
+    return connection
+
+
+@pytest.mark.parametrize('query', QUERIES, ids=lambda query: next(iter(query)) if query else 'none')
+def test_translate_matches_stub(stub, connection, query):
+    response = asyncio.run(stub.search(index='logs-*', query=query, size=len(DOCUMENTS)))
+    expected = sorted(hit['_id'] for hit in response['hits']['hits'])
+
+    sql, params = translate(query)
+    matched = sorted(doc_id for doc_id, in connection.execute(f"SELECT doc_id FROM logs WHERE {sql}", params))
+
+    assert matched == expected
+
+
+@pytest.mark.parametrize('query', [
+    {'geo_distance': {'distance': '1km', 'location': [0, 0]}},
+    {'term': {'not_a_field': 'x'}},
+    {'range': {'datetime': {'gte': 'now-1d/d'}}},
+    {'term': {'status': 1, 'method': 'GET'}},
+])
+def test_translate_rejects_unsupported(query):
+    with pytest.raises(ValueError):
+        translate(query)
@@ -1,13 +1,44 @@
+"use client";
+
+import { useEffect, useState } from "react";
 import { Card, CardContent } from "@/components/ui/card";
 import { LogAnalysisReport } from "@/types";
 import { Separator } from "@/components/ui/separator";
+import { getAnalysisSummary } from "@/services/analysis";
+
+const SUMMARY_POLL_INTERVAL_MS = 2000;
 
 interface KeyInsightsProps {
   report: LogAnalysisReport;
 }
 
 export default function KeyInsights({ report }: KeyInsightsProps) {
-  const points = report.summary?.split("\n").filter((point) => point.trim()) || [];
+  const [summary, setSummary] = useState(report.summary);
+  const [pending, setPending] = useState(!report.summary && !!report.summary_id);
+
+  // The summary is generated in the background, so poll until it is ready
+  useEffect(() => {
+    if (report.summary || !report.summary_id) return;
+
+    let cancelled = false;
+    const poll = async () => {
+      const result = await getAnalysisSummary(report.summary_id!);
+      if (cancelled) return;
+      if (result?.status === "pending") {
+        setTimeout(poll, SUMMARY_POLL_INTERVAL_MS);
+        return;
+      }
+      setSummary(result?.summary ?? null);
+      setPending(false);
+    };
+    poll();
+
+    return () => {
+      cancelled = true;
+    };
+  }, [report.summary, report.summary_id]);
+
+  const points = summary?.split("\n").filter((point) => point.trim()) || [];
 
   return (
     <div className="h-full flex flex-col gap-2">
@@ -27,7 +58,9 @@ export default function KeyInsights({ report }: KeyInsightsProps) {
               ))}
             </div>
           ) : (
-            <div className="text-sm text-gray-500">No summary available</div>
+            <div className="text-sm text-gray-500">
+              {pending ? "Generating summary..." : "No summary available"}
+            </div>
           )}
         </CardContent>
       </Card>
@@ -12,3 +12,19 @@ export async function getLogAnalysisReport(query: any): Promise<LogAnalysisRepor
     return null;
   }
 }
+
+export interface AnalysisSummary {
+  key: string;
+  status: "ready" | "pending" | "failed" | "unknown";
+  summary: string | null;
+}
+
+export async function getAnalysisSummary(summaryId: string): Promise<AnalysisSummary | null> {
+  try {
+    const response = await axios.get(NEXT_PUBLIC_API_ENDPOINT + "/summary/" + summaryId);
+    return response.data as AnalysisSummary;
+  } catch (error) {
+    console.error("Error fetching summary:", error);
+    return null;
+  }
+}
@@ -3,6 +3,36 @@ import client from "../helpers/elasticsearch";
 
 const index = process.env.ELASTIC_INDEX as string;
 
+// The API writes logs to one index per day, `${index}-YYYY.MM.DD`, named after the
+// entry's own timestamp. Searches cover every daily index.
+const indexPattern = `${index}-*`;
+
+// Name of the daily index a log entry belongs in; entries without a readable
+// timestamp go in today's index, as they do when the API ingests them
+const dailyIndex = (datetime?: string) => {
+  const parsed = datetime ? new Date(datetime) : new Date(NaN);
+  const when = isNaN(parsed.getTime()) ? new Date() : parsed;
+  const pad = (value: number) => String(value).padStart(2, "0");
+  return `${index}-${when.getFullYear()}.${pad(when.getMonth() + 1)}.${pad(when.getDate())}`;
+};
+
+// Find the daily index holding a log entry
+const findLogIndex = async (id: string) => {
+  const response = await client.search({
+    index: indexPattern,
+    query: { ids: { values: [id] } },
+    size: 1,
+    _source: false,
+    ignore_unavailable: true,
+    allow_no_indices: true,
+  });
+  const hit = response.hits.hits[0];
+  if (!hit) {
+    throw new Error(`Log entry ${id} not found`);
+  }
+  return hit._index;
+};
+
 // Define the mapping for NGINX log entries
 const mapping = {
   properties: {
@@ -13,7 +43,7 @@ const mapping = {
     status: { type: "integer" as const },
     body_bytes_sent: { type: "long" as const },
     http_referer: { type: "keyword" as const },
-    http_user_agent: { type: "text" as const },
+    http_user_agent: { type: "keyword" as const, fields: { text: { type: "text" as const } } },
     datetime: { type: "date" as const },
     method: { type: "keyword" as const },
     path: { type: "keyword" as const },
@@ -24,7 +54,7 @@ const mapping = {
 // Create a new log entry
 export const createLogEntry = async (logEntry: Record<string, any>) => {
   return await client.index({
-    index,
+    index: dailyIndex(logEntry.datetime),
     document: logEntry,
     refresh: true,
   });
@@ -36,9 +66,11 @@ export const getLogEntries = async (
   size: number = 10000
 ): Promise<LogEntry[]> => {
   const response = await client.search({
-    index,
+    index: indexPattern,
     query,
     size,
+    ignore_unavailable: true,
+    allow_no_indices: true,
   });
 
   return response.hits.hits.map((hit) => hit._source as LogEntry);
@@ -47,7 +79,7 @@ export const getLogEntries = async (
 // Update a log entry
 export const updateLogEntry = async (id: string, updates: Record<string, any>) => {
   return await client.update({
-    index,
+    index: await findLogIndex(id),
     id,
     doc: updates,
     refresh: true,
@@ -57,7 +89,7 @@ export const updateLogEntry = async (id: string, updates: Record<string, any>) =
 // Delete a log entry
 export const deleteLogEntry = async (id: string) => {
   return await client.delete({
-    index,
+    index: await findLogIndex(id),
     id,
     refresh: true,
   });
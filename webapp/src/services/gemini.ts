@@ -14,7 +14,7 @@ The query should be in JSON format and use the following fields:
 - path: keyword field for request paths
 - method: keyword field for HTTP methods
 - remote_addr: ip field for client IP addresses
-- http_user_agent: text field for user agents
+- http_user_agent: keyword field for exact user agents (use http_user_agent.text for full-text matches)
 
 The current date is ${new Date().toISOString()}.
 
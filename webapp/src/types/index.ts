@@ -18,6 +18,7 @@ export interface LogAnalysisReport {
   blacklist_occurance: string[];
   request_counts: Record<string, number>;
   high_frequency_ips: Record<string, number>;
+  high_frequency_ips_approximate?: boolean;
   suspicious_user_agents: any;
   sensitive_endpoint_access: Record<string, number>;
   burst_requests: Record<string, number>;
@@ -34,7 +35,8 @@ export interface LogAnalysisReport {
   path_counts: Record<string, number>;
   bot_vs_human_traffic: any;
   insights: string[];
-  summary: string;
+  summary: string | null;
+  summary_id?: string;
   map_markers: Array<{
     id: string;
     latitude: number;